@@ -0,0 +1 @@
+from benchmarks.suite import runBenchmarks, compareResults, saveResults, loadResults, BENCHMARKS, SIZES
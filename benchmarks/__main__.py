@@ -0,0 +1,37 @@
+import argparse
+import sys
+from benchmarks.suite import runBenchmarks, compareResults, saveResults, loadResults, BENCHMARKS, SIZES
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description="Runs the layer and pipeline benchmarks from fixed seeds.")
+    parser.add_argument('--benchmark', action='append', choices=list(BENCHMARKS),
+                        help="benchmark to run; may be repeated (default: all)")
+    parser.add_argument('--size', action='append', choices=list(SIZES),
+                        help="size to run; may be repeated (default: all)")
+    parser.add_argument('--steps', type=int, help="number of steps of each benchmark (default: per size)")
+    parser.add_argument('--seed', type=int, default=42, help="seed of the random generators (default: 42)")
+    parser.add_argument('--output', help="path of the JSON file to write the results to")
+    parser.add_argument('--baseline', help="path of a JSON results file to compare throughput against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="fraction of baseline throughput that may be lost (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(args.benchmark, args.size, args.seed, args.steps, log=print)
+    if args.output:
+        saveResults(args.output, results)
+
+    if args.baseline:
+        regressions = 0
+        for row in compareResults(results, loadResults(args.baseline), args.tolerance):
+            regressions += row['regression']
+            print('%-24s %-10s %10.1f -> %10.1f steps/s  x%.2f%s' % (
+                row['name'], row['size'] or '-', row['baseline_steps_per_sec'], row['steps_per_sec'], row['ratio'],
+                '  REGRESSION' if row['regression'] else ''))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
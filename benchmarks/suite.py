@@ -0,0 +1,261 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from sdr import SDR
+from encoders.unicode import UnicodeEncoder
+from layers import SpatialPooler, TopologyPooler, TemporalMemory, Connections, FeedForwardClassifier
+from layers.classifier import Classifier
+
+FORMAT_VERSION = 1
+
+# layer sizes; production matches the deployed model
+SIZES = {
+    'small': {'columnDim': 256, 'numActiveCols': 10, 'cellsPerColumn': 8, 'steps': 600},
+    'medium': {'columnDim': 1024, 'numActiveCols': 20, 'cellsPerColumn': 16, 'steps': 400},
+    'production': {'columnDim': 2048, 'numActiveCols': 40, 'cellsPerColumn': 32, 'steps': 200},
+}
+
+# fraction of the steps run before latencies are recorded
+_WARMUP = 0.1
+
+_TEXT = ("The quick brown fox jumps over the lazy dog. Sphinx of black quartz, judge my vow! "
+         "Pack my box with five dozen liquor jugs; how vexingly quick daft zebras jump. "
+         "Ünïcödé çhåràctérs — and digits 0123456789 — appear in real text streams too.\n")
+
+
+def _writeLookup(directory, seed):
+    """Writes a reproducible character lookup for the characters of the benchmark text and returns its path"""
+    rng = np.random.RandomState(seed)
+    width, numBits = 2048, 37
+    lookup = {str(ord(char)): sorted(rng.choice(width, numBits, replace=False).tolist()) for char in sorted(set(_TEXT))}
+    path = os.path.join(directory, 'chars.json')
+    with open(path, 'w') as fo:
+        json.dump(lookup, fo)
+    return path
+
+
+def _temporalMemory(size, seed):
+    """Constructs a Temporal Memory with thresholds scaled to the number of active columns"""
+    w = size['numActiveCols']
+    return TemporalMemory(Connections, size['columnDim'], size['cellsPerColumn'], 32, 64,
+                          max(w // 4, 2), max(w // 3, 3), 0.5, 0.55, max(w // 2, 4), 0.1, 0.05, seed=seed)
+
+
+def _sequence(width, numActive, length, rng):
+    """Returns a repeating sequence of random SDRs"""
+    return [SDR(width, sparse=rng.choice(width, numActive, replace=False)) for i in range(length)]
+
+
+def _encoderBenchmark(size, seed, directory):
+    encoder = UnicodeEncoder(_writeLookup(directory, seed), os.path.join(directory, 'chars.bin'))
+    encoder.encodeIntoBits(_TEXT[0])
+    text = _TEXT * (size['steps'] // len(_TEXT) + 1)
+    return lambda t: encoder.encodeIntoBits(text[t])
+
+
+def _encoderBatchBenchmark(size, seed, directory):
+    encoder = UnicodeEncoder(_writeLookup(directory, seed), os.path.join(directory, 'chars.bin'))
+    encoder.encodeIntoBits(_TEXT[0])
+    return lambda t: encoder.encodeBatch(_TEXT)
+
+
+def _spatialPoolerBenchmark(size, seed, directory):
+    rng = np.random.RandomState(seed)
+    sp = SpatialPooler(2048, size['columnDim'], size['numActiveCols'], seed=seed)
+    inputs = _sequence(2048, 37, 50, rng)
+    return lambda t: sp.compute(inputs[t % len(inputs)], learn=True)
+
+
+def _spatialPoolerBatchBenchmark(size, seed, directory):
+    rng = np.random.RandomState(seed)
+    sp = SpatialPooler(2048, size['columnDim'], size['numActiveCols'], seed=seed)
+    inputs = _sequence(2048, 37, 64, rng)
+    return lambda t: sp.compute_batch(inputs)
+
+
+def _topologyPoolerBenchmark(size, seed, directory):
+    rng = np.random.RandomState(seed)
+    tp = TopologyPooler((64, 64), (64, 64), seed=seed)
+    inputs = [rng.random_sample((64, 64)) < 0.1 for i in range(50)]
+    return lambda t: tp.compute(inputs[t % len(inputs)], learn=True)
+
+
+def _temporalMemoryBenchmark(size, seed, directory):
+    rng = np.random.RandomState(seed)
+    tm = _temporalMemory(size, seed)
+    inputs = _sequence(size['columnDim'], size['numActiveCols'], 25, rng)
+    return lambda t: tm.compute(inputs[t % len(inputs)], learn=True)
+
+
+def _feedForwardClassifierBenchmark(size, seed, directory):
+    rng = np.random.RandomState(seed)
+    n = size['columnDim'] * size['cellsPerColumn']
+    classifier = FeedForwardClassifier(n, 0.1)
+    inputs = _sequence(n, size['numActiveCols'], 25, rng)
+
+    def step(t):
+        classifier.record(t % 30, inputs[t % len(inputs)])
+        classifier.infer(inputs[t % len(inputs)])
+    return step
+
+
+def _classifierBenchmark(size, seed, directory):
+    rng = np.random.RandomState(seed)
+    n = size['columnDim'] * size['cellsPerColumn']
+    classifier = Classifier(n, 0.1)
+    inputs = _sequence(n, size['numActiveCols'], 25, rng)
+
+    def step(t):
+        classifier.record(t % 30, inputs[t % len(inputs)])
+        classifier.infer(inputs[t % len(inputs)])
+    return step
+
+
+def _pipelineBenchmark(size, seed, directory):
+    encoder = UnicodeEncoder(_writeLookup(directory, seed), os.path.join(directory, 'chars.bin'))
+    sp = SpatialPooler(encoder.getWidth(), size['columnDim'], size['numActiveCols'], seed=seed, sparse=True)
+    tm = _temporalMemory(size, seed)
+    classifier = FeedForwardClassifier(tm.getWidth(), 0.1)
+    text = _TEXT * (size['steps'] // len(_TEXT) + 2)
+
+    def step(t):
+        activeCells, _ = tm.compute(sp.compute(encoder.encode(text[t]), learn=True), learn=True)
+        classifier.record(text[t], activeCells)
+        classifier.infer(activeCells)
+    return step
+
+
+# name -> (constructor of the step function, whether the benchmark runs at every size);
+# a step of the batch benchmarks is a whole batch: the benchmark text or 64 inputs
+BENCHMARKS = {
+    'unicode_encoder': (_encoderBenchmark, False),
+    'unicode_encoder_batch': (_encoderBatchBenchmark, False),
+    'spatial_pooler': (_spatialPoolerBenchmark, True),
+    'spatial_pooler_batch': (_spatialPoolerBatchBenchmark, True),
+    'topology_pooler': (_topologyPoolerBenchmark, False),
+    'temporal_memory': (_temporalMemoryBenchmark, True),
+    'feed_forward_classifier': (_feedForwardClassifierBenchmark, True),
+    'classifier': (_classifierBenchmark, True),
+    'pipeline': (_pipelineBenchmark, True),
+}
+
+
+def _runBenchmark(makeStep, size, seed, steps):
+    """
+    Runs a benchmark twice from the same seed: once timing each step, and once tracing memory
+    allocations, so that tracing does not slow down the timed run
+    :return: tuple of step latencies in seconds and peak traced memory in bytes
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        np.random.seed(seed)
+        step = makeStep(size, seed, directory)
+        latencies = np.zeros(steps)
+        for t in range(steps):
+            start = time.perf_counter()
+            step(t)
+            latencies[t] = time.perf_counter() - start
+
+        tracemalloc.start()
+        try:
+            np.random.seed(seed)
+            step = makeStep(size, seed, directory)
+            for t in range(steps):
+                step(t)
+            _, peakMemory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return latencies[int(steps * _WARMUP):], peakMemory
+
+
+def runBenchmarks(names=None, sizes=None, seed=42, steps=None, log=None):
+    """
+    Runs benchmarks from fixed seeds and returns their results
+    :param names: (default=None) names of benchmarks to run, see BENCHMARKS; None runs all
+    :param sizes: (default=None) names of sizes to run, see SIZES; None runs all
+    :param seed: (default=42) seed of the random generators
+    :param steps: (default=None) number of steps of each benchmark; None uses the steps of each size
+    :param log: (default=None) function called with a line of text after each benchmark
+    :return: dict with the environment under 'meta' and a list of results under 'results'
+    """
+    names = list(BENCHMARKS) if names is None else names
+    sizes = list(SIZES) if sizes is None else sizes
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark %s. Expecting one of %s" % (name, ', '.join(BENCHMARKS)))
+    for sizeName in sizes:
+        if sizeName not in SIZES:
+            raise ValueError("Unknown size %s. Expecting one of %s" % (sizeName, ', '.join(SIZES)))
+
+    results = []
+    for name in names:
+        makeStep, sized = BENCHMARKS[name]
+        for sizeName in (sizes if sized else sizes[:1]):
+            size = SIZES[sizeName]
+            numSteps = size['steps'] if steps is None else steps
+            latencies, peakMemory = _runBenchmark(makeStep, size, seed, numSteps)
+            result = {'name': name, 'size': sizeName if sized else None,
+                      'params': {key: value for key, value in size.items() if key != 'steps'} if sized else {},
+                      'steps': numSteps,
+                      'steps_per_sec': len(latencies) / float(np.sum(latencies)),
+                      'p50_ms': float(np.percentile(latencies, 50)) * 1000.0,
+                      'p99_ms': float(np.percentile(latencies, 99)) * 1000.0,
+                      'peak_memory_bytes': int(peakMemory)}
+            results.append(result)
+            if log is not None:
+                log(_formatResult(result))
+
+    meta = {'format_version': FORMAT_VERSION, 'seed': seed, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    return {'meta': meta, 'results': results}
+
+
+def compareResults(results, baseline, tolerance=0.1):
+    """
+    Compares the throughput of benchmark results with the results of a baseline run with the same
+    benchmark, size and number of steps
+    :param results: results returned by :func:`.runBenchmarks`
+    :param baseline: results of the baseline run
+    :param tolerance: (default=0.1) fraction of baseline throughput that may be lost before a
+        benchmark counts as a regression
+    :return: list of dicts with name, size, baseline and current steps/sec, their ratio and whether it regressed
+    """
+    baselineResults = {(result['name'], result['size'], result['steps']): result for result in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        key = (result['name'], result['size'], result['steps'])
+        if key not in baselineResults:
+            continue
+        ratio = result['steps_per_sec'] / baselineResults[key]['steps_per_sec']
+        comparison.append({'name': result['name'], 'size': result['size'],
+                           'baseline_steps_per_sec': baselineResults[key]['steps_per_sec'],
+                           'steps_per_sec': result['steps_per_sec'], 'ratio': ratio,
+                           'regression': ratio < 1.0 - tolerance})
+    return comparison
+
+
+def _formatResult(result):
+    """Returns a line of text describing a benchmark result"""
+    return '%-24s %-10s %10.1f steps/s  p50 %8.3f ms  p99 %8.3f ms  peak %8.1f MiB' % (
+        result['name'], result['size'] or '-', result['steps_per_sec'], result['p50_ms'], result['p99_ms'],
+        result['peak_memory_bytes'] / 2.0 ** 20)
+
+
+def saveResults(path, results):
+    """Writes benchmark results to a JSON file"""
+    with open(path, 'w') as fo:
+        json.dump(results, fo, indent=2, sort_keys=True)
+
+
+def loadResults(path):
+    """Reads benchmark results written by :func:`.saveResults`"""
+    with open(path, 'r') as fi:
+        return json.load(fi)
@@ -6,6 +6,14 @@ class Encoder(object):
     def __init__(self):
         pass
 
+    def encode(self, inputData):
+        """
+        
+        :param inputData: 
+        :return: SDR
+        """
+        pass
+
     def encodeIntoArray(self, inputData, outputArray):
         """
         
@@ -1,5 +1,63 @@
 import json
+import os
 import numpy as np
+from sdr import SDR
+from utils.arrays import concatenateRanges
+from utils.files import writeCheckpoint, readCheckpoint
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+LOOKUP_SOURCE = os.path.join(DATA_DIR, 'chars.json')
+LOOKUP_TABLE = os.path.join(DATA_DIR, 'chars.bin')
+
+# lookup tables shared by all encoders, by path of the compiled table
+_tables = {}
+
+
+def compileLookup(sourcePath=LOOKUP_SOURCE, tablePath=LOOKUP_TABLE):
+    """
+    Compiles the JSON character lookup into a binary table in CSR form: the ON bits of codepoint c
+    are bits[offsets[c]:offsets[c + 1]].
+    :param sourcePath: path of the JSON lookup mapping codepoints to lists of ON bits
+    :param tablePath: path of the compiled table, or None to only compile in memory
+    :return: tuple of offsets and bits arrays
+    """
+    with open(sourcePath, 'r') as fi:
+        lookup = {int(key): val for key, val in json.load(fi).items()}
+
+    lengths = np.zeros(max(lookup) + 2 if lookup else 1, dtype=np.uint32)
+    for code, bits in lookup.items():
+        lengths[code + 1] = len(bits)
+    offsets = np.cumsum(lengths, dtype=np.uint32)
+    bits = np.zeros(offsets[-1], dtype=np.uint16)
+    for code, codeBits in lookup.items():
+        bits[offsets[code]:offsets[code + 1]] = sorted(codeBits)
+
+    if tablePath is not None:
+        writeCheckpoint(tablePath, {'source': os.path.basename(sourcePath)}, {'offsets': offsets, 'bits': bits})
+    return offsets, bits
+
+
+def _loadLookup(sourcePath, tablePath):
+    """
+    Returns the offsets and bits of the compiled lookup table, memory-mapped and shared by all encoders.
+    The table is compiled from the JSON lookup when it is missing or older than the JSON lookup.
+    """
+    try:
+        return _tables[tablePath]
+    except KeyError:
+        pass
+
+    if not os.path.exists(tablePath) or (os.path.exists(sourcePath) and
+                                         os.path.getmtime(sourcePath) > os.path.getmtime(tablePath)):
+        try:
+            compileLookup(sourcePath, tablePath)
+        except OSError:
+            _tables[tablePath] = compileLookup(sourcePath, None)
+            return _tables[tablePath]
+
+    _, arrays = readCheckpoint(tablePath)
+    _tables[tablePath] = arrays['offsets'], arrays['bits']
+    return _tables[tablePath]
 
 
 class UnicodeEncoder(object):
@@ -8,12 +66,17 @@ class UnicodeEncoder(object):
     such that semantically similar characters have overlap.
     """
 
-    def __init__(self):
+    def __init__(self, sourcePath=LOOKUP_SOURCE, tablePath=LOOKUP_TABLE):
+        """
+        Constructs a Unicode encoder. The lookup table is loaded on first use.
+        :param sourcePath: path of the JSON lookup mapping codepoints to lists of ON bits
+        :param tablePath: path of the compiled lookup table
+        """
         self._n = 2048
         self._w = 37
-        with open('encoders/data/chars.json', 'r') as fi:
-            lookup = json.load(fi)
-        self._lookup = {int(key): val for key, val in lookup.items()}
+        self._sourcePath = sourcePath
+        self._tablePath = tablePath
+        self._sdrs = {}
 
     def encodeIntoArray(self, inputData, outputArray):
         """
@@ -30,16 +93,69 @@ class UnicodeEncoder(object):
         outputArray[:] = 0
         outputArray[self.encodeIntoBits(inputData)] = 1
 
+    def encode(self, inputData):
+        """
+        Encodes inputData into an SDR of width returned by :meth:`.getWidth`.
+        The SDR of each character is created once and shared by later calls.
+        :param inputData: The data to encode (must be a string of length 1)
+        :return: SDR
+        """
+        if not isinstance(inputData, str):
+            raise TypeError("Expected a string or unicode but got input of type %s" % type(inputData))
+        if len(inputData) != 1:
+            raise ValueError("Expected a string of length 1")
+        code = ord(inputData)
+        try:
+            return self._sdrs[code]
+        except KeyError:
+            sdr = self._sdrs[code] = SDR(self._n, sparse=self.encodeIntoBits(inputData))
+            return sdr
+
     def encodeIntoBits(self, inputData):
         """
         Encodes inputData and generates a list of ON bits in a 1-D array of length returned by :meth:`.getWidth`.
         :param inputData: The data to encode (must be a string of length 1)
         :return: A list of integers (indices of ON bits in 1-D array of length returned by :meth:`.getWidth`.)
         """
-        try:
-            return self._lookup[ord(inputData)]
-        except KeyError:
+        offsets, bits = _loadLookup(self._sourcePath, self._tablePath)
+        code = ord(inputData)
+        if code + 1 >= len(offsets):
             return []
+        return bits[offsets[code]:offsets[code + 1]].tolist()
+
+    def encodeBatch(self, inputData, out=None):
+        """
+        Encodes every character of inputData in one call
+        :param inputData: The data to encode (a string)
+        :param out: (default=None) numpy int64 array to write the ON bits into if it is long enough, so a
+            caller encoding many strings can reuse one buffer; the returned bits are then a view of out
+        :return: tuple of offsets and bits arrays; the ON bits of character i are bits[offsets[i]:offsets[i + 1]]
+        """
+        if not isinstance(inputData, str):
+            raise TypeError("Expected a string or unicode but got input of type %s" % type(inputData))
+        offsets, bits = _loadLookup(self._sourcePath, self._tablePath)
+        codes = np.frombuffer(inputData.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.int64)
+        codes[codes + 1 >= len(offsets)] = len(offsets) - 1  # unknown characters have no ON bits
+        starts = offsets[codes].astype(np.int64)
+        stops = offsets[np.minimum(codes + 1, len(offsets) - 1)].astype(np.int64)
+        charOffsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        charOffsets[1:] = np.cumsum(stops - starts)
+        numBits = int(charOffsets[-1])
+        if out is None or len(out) < numBits:
+            out = np.empty(numBits, dtype=np.int64)
+        out[:numBits] = bits[concatenateRanges(starts, stops)]
+        return charOffsets, out[:numBits]
+
+    def encodeString(self, inputData):
+        """
+        Encodes every character of inputData in one call
+        :param inputData: The data to encode (a string)
+        :return: numpy int8 array of shape (len(inputData), n) with n returned by :meth:`.getWidth`.
+        """
+        charOffsets, bits = self.encodeBatch(inputData)
+        encoded = np.zeros((len(charOffsets) - 1, self._n), dtype=np.int8)
+        encoded[np.repeat(np.arange(len(charOffsets) - 1), np.diff(charOffsets)), bits] = 1
+        return encoded
 
     def getWidth(self):
         """
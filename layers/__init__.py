@@ -1,5 +1,10 @@
 from layers.spatial_pooler import SpatialPooler
+from layers.topology_pooler import TopologyPooler
 from layers.tm_cell import TMCell
-from layers.temporal_memory import TemporalMemory
+from layers.temporal_memory import TemporalMemory, StreamState
 from layers.feed_forward_classifier import FeedForwardClassifier
-from layers.basic_cell import BasicTMCell
\ No newline at end of file
+from layers.basic_cell import BasicTMCell
+from layers.connections import Connections
+from layers.anomaly import AnomalyLikelihood
+from layers.sharded_connections import ShardedConnections
+from layers.checkpoint import saveModel, loadModel
\ No newline at end of file
@@ -0,0 +1,107 @@
+import numpy as np
+
+# lower bound of the variance of the averaged anomaly scores, so a perfectly stable history does
+# not make the smallest change look certain
+_MIN_VARIANCE = 1.5e-5
+
+
+def _normalCdf(z):
+    """Returns the standard normal cumulative distribution of z, elementwise (absolute error below 1.5e-7)"""
+    x = np.abs(z) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    erfc = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erfc = erfc * np.exp(-x * x)
+    return np.where(z >= 0, 1.0 - 0.5 * erfc, 0.5 * erfc)
+
+
+class AnomalyLikelihood:
+    """
+    Estimates how unusual the recent raw anomaly scores of a metric are given their history. Raw
+    scores are averaged over a short window and the averages are modelled as a normal distribution
+    estimated from a long rolling window; the likelihood is the probability of an average lower than
+    the current one, so values close to 1 flag anomalies.
+
+    The windows are ring buffers with running sums, so each step costs O(1) per metric whatever the
+    window sizes. The sums are recomputed from the buffers each time a buffer wraps to keep rounding
+    errors from accumulating. Several metrics can be estimated at once by passing arrays of scores.
+    """
+
+    def __init__(self, windowSize=1000, averagingWindow=10, learningPeriod=None, numMetrics=None):
+        """
+        Constructs an anomaly likelihood estimator
+        :param windowSize: (default=1000) number of recent averaged scores the distribution is estimated from
+        :param averagingWindow: (default=10) number of recent raw scores averaged at each step
+        :param learningPeriod: (default=None) number of first steps for which the likelihood is 0.5
+            while the distribution is estimated; None uses a tenth of windowSize, at least averagingWindow
+        :param numMetrics: (default=None) number of metrics estimated at once; None estimates one metric
+            from scalar scores
+        """
+        if windowSize < 2:
+            raise ValueError("Window size must be greater than 1")
+        if averagingWindow < 1 or averagingWindow > windowSize:
+            raise ValueError("Averaging window must be between 1 and %d but got %d" % (windowSize, averagingWindow))
+
+        self._windowSize = windowSize
+        self._averagingWindow = averagingWindow
+        self._learningPeriod = max(windowSize // 10, averagingWindow) if learningPeriod is None else learningPeriod
+        self._numMetrics = numMetrics
+        shape = () if numMetrics is None else (numMetrics,)
+        self._rawScores = np.zeros((averagingWindow,) + shape)
+        self._rawSum = np.zeros(shape)
+        self._averages = np.zeros((windowSize,) + shape)
+        self._averageSum = np.zeros(shape)
+        self._averageSquares = np.zeros(shape)
+        self._time = 0
+
+    def compute(self, anomalyScore):
+        """
+        Adds the raw anomaly score of the current step and returns its anomaly likelihood
+        :param anomalyScore: raw anomaly score, see :meth:`layers.temporal_memory.TemporalMemory.compute`,
+            or array of one score for each metric
+        :return: likelihood between 0 and 1, or numpy array of one likelihood for each metric
+        """
+        score = np.asarray(anomalyScore, dtype=np.float64)
+        if score.shape != self._rawSum.shape:
+            raise ValueError("Expecting scores of shape %s but got %s" % (self._rawSum.shape, score.shape))
+
+        # short window of raw scores
+        index = self._time % self._averagingWindow
+        self._rawSum += score - self._rawScores[index]
+        self._rawScores[index] = score
+        if index == self._averagingWindow - 1:
+            self._rawSum = np.sum(self._rawScores, axis=0)
+        average = self._rawSum / min(self._time + 1, self._averagingWindow)
+
+        # long window of averaged scores
+        index = self._time % self._windowSize
+        previous = self._averages[index]
+        self._averageSum += average - previous
+        self._averageSquares += average * average - previous * previous
+        self._averages[index] = average
+        if index == self._windowSize - 1:
+            self._averageSum = np.sum(self._averages, axis=0)
+            self._averageSquares = np.sum(self._averages * self._averages, axis=0)
+        self._time += 1
+
+        if self._time <= self._learningPeriod:
+            likelihood = np.full(score.shape, 0.5)
+        else:
+            count = min(self._time, self._windowSize)
+            mean = self._averageSum / count
+            variance = np.maximum(self._averageSquares / count - mean * mean, _MIN_VARIANCE)
+            likelihood = _normalCdf((average - mean) / np.sqrt(variance))
+        return float(likelihood) if self._numMetrics is None else likelihood
+
+    @staticmethod
+    def logLikelihood(likelihood):
+        """
+        Returns the likelihood on a logarithmic scale between 0 and 1, which spreads out the likelihoods
+        close to 1 that matter when thresholding
+        :param likelihood: likelihood or numpy array of likelihoods returned by :meth:`.compute`
+        :return: float or numpy array
+        """
+        return np.log(1.0000000001 - np.asarray(likelihood)) / np.log(1.0 - 0.9999999999)
+
+    def reset(self):
+        """Forgets the history of scores"""
+        self.__init__(self._windowSize, self._averagingWindow, self._learningPeriod, self._numMetrics)
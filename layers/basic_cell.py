@@ -28,12 +28,21 @@ class BasicTMCell(TMCell):
         self._segmentPermanences = []
         self._activeSegments = []
         self._matchingSegments = []
+        # iteration of the last activation, adaptation or creation of each segment
+        self._lastUsed = []
+        self._iteration = 0
 
     def activateSegments(self, activeCells):
         """
         Using current active cells find cell's segment activity
         :param activeCells: List of indices of active cells in region
         """
+        self._iteration += 1
+        # segments that lost all their synapses are removed
+        for segment in reversed(range(len(self._segmentPermanences))):
+            if not np.any(self._segmentPermanences[segment] > 0):
+                del self._segmentPermanences[segment]
+                del self._lastUsed[segment]
         if len(self._segmentPermanences):
             activeStates = np.zeros(self._regionDim, dtype=np.int8).flatten()
             activeStates[activeCells] = 1
@@ -41,9 +50,14 @@ class BasicTMCell(TMCell):
 
             connectedSynapses = (np.array(self._segmentPermanences) >= self._minPermanence) * activeStates
             self._activeSegments = np.nonzero(np.sum(connectedSynapses, axis=(1, 2)) >= self._activationThreshold)[0]
+            for segment in self._activeSegments:
+                self._lastUsed[segment] = self._iteration
 
             matchingSynapses = (np.array(self._segmentPermanences) > 0) * activeStates
             self._matchingSegments = np.nonzero(np.sum(matchingSynapses, axis=(1, 2)) >= self._minActive)[0]
+        else:
+            self._activeSegments = []
+            self._matchingSegments = []
 
     def adaptSegment(self, segment, previousCells, maxNewSynapses, initialPermanence,
                      permanenceInc, permanenceDec):
@@ -57,21 +71,14 @@ class BasicTMCell(TMCell):
         :param permanenceDec: (float) value to decrement inactive synapses
         """
 
-        updates = np.full(self._regionDim, permanenceDec, dtype=np.int8).flatten()
+        updates = np.full(self._regionDim, -permanenceDec, dtype=np.float32).flatten()
         updates[previousCells] = permanenceInc
         updates = np.multiply(updates.reshape(self._regionDim), (self._segmentPermanences[segment] > 0))
 
         self._segmentPermanences[segment] = np.clip(self._segmentPermanences[segment] + updates, 0.0, 1.0)
+        self._lastUsed[segment] = self._iteration
 
-        activeSynapsesCount = np.count_nonzero(updates > 0)
-        newSynapsesCount = maxNewSynapses - activeSynapsesCount
-        if newSynapsesCount > 0:
-            eligibleSynapses = np.logical_and(updates > 0, self._segmentPermanences[segment] == 0)
-            eligibleSynapses = np.transpose(np.nonzero(eligibleSynapses))
-            if len(eligibleSynapses):
-                np.random.shuffle(eligibleSynapses)
-                for i in range(newSynapsesCount):
-                    self._segmentPermanences[segment][eligibleSynapses[i]] = initialPermanence
+        self.addSynapses(segment, previousCells, maxNewSynapses, initialPermanence)
 
     def adaptActiveSegments(self, prevActiveCells, maxNewSynapses, prevWinnerCells, initialPermanence,
                             permanenceInc, permanenceDec):
@@ -86,7 +93,7 @@ class BasicTMCell(TMCell):
         """
 
         if len(self._activeSegments) > 0:
-            updates = np.full(self._regionDim, -permanenceDec).flatten()
+            updates = np.full(self._regionDim, -permanenceDec, dtype=np.float32).flatten()
             updates[prevActiveCells] = permanenceInc
             updates = updates.reshape(self._regionDim)
             for segment in self._activeSegments:
@@ -104,17 +111,31 @@ class BasicTMCell(TMCell):
         :param maxNewSynapses: (int) maximum number of new synapses to create
         :param initialPermanence: (float) permanence value for new synapses
         """
-        cells = np.zeros(self._regionDim).flatten()
+        cells = np.zeros(self._regionDim, dtype=np.int8).flatten()
         cells[previousCells] = 1
+        cells = cells.reshape(self._regionDim)
         activeSynapsesCount = np.count_nonzero(np.multiply(self._segmentPermanences[segment] > 0, cells))
         newSynapseCount = maxNewSynapses - activeSynapsesCount
         if newSynapseCount > 0:
-            eligibleSynapses = np.logical_and(cells, self._segmentPermanences == 0)
+            eligibleSynapses = np.logical_and(cells, self._segmentPermanences[segment] == 0)
             eligibleSynapses = np.transpose(np.nonzero(eligibleSynapses))
             if len(eligibleSynapses):
                 np.random.shuffle(eligibleSynapses)
+                newSynapseCount = min(newSynapseCount, len(eligibleSynapses), self._maxSynapsesPerSegment)
+                self._destroyWeakestSynapses(segment, newSynapseCount)
                 for i in range(newSynapseCount):
-                    self._segmentPermanences[segment][eligibleSynapses[i]] = initialPermanence
+                    self._segmentPermanences[segment][tuple(eligibleSynapses[i])] = initialPermanence
+
+    def _destroyWeakestSynapses(self, segment, newSynapseCount):
+        """
+        Destroys the synapses of segment with the lowest permanences, lowest presynaptic cell first on ties,
+        so that newSynapseCount synapses can be grown without exceeding maxSynapsesPerSegment
+        """
+        permanences = self._segmentPermanences[segment].reshape(-1)
+        synapses = np.flatnonzero(permanences > 0)
+        excess = len(synapses) + newSynapseCount - self._maxSynapsesPerSegment
+        if excess > 0:
+            permanences[synapses[np.argsort(permanences[synapses], kind='stable')[:excess]]] = 0.0
 
     def createSegment(self, maxNewSynapses, prevWinnerCells, initialPermanence):
         """
@@ -123,14 +144,21 @@ class BasicTMCell(TMCell):
         :param prevWinnerCells: (array-like) list of previous winner cells to adapt to
         :param initialPermanence: (float) permanence value for new synapsess
         """
-        newSynapsesCount = min(maxNewSynapses, len(prevWinnerCells))
+        newSynapsesCount = min(maxNewSynapses, len(prevWinnerCells), self._maxSynapsesPerSegment)
         if newSynapsesCount > 0:
             synapses = np.zeros(self._regionDim, dtype=np.float32).flatten()
             eligibleSynapses = np.array(prevWinnerCells)
             np.random.shuffle(eligibleSynapses)
             for i in range(newSynapsesCount):
                 synapses[eligibleSynapses[i]] = initialPermanence
-            self._segmentPermanences.append(synapses.reshape(self._regionDim))
+            if len(self._segmentPermanences) >= self._maxSegmentsPerCell:
+                # the cell is full: the least recently used segment is replaced
+                segment = int(np.argmin(self._lastUsed))
+                self._segmentPermanences[segment] = synapses.reshape(self._regionDim)
+                self._lastUsed[segment] = self._iteration
+            else:
+                self._segmentPermanences.append(synapses.reshape(self._regionDim))
+                self._lastUsed.append(self._iteration)
 
     def punishMatchingSegments(self, prevActiveCells, permanenceDec):
         """
@@ -139,7 +167,7 @@ class BasicTMCell(TMCell):
         :param permanenceDec: (float) permanence value to decrement previous active cells
         """
         if len(self._matchingSegments) > 0:
-            updates = np.zeros(self._regionDim).flatten()
+            updates = np.zeros(self._regionDim, dtype=np.float32).flatten()
             updates[prevActiveCells] = permanenceDec
             updates = updates.reshape(self._regionDim)
             for segment in self._matchingSegments:
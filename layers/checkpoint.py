@@ -0,0 +1,74 @@
+import numpy as np
+from utils.files import writeCheckpoint, readCheckpoint
+
+
+def getRandomState():
+    """Returns the state of numpy's global random generator as metadata and arrays"""
+    name, key, pos, hasGauss, cachedGaussian = np.random.get_state()
+    return {'name': name, 'pos': int(pos), 'has_gauss': int(hasGauss), 'cached_gaussian': float(cachedGaussian)}, key
+
+
+def setRandomState(meta, key):
+    """Restores the state of numpy's global random generator saved by :func:`.getRandomState`"""
+    np.random.set_state((meta['name'], np.asarray(key), meta['pos'], meta['has_gauss'], meta['cached_gaussian']))
+
+
+def saveLayer(path, layer):
+    """
+    Saves a layer and the state of numpy's global random generator to a checkpoint file
+    :param path: path of the checkpoint file
+    :param layer: layer implementing _getState
+    """
+    saveModel(path, {'layer': layer})
+
+
+def loadLayer(path, mmap=True):
+    """
+    Loads a layer saved by :func:`.saveLayer` and restores the state of numpy's global random generator
+    :param path: path of the checkpoint file
+    :param mmap: (default=True) if True, memory-maps the layer's arrays
+    :return: layer
+    """
+    return loadModel(path, mmap)['layer']
+
+
+def saveModel(path, layers):
+    """
+    Saves several layers and the state of numpy's global random generator to one checkpoint file
+    :param path: path of the checkpoint file
+    :param layers: (dict) layers by name
+    """
+    meta = {'layers': {}}
+    arrays = {}
+    for name, layer in layers.items():
+        layerMeta, layerArrays = layer._getState()
+        meta['layers'][name] = {'class': type(layer).__name__, 'meta': layerMeta}
+        for arrayName, array in layerArrays.items():
+            arrays['%s/%s' % (name, arrayName)] = array
+    meta['random'], arrays['random/key'] = getRandomState()
+    writeCheckpoint(path, meta, arrays)
+
+
+def loadModel(path, mmap=True):
+    """
+    Loads layers saved by :func:`.saveModel` and restores the state of numpy's global random generator
+    :param path: path of the checkpoint file
+    :param mmap: (default=True) if True, memory-maps the layers' arrays
+    :return: dict of layers by name
+    """
+    from layers.spatial_pooler import SpatialPooler
+    from layers.topology_pooler import TopologyPooler
+    from layers.temporal_memory import TemporalMemory
+    from layers.feed_forward_classifier import FeedForwardClassifier
+    from layers.classifier import Classifier
+    layerClasses = {cls.__name__: cls for cls in (SpatialPooler, TopologyPooler, TemporalMemory, FeedForwardClassifier,
+                                                    Classifier)}
+
+    meta, arrays = readCheckpoint(path, mmap)
+    model = {}
+    for name, entry in meta['layers'].items():
+        prefix = name + '/'
+        layerArrays = {key[len(prefix):]: array for key, array in arrays.items() if key.startswith(prefix)}
+        model[name] = layerClasses[entry['class']]._fromState(entry['meta'], layerArrays)
+    setRandomState(meta['random'], arrays['random/key'])
+    return model
@@ -1,8 +1,14 @@
+import itertools
 import numpy as np
+from sdr import SDR
+from layers import checkpoint
 
 
 class Classifier:
 
+    # number of label rows of the counts buffer of a new classifier
+    _initialCapacity = 4
+
     def __init__(self, columnDim, alpha):
 
         if alpha < 0 or alpha > 1:
@@ -11,38 +17,106 @@ class Classifier:
         self._columnDim = columnDim
         self._alpha = alpha
         self._maxTimesSeen = int(1.0 / alpha)
-        self._history = []
+        # times each column was seen with each label, in the first _numLabels rows; the buffer doubles when full.
+        # Counts kept at maxTimesSeen + 1 by record must still fit after one more increment
+        self._counts = np.zeros((self._initialCapacity, columnDim), dtype=np.min_scalar_type(self._maxTimesSeen + 2))
+        self._numLabels = 0
+        # column -> indices of the labels seen with it
+        self._columnLabels = [set() for i in range(columnDim)]
         self._lookup = {}
         self._revlookup = {}
 
     def record(self, inputData, selectedColumns):
-        columns = np.zeros(self._columnDim, dtype=np.int64)
-        columns[selectedColumns] = 1
+        columns = SDR.convert(selectedColumns, self._columnDim).sparse
         try:
             index = self._lookup[inputData]
-            self._history[index] += columns
-            if np.count_nonzero(self._history[index] > self._maxTimesSeen):
-                temp = self._history[index]
-                minTimesSeen = np.min(temp[temp > 0])
-                if minTimesSeen != self._maxTimesSeen:  # Need TODO something different here
-                    temp[temp > 0] -= minTimesSeen
-                    self._history[index] = temp
-
         except KeyError:
-            self._history.append(columns)
-            self._lookup[inputData] = len(self._history) - 1
-            self._revlookup[len(self._history) - 1] = inputData
-
-    def infer(self, selectedColumns):
-        columns = np.zeros(self._columnDim, dtype=np.int8)
-        columns[selectedColumns] = 1
-        history = np.array(self._history)
-        overlapScores = np.count_nonzero(np.multiply(history, columns), axis=1)
-        # find probability distribution
-        # TODO: implement prob.dist
-        # return tuple of lists of historical input data and probability distribution for inferences
-        inputs = [self._revlookup[i] for i in range(len(overlapScores))]
-        return inputs
+            index = self._addLabel(inputData)
+
+        counts = self._counts[index]
+        counts[columns] += 1
+        for column in columns[counts[columns] == 1].tolist():
+            self._columnLabels[column].add(index)
+
+        if np.any(counts > self._maxTimesSeen):
+            seen = np.flatnonzero(counts)
+            minTimesSeen = np.min(counts[seen])
+            if minTimesSeen != self._maxTimesSeen:
+                counts[seen] -= minTimesSeen
+                for column in seen[counts[seen] == 0].tolist():
+                    self._columnLabels[column].discard(index)
+            else:  # every column was seen as often, keep the counts within the count dtype
+                np.minimum(counts, self._maxTimesSeen + 1, out=counts)
+
+    def _addLabel(self, label):
+        """Adds a row of counts for a new label, growing the counts buffer if full, and returns its index"""
+        index = self._numLabels
+        if index == len(self._counts):
+            capacity = max(self._initialCapacity, 2 * len(self._counts))
+            counts = np.zeros((capacity, self._columnDim), dtype=self._counts.dtype)
+            counts[:index] = self._counts[:index]
+            self._counts = counts
+        self._numLabels = index + 1
+        self._lookup[label] = index
+        self._revlookup[index] = label
+        return index
+
+    def infer(self, selectedColumns, k=None):
+        """
+        Given a set of columns in the input space, infer the represented data. The probability of a label
+        is proportional to the number of active columns it was seen with; only labels seen with at least
+        one active column are returned.
+        :param selectedColumns: SDR or (array-like) columns with ON bits
+        :param k: (default=None) if given, returns only the k most probable labels
+        :return: tuple of list of labels and numpy array of their probabilities, most probable first
+        """
+        columns = SDR.convert(selectedColumns, self._columnDim).sparse
+        labels = np.fromiter(itertools.chain.from_iterable(self._columnLabels[column] for column in columns.tolist()),
+                             dtype=np.int64)
+        overlapScores = np.bincount(labels, minlength=self._numLabels)
+        indices = np.flatnonzero(overlapScores)
+        if k is not None and k < len(indices):
+            indices = indices[np.argpartition(-overlapScores[indices], k - 1)[:k]]
+        indices = indices[np.lexsort((indices, -overlapScores[indices]))]
+        probabilities = overlapScores[indices] / max(np.sum(overlapScores[indices]), 1)
+        return [self._revlookup[i] for i in indices.tolist()], probabilities
+
+    def save(self, path):
+        """
+        Saves the classifier and the state of numpy's random generator to a checkpoint file.
+        Labels must be JSON serializable.
+        :param path: path of the checkpoint file
+        """
+        checkpoint.saveLayer(path, self)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a classifier saved by :meth:`.save` and restores the state of numpy's random generator
+        :param path: path of the checkpoint file
+        :param mmap: (default=True) if True, the counts are memory-mapped from the file
+        :return: Classifier
+        """
+        return checkpoint.loadLayer(path, mmap)
+
+    def _getState(self):
+        """Returns the metadata and arrays of the classifier for a checkpoint"""
+        meta = {'columnDim': self._columnDim, 'alpha': self._alpha,
+                'labels': [self._revlookup[i] for i in range(self._numLabels)]}
+        return meta, {'counts': self._counts[:self._numLabels]}
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """Constructs a classifier from the metadata and arrays of a checkpoint"""
+        classifier = cls(meta['columnDim'], meta['alpha'])
+        classifier._counts = arrays['counts']
+        classifier._numLabels = len(classifier._counts)
+        classifier._revlookup = dict(enumerate(meta['labels']))
+        classifier._lookup = {label: i for i, label in classifier._revlookup.items()}
+        labels, columns = np.nonzero(classifier._counts)
+        for label, column in zip(labels.tolist(), columns.tolist()):
+            classifier._columnLabels[column].add(label)
+        return classifier
 
     def get_alpha(self):
         """Returns value of alpha parameter"""
@@ -54,3 +128,6 @@ class Classifier:
             raise ValueError("alpha must be a number between 0 and 1")
         self._alpha = alpha
         self._maxTimesSeen = int(1.0 / alpha)
+        dtype = np.promote_types(self._counts.dtype, np.min_scalar_type(self._maxTimesSeen + 2))
+        if dtype != self._counts.dtype:
+            self._counts = self._counts.astype(dtype)
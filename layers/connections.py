@@ -0,0 +1,732 @@
+import itertools
+import numpy as np
+from layers.stats import arrayBytes
+
+
+class Connections:
+    """
+    This class implements a region-wide store of Temporal Memory segments and synapses.
+    Instead of one cell object holding dense region-sized permanence arrays per segment,
+    segment ownership and synapses are kept in flat numpy buffers, so memory and time grow
+    with the number of synapses rather than with the size of the region.
+
+    Segments are numbered globally in creation order. The synapses of a segment occupy a
+    contiguous row of slots in the flat synapse buffers (like CSR); a row that runs out of
+    capacity is moved to the end of the buffers with double the capacity. A cell holds at most
+    maxSegmentsPerCell segments, replacing its least recently used segment when full, and a segment
+    holds at most maxSynapsesPerSegment synapses, destroying its weakest synapses when full. Synapses
+    are destroyed when their permanence reaches 0 and segments without synapses are removed at the next
+    activation; :meth:`.compact` repacks the buffers, either all at once or incrementally. A reverse index
+    from each presynaptic cell to the synapse slots targeting it lets segment activation
+    visit only the synapses of the currently active cells.
+
+    The methods mirror :class:`layers.tm_cell.TMCell` with a leading flat cell index, so
+    a :class:`layers.temporal_memory.TemporalMemory` can be constructed with this class in
+    place of a cell class.
+    """
+
+    def __init__(self, regionDim, minPermanence, activationThreshold,
+                 minActive, maxSegmentsPerCell, maxSynapsesPerSegment, random=None):
+        """
+        Constructs a region-wide connections store
+        :param regionDim: (tuple of integers) The dimensions of the region of temporal memory
+        :param minPermanence: (float) The permanence threshold for potentially connected synapses
+        :param activationThreshold: (int) The minimum number of active synapses for a segment to be considered active
+        :param minActive: (int) The minimum number of active synapses for a segment to be considered matching
+        :param maxSegmentsPerCell: (int) The maximum number of allowed segments for each cell
+        :param maxSynapsesPerSegment: (int) The maximum number of allowed synapses for each segment
+        :param random: (default=None) numpy Generator choosing the cells new synapses grow to; None uses
+            numpy's global random generator
+        """
+
+        self._regionDim = regionDim
+        self._numCells = int(np.prod(regionDim))
+        self._minPermanence = minPermanence
+        self._activationThreshold = activationThreshold
+        self._minActive = minActive
+        self._maxSegmentsPerCell = maxSegmentsPerCell
+        self._maxSynapsesPerSegment = maxSynapsesPerSegment
+        self._random = random
+
+        # segment -> owner cell and the segment's row of synapse slots
+        self._numSegments = 0
+        self._segmentCells = np.zeros(64, dtype=np.int32)
+        self._segmentStarts = np.zeros(64, dtype=np.int64)
+        self._segmentLengths = np.zeros(64, dtype=np.int32)
+        self._segmentCapacities = np.zeros(64, dtype=np.int32)
+        self._cellSegmentCounts = np.zeros(self._numCells, dtype=np.int32)
+        # iteration of the last activation, adaptation or creation of each segment
+        self._segmentLastUsed = np.zeros(64, dtype=np.int64)
+        self._iteration = 0
+        # cell -> its segments in creation order, built on first use
+        self._cellSegments = None
+        # segments that lost their last synapse since the last activation
+        self._emptiedSegments = []
+
+        # synapse slots; unused slots have presynaptic cell -1 and permanence 0
+        self._numSlots = 0
+        self._synapseSegments = np.zeros(256, dtype=np.int32)
+        self._presynapticCells = np.full(256, -1, dtype=np.int32)
+        self._permanences = np.zeros(256, dtype=np.float32)
+
+        # presynaptic cell -> synapse slots targeting it, built on first use
+        self._presynapticSynapses = None
+
+        # incremental compaction: rows starting before _compactCursor were packed into the slots below _compactEnd
+        self._compactCursor = 0
+        self._compactEnd = 0
+
+        # segment activity of the last activation, see getActivity
+        self._activeSegments = np.zeros(0, dtype=np.int64)
+        self._matchingSegments = np.zeros(0, dtype=np.int64)
+        self._potentialSegments = np.zeros(0, dtype=np.int64)
+        self._potentialCounts = np.zeros(0, dtype=np.int64)
+
+    def activateSegments(self, activeCells):
+        """
+        Using current active cells find segment activity for the whole region
+        :param activeCells: List of indices of active cells in region
+        """
+        self._removeEmptySegments()
+        self.setActivity(self.computeActivity([activeCells])[0])
+        self._iteration += 1
+        self._segmentLastUsed[self._activeSegments] = self._iteration
+
+    def computeActivity(self, streamCells):
+        """
+        Finds the segment activity of several independent sets of active cells in one pass over the
+        synapses of their cells, without changing the connections
+        :param streamCells: list of lists of indices of active cells in region, one for each stream
+        :return: list of segment activities, see :meth:`.getActivity`
+        """
+        numStreams = len(streamCells)
+        streamCells = [np.asarray(cells, dtype=np.int64).ravel() for cells in streamCells]
+        cells = np.concatenate(streamCells) if numStreams else np.zeros(0, dtype=np.int64)
+        if self._numSegments and len(cells):
+            # only the synapses of the active cells are visited
+            presynapticSynapses = self._getPresynapticSynapses()
+            cellSynapses = [presynapticSynapses[cell] for cell in cells.tolist()]
+            synapseCounts = np.fromiter(map(len, cellSynapses), dtype=np.int64, count=len(cellSynapses))
+            synapses = np.fromiter(itertools.chain.from_iterable(cellSynapses), dtype=np.int64,
+                                   count=int(np.sum(synapseCounts)))
+            streams = np.repeat(np.repeat(np.arange(numStreams), [len(c) for c in streamCells]), synapseCounts)
+            keys = streams * self._numSegments + self._synapseSegments[synapses]
+            permanences = self._permanences[synapses]
+
+            connectedKeys, connectedCounts = np.unique(keys[permanences >= self._minPermanence], return_counts=True)
+            activeKeys = connectedKeys[connectedCounts >= self._activationThreshold]
+            potentialKeys, potentialCounts = np.unique(keys[permanences > 0], return_counts=True)
+            matchingKeys = potentialKeys[potentialCounts >= self._minActive]
+        else:
+            activeKeys = matchingKeys = potentialKeys = potentialCounts = np.zeros(0, dtype=np.int64)
+
+        bounds = np.arange(numStreams + 1) * max(self._numSegments, 1)
+        activeBounds = np.searchsorted(activeKeys, bounds)
+        matchingBounds = np.searchsorted(matchingKeys, bounds)
+        potentialBounds = np.searchsorted(potentialKeys, bounds)
+        return [(activeKeys[activeBounds[k]:activeBounds[k + 1]] - bounds[k],
+                 matchingKeys[matchingBounds[k]:matchingBounds[k + 1]] - bounds[k],
+                 potentialKeys[potentialBounds[k]:potentialBounds[k + 1]] - bounds[k],
+                 potentialCounts[potentialBounds[k]:potentialBounds[k + 1]])
+                for k in range(numStreams)]
+
+    def getActivity(self):
+        """
+        Returns the segment activity of the last activation: the active segments, the matching segments,
+        and the segments with active potential synapses with their counts of active potential synapses.
+        The activity only refers to segments, so it is as small as the activity it was computed from.
+        :return: tuple of arrays of active, matching and potential segments and potential counts
+        """
+        return self._activeSegments, self._matchingSegments, self._potentialSegments, self._potentialCounts
+
+    def setActivity(self, activity):
+        """
+        Sets the segment activity used by learning and by the state getters. Segments removed since the
+        activity was computed are left out.
+        :param activity: segment activity returned by :meth:`.getActivity` or :meth:`.computeActivity`
+        """
+        activeSegments, matchingSegments, potentialSegments, potentialCounts = activity
+        potential = self._segmentLengths[potentialSegments] > 0
+        self._activeSegments = activeSegments[self._segmentLengths[activeSegments] > 0]
+        self._matchingSegments = matchingSegments[self._segmentLengths[matchingSegments] > 0]
+        self._potentialSegments = potentialSegments[potential]
+        self._potentialCounts = potentialCounts[potential]
+
+    def adaptSegment(self, cell, segment, previousCells, maxNewSynapses, initialPermanence,
+                     permanenceInc, permanenceDec):
+        """
+        Updates permanence values for segment and creates new synapses on segment to previous cells
+        :param cell: (int) index of cell in region
+        :param segment: (integer) region-wide index of the matching segment of the cell to adapt
+        :param previousCells: (array-like) list of previous cells to adapt to
+        :param maxNewSynapses: (int) maximum number of new synapses to create
+        :param initialPermanence: (float) permanence value for new synapses
+        :param permanenceInc: (float) value to increment active synapses
+        :param permanenceDec: (float) value to decrement inactive synapses
+        """
+        self._updatePermanences(segment, previousCells, permanenceInc, -permanenceDec)
+        self._segmentLastUsed[segment] = self._iteration
+        self._addSynapses(segment, previousCells, maxNewSynapses, initialPermanence)
+
+    def adaptActiveSegments(self, cell, prevActiveCells, maxNewSynapses, prevWinnerCells, initialPermanence,
+                            permanenceInc, permanenceDec):
+        """
+        Updates permanence values for active segments of cell and creates new synapses to previous winner cells
+        :param cell: (int) index of cell in region
+        :param prevActiveCells: (array-like) list of previous active cells to adapt to
+        :param maxNewSynapses: (int) maximum number of new synapses to create
+        :param prevWinnerCells: (array-like) list of previous winner cells to grow to
+        :param initialPermanence: (float) permanence value for new synapses
+        :param permanenceInc: (float) value to increment active synapses
+        :param permanenceDec: (float) value to decrement inactive synapses
+        """
+        for segment in self._activeSegments[self._segmentCells[self._activeSegments] == cell]:
+            self._updatePermanences(segment, prevActiveCells, permanenceInc, -permanenceDec)
+            self._addSynapses(segment, prevWinnerCells, maxNewSynapses, initialPermanence)
+
+    def addSynapses(self, cell, segment, previousCells, maxNewSynapses, initialPermanence):
+        """
+        Creates new synapses on segment to previous cells
+        :param cell: (int) index of cell in region
+        :param segment: (integer) region-wide index of the segment of the cell to grow synapses on
+        :param previousCells: (array-like) list of previous cells to adapt to
+        :param maxNewSynapses: (int) maximum number of new synapses to create
+        :param initialPermanence: (float) permanence value for new synapses
+        """
+        self._addSynapses(segment, previousCells, maxNewSynapses, initialPermanence)
+
+    def createSegment(self, cell, maxNewSynapses, prevWinnerCells, initialPermanence):
+        """
+        Creates new segment on cell and synapses on segment to previous winner cells
+        :param cell: (int) index of cell in region
+        :param maxNewSynapses: (int) maximum number of new synapses to create
+        :param prevWinnerCells: (array-like) list of previous winner cells to adapt to
+        :param initialPermanence: (float) permanence value for new synapses
+        """
+        newSynapsesCount = min(maxNewSynapses, len(prevWinnerCells), self._maxSynapsesPerSegment)
+        if newSynapsesCount > 0:
+            eligibleSynapses = np.array(prevWinnerCells)
+            self._shuffle(eligibleSynapses)
+            if self._cellSegmentCounts[cell] >= self._maxSegmentsPerCell:
+                # the cell is full: the least recently used segment is replaced
+                segments = self._getCellSegments()[cell]
+                segment = segments[int(np.argmin(self._segmentLastUsed[segments]))]
+                self._clearSegment(segment)
+            else:
+                segment = self._allocateSegment(cell, newSynapsesCount)
+            self._segmentLastUsed[segment] = self._iteration
+            self._growSynapses(segment, eligibleSynapses[:newSynapsesCount], initialPermanence)
+
+    def punishMatchingSegments(self, cell, prevActiveCells, permanenceDec):
+        """
+        Updates permanence values for matching segments of cell in an inactive column
+        :param cell: (int) index of cell in region
+        :param prevActiveCells: (array-like) list of previous active cells to update
+        :param permanenceDec: (float) permanence value to decrement previous active cells
+        """
+        for segment in self._matchingSegments[self._segmentCells[self._matchingSegments] == cell]:
+            self._updatePermanences(segment, prevActiveCells, -permanenceDec, 0.0, punish=True)
+
+    def getActivePotentials(self, cell, activeCells):
+        """
+        Returns the counts of active matching synapses for each segment of cell
+        :param cell: (int) index of cell in region
+        :param activeCells: array_like list of active cells indices in region
+        :return: numpy array
+        """
+        segments = self.getSegments(cell)
+        if len(segments) < 1:  # no segments on this cell
+            return [0]
+
+        activeStates = np.zeros(self._numCells + 1, dtype=bool)
+        activeStates[activeCells] = True
+        activePotentials = np.zeros(len(segments), dtype=np.int64)
+        for i, segment in enumerate(segments):
+            synapses = self._segmentSlots(segment)
+            activePotentials[i] = np.count_nonzero(activeStates[self._presynapticCells[synapses]] &
+                                                   (self._permanences[synapses] > 0))
+        return activePotentials
+
+    def getBestMatchingSegments(self, columns):
+        """
+        Finds the winner cell of each bursting column from the active potential counts of the last
+        segment activation. The winner is the cell with the segment having the most active potential
+        synapses, or if no segment in the column has any, the cell with the fewest segments.
+        :param columns: (array-like) sorted indices of bursting columns
+        :return: tuple of arrays of winner cells and their best matching segments (-1 if none)
+        """
+        return self.getStreamBestMatchingSegments([columns], [self.getActivity()])
+
+    def getStreamBestMatchingSegments(self, streamColumns, activities):
+        """
+        Finds the winner cells of the bursting columns of several streams in one pass,
+        see :meth:`.getBestMatchingSegments`
+        :param streamColumns: list of arrays of sorted indices of bursting columns, one for each stream
+        :param activities: list of segment activities of the streams, see :meth:`.getActivity`
+        :return: tuple of arrays of winner cells and their best matching segments (-1 if none) of the
+            bursting columns of all streams in order
+        """
+        numColumns, cellsPerColumn = self._regionDim
+        streamLengths = [len(columns) for columns in streamColumns]
+        columnKeys = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                    [np.asarray(columns, dtype=np.int64) + k * numColumns
+                                     for k, columns in enumerate(streamColumns)])
+        segments = np.concatenate([np.zeros(0, dtype=np.int64)] + [activity[2] for activity in activities])
+        potentialCounts = np.concatenate([np.zeros(0, dtype=np.int64)] + [activity[3] for activity in activities])
+        segmentStreams = np.repeat(np.arange(len(activities)), [len(activity[2]) for activity in activities])
+
+        # segmented argmax over the candidate segments of each bursting column,
+        # preferring the lowest cell and then the oldest segment on ties
+        segmentCells = self._segmentCells[segments].astype(np.int64)
+        segmentKeys = segmentStreams * numColumns + segmentCells // cellsPerColumn
+        segmentColumns = np.minimum(np.searchsorted(columnKeys, segmentKeys), max(len(columnKeys) - 1, 0))
+        candidates = columnKeys[segmentColumns] == segmentKeys if len(columnKeys) else segmentKeys < 0
+        segments, segmentCells, segmentColumns, potentialCounts = (segments[candidates], segmentCells[candidates],
+                                                                   segmentColumns[candidates],
+                                                                   potentialCounts[candidates])
+        order = np.lexsort((segments, segmentCells, -potentialCounts, segmentColumns))
+        matchedColumns, first = np.unique(segmentColumns[order], return_index=True)
+
+        bestSegments = np.full(len(columnKeys), -1, dtype=np.int64)
+        bestSegments[matchedColumns] = segments[order[first]]
+        winnerCells = np.empty(len(columnKeys), dtype=np.int64)
+        winnerCells[matchedColumns] = segmentCells[order[first]]
+
+        unmatched = bestSegments < 0
+        columns = columnKeys[unmatched] % numColumns
+        segmentCounts = self._cellSegmentCounts.reshape((-1, cellsPerColumn))[columns]
+        winnerCells[unmatched] = columns * cellsPerColumn + np.argmin(segmentCounts, axis=1)
+        return winnerCells, bestSegments
+
+    def getSegments(self, cell):
+        """Returns the region-wide indices of the segments on cell in creation order"""
+        return np.array(self._getCellSegments()[cell], dtype=np.int64)
+
+    def getNumberOfSegments(self, cell):
+        """Returns the number of segments on cell"""
+        return self._cellSegmentCounts[cell]
+
+    def getNumSegments(self):
+        """Returns the number of segments in the region"""
+        return int(np.sum(self._cellSegmentCounts))
+
+    def getNumSynapses(self):
+        """Returns the number of synapses in the region with a permanence above 0"""
+        return int(np.count_nonzero(self._permanences[:self._numSlots] > 0))
+
+    def getPredictiveStates(self):
+        """Returns a boolean array of the predictive state of every cell in the region"""
+        predictiveStates = np.zeros(self._numCells, dtype=bool)
+        predictiveStates[self._segmentCells[self._activeSegments]] = True
+        return predictiveStates
+
+    def getMatchingStates(self):
+        """Returns a boolean array of the matching state of every cell in the region"""
+        matchingStates = np.zeros(self._numCells, dtype=bool)
+        matchingStates[self._segmentCells[self._matchingSegments]] = True
+        return matchingStates
+
+    def matching(self, cell):
+        """Returns matching state of cell"""
+        return bool(np.any(self._segmentCells[self._matchingSegments] == cell))
+
+    def predictive(self, cell):
+        """Returns predictive state of cell"""
+        return bool(np.any(self._segmentCells[self._activeSegments] == cell))
+
+    def _getPresynapticSynapses(self):
+        """Returns the reverse synapse index, building it from the synapse buffers if it was not loaded"""
+        if self._presynapticSynapses is None:
+            synapses = np.flatnonzero(self._presynapticCells[:self._numSlots] >= 0)
+            self._presynapticSynapses = self._groupBy(synapses, self._presynapticCells[synapses], self._numCells)
+        return self._presynapticSynapses
+
+    def _getCellSegments(self):
+        """Returns the segments of each cell, building them from the segment buffers if they were not loaded"""
+        if self._cellSegments is None:
+            segments = np.flatnonzero(self._segmentLengths[:self._numSegments] > 0)
+            self._cellSegments = self._groupBy(segments, self._segmentCells[segments], self._numCells)
+        return self._cellSegments
+
+    @staticmethod
+    def _groupBy(values, keys, numKeys):
+        """Returns a list of numKeys lists, list k holding the values with key k in order"""
+        # unique sort keys make the faster unstable sort keep the order of the values
+        order = np.argsort(np.asarray(keys, dtype=np.int64) * max(len(values), 1) + np.arange(len(values)))
+        values = values[order].tolist()
+        stops = np.cumsum(np.bincount(keys, minlength=numKeys)).tolist()
+        return [values[start:stop] for start, stop in zip([0] + stops[:-1], stops)]
+
+    def compact(self, maxSegments=None):
+        """
+        Repacks the synapse buffers so that activation scans only live synapses.
+
+        By default the pass is full: the synapses of the remaining segments are repacked into contiguous
+        rows without free slots, the segments are renumbered in creation order without the removed ones and
+        the buffers shrink, which stops the layer for time proportional to the number of synapses.
+
+        With maxSegments the pass is incremental: each call packs the rows of at most maxSegments segments,
+        in buffer order, towards the start of the buffers, continuing where the previous call stopped. The
+        segments keep their indices, and the buffers shrink once the pass reaches their end.
+        :param maxSegments: (default=None) maximum number of segment rows packed by this call; None runs a
+            full pass
+        :return: tuple of numpy array mapping old segment indices to new ones (-1 for removed segments), or
+            None if the segments were not renumbered, and dict with the numbers of removed segments and
+            reclaimed synapse slots, the bytes of the buffers before and after, and whether the pass completed
+        """
+        if maxSegments is not None and maxSegments < 1:
+            raise ValueError("Maximum number of segments must be greater than 0")
+        self._removeEmptySegments()
+        bytesBefore = arrayBytes(self)
+        if maxSegments is not None:
+            report = self._compactRows(maxSegments)
+            report['bytesBefore'] = bytesBefore
+            report['bytesAfter'] = arrayBytes(self)
+            report['bytesReclaimed'] = bytesBefore - report['bytesAfter']
+            return None, report
+        numSegments, numSlots = self._numSegments, self._numSlots
+
+        alive = self._segmentLengths[:self._numSegments] > 0
+        segmentMap = np.full(self._numSegments, -1, dtype=np.int64)
+        segmentMap[alive] = np.arange(np.count_nonzero(alive))
+
+        # live synapses grouped by new segment, in row order
+        slots = np.flatnonzero(self._presynapticCells[:self._numSlots] >= 0)
+        slots = slots[self._permanences[slots] > 0]
+        slotSegments = segmentMap[self._synapseSegments[slots]]
+        slots, slotSegments = slots[slotSegments >= 0], slotSegments[slotSegments >= 0]
+        order = np.argsort(slotSegments, kind='stable')
+        slots, slotSegments = slots[order], slotSegments[order]
+
+        report = {'segmentsRemoved': int(numSegments - np.count_nonzero(alive)),
+                  'slotsReclaimed': int(numSlots - len(slots)), 'bytesBefore': bytesBefore, 'complete': True}
+        numSegments, numSlots = int(np.count_nonzero(alive)), len(slots)
+        segmentSize = max(64, numSegments)
+        lengths = np.bincount(slotSegments, minlength=numSegments).astype(np.int32)
+        self._segmentCells = np.resize(self._segmentCells[:self._numSegments][alive], segmentSize)
+        self._segmentLastUsed = np.resize(self._segmentLastUsed[:self._numSegments][alive], segmentSize)
+        self._segmentStarts = np.zeros(segmentSize, dtype=np.int64)
+        self._segmentStarts[:numSegments] = np.cumsum(lengths) - lengths
+        self._segmentLengths = np.zeros(segmentSize, dtype=np.int32)
+        self._segmentLengths[:numSegments] = lengths
+        self._segmentCapacities = self._segmentLengths.copy()
+        self._numSegments = numSegments
+
+        slotSize = max(256, numSlots)
+        self._synapseSegments = np.zeros(slotSize, dtype=np.int32)
+        self._synapseSegments[:numSlots] = slotSegments
+        presynapticCells = np.full(slotSize, -1, dtype=np.int32)
+        presynapticCells[:numSlots] = self._presynapticCells[slots]
+        permanences = np.zeros(slotSize, dtype=np.float32)
+        permanences[:numSlots] = self._permanences[slots]
+        self._presynapticCells = presynapticCells
+        self._permanences = permanences
+        self._numSlots = numSlots
+
+        self._compactCursor = self._compactEnd = 0
+
+        # the indices are renumbered in place so the next step does not rebuild them
+        if self._presynapticSynapses is not None:
+            self._presynapticSynapses = self._groupBy(np.arange(numSlots), presynapticCells[:numSlots],
+                                                      self._numCells)
+        if self._cellSegments is not None:
+            self._cellSegments = self._groupBy(np.arange(numSegments), self._segmentCells[:numSegments],
+                                               self._numCells)
+        self.setActivity(self.remapActivity(self.getActivity(), segmentMap))
+
+        report['bytesAfter'] = arrayBytes(self)
+        report['bytesReclaimed'] = bytesBefore - report['bytesAfter']
+        return segmentMap, report
+
+    def _compactRows(self, maxSegments):
+        """
+        Packs the rows of at most maxSegments segments of the incremental pass, see :meth:`.compact`, and
+        returns the numbers of removed segments and reclaimed synapse slots and whether the pass completed
+        """
+        starts = self._segmentStarts[:self._numSegments]
+        pending = np.flatnonzero((starts >= self._compactCursor) & (self._segmentCapacities[:self._numSegments] > 0))
+        complete = len(pending) <= maxSegments
+        if not complete:
+            pending = pending[np.argpartition(starts[pending], maxSegments - 1)[:maxSegments]]
+        pending = pending[np.argsort(starts[pending])]
+
+        presynapticSynapses = self._getPresynapticSynapses()
+        cursor, end = self._compactCursor, self._compactEnd
+        slotsReclaimed = 0
+        for segment in pending.tolist():
+            start = int(self._segmentStarts[segment])
+            capacity = int(self._segmentCapacities[segment])
+            row = slice(start, start + capacity)
+            live = np.flatnonzero(self._presynapticCells[row] >= 0)
+            presynapticCells = self._presynapticCells[row][live]
+            permanences = self._permanences[row][live]
+            count = len(live)
+            for slot, newSlot, presynapticCell in zip((live + start).tolist(), range(end, end + count),
+                                                      presynapticCells.tolist()):
+                if slot != newSlot:
+                    cellSynapses = presynapticSynapses[presynapticCell]
+                    cellSynapses[cellSynapses.index(slot)] = newSlot
+            self._presynapticCells[row] = -1
+            self._permanences[row] = 0.0
+            self._presynapticCells[end:end + count] = presynapticCells
+            self._permanences[end:end + count] = permanences
+            self._synapseSegments[end:end + count] = segment
+            self._segmentStarts[segment] = end
+            self._segmentLengths[segment] = count
+            self._segmentCapacities[segment] = count
+            # free slots between the rows and in the packed row
+            slotsReclaimed += start - cursor + capacity - count
+            cursor, end = start + capacity, end + count
+
+        if complete:
+            slotsReclaimed += self._numSlots - cursor
+            self._numSlots = end
+            size = max(256, end)
+            self._synapseSegments = self._synapseSegments[:size].copy()
+            self._presynapticCells = self._presynapticCells[:size].copy()
+            self._permanences = self._permanences[:size].copy()
+            cursor = end = 0
+        self._compactCursor, self._compactEnd = cursor, end
+        return {'segmentsRemoved': 0, 'slotsReclaimed': int(slotsReclaimed), 'complete': complete}
+
+    @staticmethod
+    def remapActivity(activity, segmentMap):
+        """
+        Renumbers the segments of a segment activity after :meth:`.compact`
+        :param activity: segment activity, see :meth:`.getActivity`
+        :param segmentMap: numpy array mapping old segment indices to new ones returned by :meth:`.compact`
+        :return: segment activity
+        """
+        activeSegments, matchingSegments, potentialSegments, potentialCounts = activity
+        activeSegments = segmentMap[activeSegments]
+        matchingSegments = segmentMap[matchingSegments]
+        potentialSegments = segmentMap[potentialSegments]
+        potential = potentialSegments >= 0
+        return (activeSegments[activeSegments >= 0], matchingSegments[matchingSegments >= 0],
+                potentialSegments[potential], potentialCounts[potential])
+
+    def _getState(self):
+        """Returns the metadata and arrays of the connections for a checkpoint"""
+        meta = {'regionDim': list(self._regionDim), 'minPermanence': self._minPermanence,
+                'activationThreshold': self._activationThreshold, 'minActive': self._minActive,
+                'maxSegmentsPerCell': self._maxSegmentsPerCell, 'maxSynapsesPerSegment': self._maxSynapsesPerSegment,
+                'iteration': self._iteration}
+        arrays = {'segmentCells': self._segmentCells[:self._numSegments],
+                  'segmentStarts': self._segmentStarts[:self._numSegments],
+                  'segmentLengths': self._segmentLengths[:self._numSegments],
+                  'segmentCapacities': self._segmentCapacities[:self._numSegments],
+                  'cellSegmentCounts': self._cellSegmentCounts,
+                  'segmentLastUsed': self._segmentLastUsed[:self._numSegments],
+                  'synapseSegments': self._synapseSegments[:self._numSlots],
+                  'presynapticCells': self._presynapticCells[:self._numSlots],
+                  'permanences': self._permanences[:self._numSlots],
+                  'activeSegments': self._activeSegments,
+                  'matchingSegments': self._matchingSegments,
+                  'potentialSegments': self._potentialSegments,
+                  'potentialCounts': self._potentialCounts,
+                  'emptiedSegments': np.array(self._emptiedSegments, dtype=np.int64)}
+        return meta, arrays
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """
+        Constructs connections from the metadata and arrays of a checkpoint. The reverse synapse
+        index is rebuilt on first use, so loading does not touch the synapse data.
+        """
+        connections = cls(tuple(meta['regionDim']), meta['minPermanence'], meta['activationThreshold'],
+                          meta['minActive'], meta['maxSegmentsPerCell'], meta['maxSynapsesPerSegment'])
+        connections._numSegments = len(arrays['segmentCells'])
+        connections._segmentCells = arrays['segmentCells']
+        connections._segmentStarts = arrays['segmentStarts']
+        connections._segmentLengths = arrays['segmentLengths']
+        connections._segmentCapacities = arrays['segmentCapacities']
+        connections._cellSegmentCounts = arrays['cellSegmentCounts']
+        connections._segmentLastUsed = arrays['segmentLastUsed']
+        connections._iteration = meta['iteration']
+        connections._numSlots = len(arrays['permanences'])
+        connections._synapseSegments = arrays['synapseSegments']
+        connections._presynapticCells = arrays['presynapticCells']
+        connections._permanences = arrays['permanences']
+        connections._emptiedSegments = np.asarray(arrays.get('emptiedSegments', [])).tolist()
+        connections.setActivity((arrays['activeSegments'], arrays['matchingSegments'],
+                                 arrays['potentialSegments'], arrays['potentialCounts']))
+        return connections
+
+    def _shuffle(self, array):
+        """Shuffles array in place with the random generator of the connections"""
+        if self._random is None:
+            np.random.shuffle(array)
+        else:
+            self._random.shuffle(array)
+
+    def _segmentSlots(self, segment):
+        """Returns the slice of synapse slots used by segment"""
+        start = self._segmentStarts[segment]
+        return slice(start, start + self._segmentLengths[segment])
+
+    def _updatePermanences(self, segment, previousCells, activeDelta, inactiveDelta, punish=False):
+        """
+        Adds activeDelta to the permanences of the segment's synapses to previousCells and
+        inactiveDelta to its other synapses. Unless punishing, only existing synapses are updated.
+        """
+        synapses = self._segmentSlots(segment)
+        previousStates = np.zeros(self._numCells + 1, dtype=bool)
+        previousStates[previousCells] = True
+        permanences = self._permanences[synapses]
+        updates = np.where(previousStates[self._presynapticCells[synapses]],
+                           np.float32(activeDelta), np.float32(inactiveDelta))
+        if not punish:
+            updates = np.multiply(updates, permanences > 0)
+        permanences = np.clip(permanences + updates, 0.0, 1.0)
+        self._permanences[synapses] = permanences
+
+        destroyed = np.flatnonzero((permanences == 0) & (self._presynapticCells[synapses] >= 0))
+        if len(destroyed):
+            self._destroySynapses(destroyed + synapses.start)
+            if not np.any(permanences > 0):
+                self._emptiedSegments.append(segment)
+
+    def _destroySynapses(self, slots):
+        """Destroys the synapses in slots, leaving the slots free for new synapses"""
+        presynapticSynapses = self._getPresynapticSynapses()
+        for slot, presynapticCell in zip(slots.tolist(), self._presynapticCells[slots].tolist()):
+            presynapticSynapses[presynapticCell].remove(slot)
+        self._presynapticCells[slots] = -1
+        self._permanences[slots] = 0.0
+
+    def _removeEmptySegments(self):
+        """Removes the segments that lost their last synapse since the last activation"""
+        cellSegments = self._getCellSegments()
+        for segment in set(self._emptiedSegments):
+            synapses = self._segmentSlots(segment)
+            if self._segmentLengths[segment] and not np.any(self._permanences[synapses] > 0):
+                cell = self._segmentCells[segment]
+                cellSegments[cell].remove(segment)
+                self._cellSegmentCounts[cell] -= 1
+                self._segmentLengths[segment] = 0
+        self._emptiedSegments = []
+
+    def _addSynapses(self, segment, previousCells, maxNewSynapses, initialPermanence):
+        """Grows synapses on segment to up to maxNewSynapses previous cells it is not yet connected to"""
+        synapses = self._segmentSlots(segment)
+        liveCells = self._presynapticCells[synapses][self._permanences[synapses] > 0]
+        previousCells = np.unique(np.asarray(previousCells, dtype=np.int64))
+        connected = np.isin(previousCells, liveCells)
+        newSynapseCount = maxNewSynapses - np.count_nonzero(connected)
+        if newSynapseCount > 0:
+            eligibleSynapses = previousCells[~connected]
+            if len(eligibleSynapses):
+                self._shuffle(eligibleSynapses)
+                newSynapseCount = min(newSynapseCount, len(eligibleSynapses), self._maxSynapsesPerSegment)
+                self._destroyWeakestSynapses(segment, newSynapseCount)
+                self._growSynapses(segment, eligibleSynapses[:newSynapseCount], initialPermanence)
+
+    def _destroyWeakestSynapses(self, segment, newSynapseCount):
+        """
+        Destroys the synapses of segment with the lowest permanences, lowest presynaptic cell first on ties,
+        so that newSynapseCount synapses can be grown without exceeding maxSynapsesPerSegment
+        """
+        synapses = self._segmentSlots(segment)
+        permanences = self._permanences[synapses]
+        live = np.flatnonzero(permanences > 0)
+        excess = len(live) + newSynapseCount - self._maxSynapsesPerSegment
+        if excess > 0:
+            order = np.lexsort((self._presynapticCells[synapses][live], permanences[live]))
+            self._destroySynapses(live[order[:excess]] + synapses.start)
+
+    def _clearSegment(self, segment):
+        """Destroys all synapses of segment, keeping its row of slots"""
+        synapses = self._segmentSlots(segment)
+        presynapticSynapses = self._getPresynapticSynapses()
+        for slot, presynapticCell in zip(range(synapses.start, synapses.stop),
+                                         self._presynapticCells[synapses].tolist()):
+            if presynapticCell >= 0:
+                presynapticSynapses[presynapticCell].remove(slot)
+        self._presynapticCells[synapses] = -1
+        self._permanences[synapses] = 0.0
+        self._segmentLengths[segment] = 0
+
+    def _growSynapses(self, segment, presynapticCells, initialPermanence):
+        """Sets synapses on segment to presynapticCells with initialPermanence, reusing dead synapses"""
+        synapses = self._segmentSlots(segment)
+        existing = self._presynapticCells[synapses]
+        reused = np.isin(existing, presynapticCells)
+        self._permanences[synapses][reused] = initialPermanence
+        presynapticCells = presynapticCells[~np.isin(presynapticCells, existing)]
+
+        # dead synapses to other cells are reused before the row grows
+        presynapticSynapses = self._getPresynapticSynapses()
+        dead = np.flatnonzero(self._permanences[synapses] == 0)[:len(presynapticCells)]
+        for slot, presynapticCell in zip((dead + synapses.start).tolist(), presynapticCells.tolist()):
+            previousCell = int(self._presynapticCells[slot])
+            if previousCell >= 0:
+                presynapticSynapses[previousCell].remove(slot)
+            self._presynapticCells[slot] = presynapticCell
+            self._permanences[slot] = initialPermanence
+            presynapticSynapses[presynapticCell].append(slot)
+        presynapticCells = presynapticCells[len(dead):]
+
+        count = len(presynapticCells)
+        if count:
+            length = self._segmentLengths[segment]
+            if length + count > self._segmentCapacities[segment]:
+                self._moveSegment(segment, max(2 * self._segmentCapacities[segment], length + count))
+            start = self._segmentStarts[segment] + length
+            presynapticSynapses = self._getPresynapticSynapses()
+            self._presynapticCells[start:start + count] = presynapticCells
+            self._permanences[start:start + count] = initialPermanence
+            self._segmentLengths[segment] = length + count
+            for slot, presynapticCell in zip(range(start, start + count), presynapticCells.tolist()):
+                presynapticSynapses[presynapticCell].append(slot)
+
+    def _allocateSegment(self, cell, capacity):
+        """Creates an empty segment on cell with room for capacity synapses and returns its index"""
+        segment = self._numSegments
+        if segment == len(self._segmentCells):
+            size = max(64, 2 * len(self._segmentCells))
+            self._segmentCells = np.resize(self._segmentCells, size)
+            self._segmentStarts = np.resize(self._segmentStarts, size)
+            self._segmentLengths = np.resize(self._segmentLengths, size)
+            self._segmentCapacities = np.resize(self._segmentCapacities, size)
+            self._segmentLastUsed = np.resize(self._segmentLastUsed, size)
+
+        self._segmentCells[segment] = cell
+        self._segmentStarts[segment] = self._allocateSlots(segment, capacity)
+        self._segmentLengths[segment] = 0
+        self._segmentCapacities[segment] = capacity
+        self._cellSegmentCounts[cell] += 1
+        self._getCellSegments()[cell].append(segment)
+        self._numSegments += 1
+        return segment
+
+    def _allocateSlots(self, segment, count):
+        """Reserves count slots at the end of the synapse buffers for segment and returns the first slot"""
+        start = self._numSlots
+        if start + count > len(self._permanences):
+            size = max(256, 2 * len(self._permanences), start + count)
+            self._synapseSegments = np.resize(self._synapseSegments, size)
+            self._presynapticCells = np.concatenate((self._presynapticCells,
+                                                     np.full(size - len(self._presynapticCells), -1,
+                                                             dtype=np.int32)))
+            self._permanences = np.concatenate((self._permanences,
+                                                np.zeros(size - len(self._permanences), dtype=np.float32)))
+        self._synapseSegments[start:start + count] = segment
+        self._numSlots = start + count
+        return start
+
+    def _moveSegment(self, segment, capacity):
+        """Moves the synapses of segment to a new row at the end of the synapse buffers"""
+        synapses = self._segmentSlots(segment)
+        length = self._segmentLengths[segment]
+        presynapticSynapses = self._getPresynapticSynapses()
+        start = self._allocateSlots(segment, capacity)
+        for offset, presynapticCell in enumerate(self._presynapticCells[synapses].tolist()):
+            if presynapticCell >= 0:
+                cellSynapses = presynapticSynapses[presynapticCell]
+                cellSynapses[cellSynapses.index(synapses.start + offset)] = start + offset
+        self._presynapticCells[start:start + length] = self._presynapticCells[synapses]
+        self._permanences[start:start + length] = self._permanences[synapses]
+        self._presynapticCells[synapses] = -1
+        self._permanences[synapses] = 0.0
+        self._segmentStarts[segment] = start
+        self._segmentCapacities[segment] = capacity
@@ -1,77 +1,230 @@
 import numpy as np
+from sdr import SDR
+from layers import checkpoint
 
 
 class FeedForwardClassifier:
     """
     This class implements a single layer feed forward neural network classifier for SDRs.
-    The classifier grows with new unseen data.
+    The classifier grows with new unseen data. It can predict several steps ahead, with one
+    weight matrix for each step offset.
     """
 
-    def __init__(self, columnDim, alpha):
+    def __init__(self, columnDim, alpha, steps=(1,)):
         """
         Constructs a feed-forward neural network classifier
         :param columnDim: (int) number columns in input
         :param alpha: (float) learning rate
+        :param steps: (default=(1,)) step offsets k to learn to predict the data at t+k for
         """
+        steps = sorted(set(steps))
+        if not steps or steps[0] < 1:
+            raise ValueError("Step offsets must be greater than 0")
+
         self._columnDim = columnDim
-        self._weights = np.random.normal(size=columnDim)
+        self._steps = np.array(steps, dtype=np.int64)
+        # weights of each step offset, with the labels in the first _numLabels rows; the buffer doubles when full
+        self._weights = np.zeros((len(steps), 4, columnDim))
+        self._weights[:, 0] = np.random.normal(size=(len(steps), columnDim))
+        self._numLabels = 1
         self._alpha = alpha
         self._lookup = {None: 0}
         self._revlookup = {0: None}
-        self._history = None
+        # ring buffer of the columns of the last steps; the columns of step t are in slot t % len(_history)
+        self._history = [None] * steps[-1]
+        self._time = 0
         self._bits = None
+        self._stepIndex = 0
 
     def record(self, inputData, columns):
         """
-        Records and learns to predict inputData based on columns at t-l 
+        Records and learns to predict inputData based on columns at t-k for every step offset k.
+        All step offsets are learned together.
         :param inputData: data value to be predicted
-        :param columns: (array-like) columns with ON bits
+        :param columns: SDR or (array-like) columns with ON bits
         """
-        if self._history is not None:
+        stepIndices = np.flatnonzero(self._steps <= self._time)
+        if len(stepIndices):
 
             try:
                 index = self._lookup[inputData]
             except KeyError:
-                if len(self._weights.shape) == 1:
-                    index = 1
-                else:
-                    index = self._weights.shape[0]
-                self._weights = np.vstack((self._weights,
-                                           np.random.normal(scale=np.sqrt(1.0/(index + 1)),
-                                                            size=self._columnDim)))
-                self._revlookup[len(self._lookup)] = inputData
-                self._lookup[inputData] = len(self._lookup)
-
-            _, probabilities = self._infer(self._history, learn=True)
-
-            self.learn(probabilities, index)
-            self._bits = None
+                index = self._addLabel(inputData)
+
+            bits = [self._history[(self._time - step) % len(self._history)].sparse
+                    for step in self._steps[stepIndices]]
+            probabilities = self._stepProbabilities(stepIndices, bits)
+
+            gradients = probabilities
+            gradients[:, index] -= 1
+            # the gradient is zero for the weights of OFF bits
+            stepRows = np.repeat(np.arange(len(stepIndices)), [len(b) for b in bits])
+            self._weights[stepIndices[stepRows], :self._numLabels, np.concatenate(bits)] -= \
+                self._alpha * gradients[stepRows]
+
+        self._history[self._time % len(self._history)] = SDR.convert(columns, self._columnDim)
+        self._time += 1
+
+    def _stepProbabilities(self, stepIndices, bits):
+        """
+        Returns the label probabilities of several step offsets, each given its own columns
+        :param stepIndices: numpy array of indices of the step offsets
+        :param bits: list of numpy arrays of indices of ON bits, one for each step offset
+        :return: numpy array of shape (len(stepIndices), number of labels)
+        """
+        lengths = np.array([len(b) for b in bits], dtype=np.int64)
+        logits = np.zeros((len(stepIndices), self._numLabels))
+        if np.sum(lengths):
+            # only the weights of the ON bits contribute to the logits
+            weights = self._weights[np.repeat(stepIndices, lengths), :self._numLabels, np.concatenate(bits)]
+            starts = np.cumsum(lengths) - lengths
+            logits[lengths > 0] = np.add.reduceat(weights, starts[lengths > 0], axis=0)
+        z = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+        return z / np.sum(z, axis=1, keepdims=True)
+
+    def _addLabel(self, label):
+        """Adds a row of weights for a new label, growing the weights buffer if full, and returns its index"""
+        self._addLabels([label])
+        return self._numLabels - 1
+
+    def _addLabels(self, labels):
+        """Adds rows of weights for new labels in order, growing the weights buffer at most once"""
+        labels = [label for label in dict.fromkeys(labels) if label not in self._lookup]
+        numLabels = self._numLabels + len(labels)
+        if numLabels > self._weights.shape[1]:
+            capacity = max(self._weights.shape[1], 1)
+            while capacity < numLabels:
+                capacity *= 2
+            weights = np.zeros((len(self._steps), capacity, self._columnDim))
+            weights[:, :self._numLabels] = self._weights[:, :self._numLabels]
+            self._weights = weights
+        for label in labels:
+            index = self._numLabels
+            self._weights[:, index] = np.random.normal(scale=np.sqrt(1.0/(index + 1)),
+                                                       size=(len(self._steps), self._columnDim))
+            self._numLabels = index + 1
+            self._revlookup[index] = label
+            self._lookup[label] = index
+
+    def fit(self, column_sets, labels, batch_size=32, epochs=1, shuffle=False, vocabulary=None, step=None):
+        """
+        Trains the classifier offline on recorded pairs of columns and labels with mini-batch gradient
+        descent. Each batch is trained with matrix products of its columns and the weights, and the weights
+        are updated by alpha times the mean gradient of the batch, so batch_size=1 without shuffling learns
+        like calling :meth:`.learn` for each pair in order. The history of :meth:`.record` is not changed.
+        :param column_sets: list of SDRs or (array-like) columns with ON bits, or binary numpy array of
+            shape (N, columnDim)
+        :param labels: list of N labels, the data value to be predicted from each column set
+        :param batch_size: (default=32) number of pairs in each batch
+        :param epochs: (default=1) number of passes over the pairs
+        :param shuffle: (default=False) if True, the pairs are shuffled before each epoch
+        :param vocabulary: (default=None) list of labels to add before training, in order; labels not in
+            the vocabulary are added in order of first appearance. The weights buffer is grown once.
+        :param step: (default=None) step offset whose weights are trained; None trains the first step offset
+        :return: list of the mean cross-entropy loss of each epoch
+        """
+        if len(column_sets) != len(labels):
+            raise ValueError("Expecting %d labels but got %d" % (len(column_sets), len(labels)))
+        if batch_size < 1:
+            raise ValueError("Batch size must be greater than 0")
+
+        stepIndex = self._getStepIndex(step)
+        self._addLabels(list(vocabulary or []) + list(labels))
+        targets = np.array([self._lookup[label] for label in labels], dtype=np.int64)
+        if isinstance(column_sets, np.ndarray):
+            if column_sets.ndim != 2 or column_sets.shape[1] != self._columnDim:
+                raise ValueError("Input dimensions do not match. Expecting (N, %d) but got %s" %
+                                 (self._columnDim, column_sets.shape))
+            bits = [np.flatnonzero(columns) for columns in column_sets]
+        else:
+            bits = [SDR.convert(columns, self._columnDim).sparse for columns in column_sets]
+
+        numPairs = len(targets)
+        losses = []
+        for epoch in range(epochs):
+            order = np.random.permutation(numPairs) if shuffle else np.arange(numPairs)
+            loss = 0.0
+            for start in range(0, numPairs, batch_size):
+                batch = order[start:start + batch_size]
+                batchBits = [bits[i] for i in batch]
+                inputs = np.zeros((len(batch), self._columnDim))
+                inputs[np.repeat(np.arange(len(batch)), [len(b) for b in batchBits]),
+                       np.concatenate(batchBits).astype(np.int64)] = 1.0
+
+                weights = self._weights[stepIndex, :self._numLabels]
+                logits = np.matmul(inputs, weights.T)
+                z = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+                probabilities = z / np.sum(z, axis=1, keepdims=True)
+                rows = np.arange(len(batch))
+                loss -= np.sum(np.log(probabilities[rows, targets[batch]]))
+
+                gradients = probabilities
+                gradients[rows, targets[batch]] -= 1
+                weights -= (self._alpha / len(batch)) * np.matmul(gradients.T, inputs)
+            losses.append(float(loss) / max(numPairs, 1))
+        return losses
 
-        self._history = columns
+    def reset(self):
+        """Forgets the columns of the previous steps so the next record starts a new sequence"""
+        self._history = [None] * len(self._history)
+        self._time = 0
+        self._bits = None
+
+    def _getStepIndex(self, step):
+        """Returns the index of step offset step, or of the first step offset if step is None"""
+        if step is None:
+            return 0
+        stepIndices = np.flatnonzero(self._steps == step)
+        if not len(stepIndices):
+            raise ValueError("Unknown step offset %s. Expecting one of %s" % (step, self._steps.tolist()))
+        return int(stepIndices[0])
 
-    def _infer(self, columns, learn=True):
+    def _infer(self, columns, learn=True, step=None):
         """
         Given a set of columns in the input space, infer the represented data
-        :param columns: (array-like) columns with ON bits 
-        :param learn: if True, save bits and z scores for learning
+        :param columns: SDR or (array-like) columns with ON bits
+        :param learn: if True, save bits and step offset for learning
+        :param step: (default=None) step offset to infer; None infers the first step offset
         :return: tuple of labels and their probabilities
         """
-        self._bits = np.zeros(self._columnDim)
-        self._bits[columns] = 1
-        z = np.exp(np.dot(self._weights, self._bits))
-        probabilities = z / np.sum(z)
-        labels = [self._revlookup[i] for i in range(len(self._weights))]
+        self._stepIndex = self._getStepIndex(step)
+        self._bits = SDR.convert(columns, self._columnDim).sparse
+        probabilities = self._stepProbabilities(np.array([self._stepIndex]), [self._bits])[0]
+        labels = [self._revlookup[i] for i in range(self._numLabels)]
         if not learn:
             self._bits = None
         return labels, probabilities
 
-    def infer(self, columns):
+    def infer(self, columns, step=None):
         """
         Given a set of columns in the input space, infer the represented data
-        :param columns: (array-like) columns with ON bits 
+        :param columns: SDR or (array-like) columns with ON bits
+        :param step: (default=None) step offset k to infer the data at t+k for; None infers the first step offset
         :return: tuple of labels and their probabilities
         """
-        return self._infer(columns, learn=False)
+        return self._infer(columns, learn=False, step=step)
+
+    def inferSteps(self, columns):
+        """
+        Given a set of columns in the input space, infer the represented data for every step offset at once
+        :param columns: SDR or (array-like) columns with ON bits
+        :return: tuple of labels and numpy array of their probabilities with one row for each step offset,
+            in the order returned by :meth:`.getSteps`
+        """
+        bits = SDR.convert(columns, self._columnDim).sparse
+        probabilities = self._stepProbabilities(np.arange(len(self._steps)), [bits] * len(self._steps))
+        return [self._revlookup[i] for i in range(self._numLabels)], probabilities
+
+    def infer_batch(self, columnSets, step=None):
+        """
+        Given several sets of columns in the input space, infer the represented data of each in one pass
+        :param columnSets: list of SDRs or (array-like) columns with ON bits
+        :param step: (default=None) step offset k to infer the data at t+k for; None infers the first step offset
+        :return: tuple of labels and numpy array of their probabilities with one row for each set of columns
+        """
+        bits = [SDR.convert(columns, self._columnDim).sparse for columns in columnSets]
+        probabilities = self._stepProbabilities(np.full(len(bits), self._getStepIndex(step)), bits)
+        return [self._revlookup[i] for i in range(self._numLabels)], probabilities
 
     def learn(self, probabilities, label):
         """
@@ -82,5 +235,62 @@ class FeedForwardClassifier:
         loss = -np.log(probabilities[label])
         gradients = probabilities
         gradients[label] -= 1
-        deltas = np.matmul(gradients.reshape((-1, 1)), self._bits.reshape((1, -1)))
-        self._weights += -self._alpha * deltas
+        # the gradient is zero for the weights of OFF bits
+        self._weights[self._stepIndex, :len(gradients), self._bits] -= self._alpha * gradients[np.newaxis, :]
+
+    def getSteps(self):
+        """Returns the step offsets of the classifier"""
+        return self._steps.tolist()
+
+    def save(self, path):
+        """
+        Saves the classifier and the state of numpy's random generator to a checkpoint file.
+        Labels must be JSON serializable.
+        :param path: path of the checkpoint file
+        """
+        checkpoint.saveLayer(path, self)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a classifier saved by :meth:`.save` and restores the state of numpy's random generator
+        :param path: path of the checkpoint file
+        :param mmap: (default=True) if True, weights are memory-mapped from the file
+        :return: FeedForwardClassifier
+        """
+        return checkpoint.loadLayer(path, mmap)
+
+    def _getState(self):
+        """Returns the metadata and arrays of the classifier for a checkpoint"""
+        # the columns of the recorded steps still in the history, oldest first
+        history = [self._history[t % len(self._history)].sparse
+                   for t in range(max(self._time - len(self._history), 0), self._time)]
+        meta = {'columnDim': self._columnDim, 'alpha': self._alpha, 'steps': self._steps.tolist(),
+                'labels': [self._revlookup[i] for i in range(len(self._revlookup))],
+                'time': self._time}
+        arrays = {'weights': self._weights[:, :self._numLabels],
+                  'historyOffsets': np.cumsum([0] + [len(bits) for bits in history]),
+                  'historyBits': np.concatenate([np.zeros(0, dtype=np.int64)] + history)}
+        return meta, arrays
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """Constructs a classifier from the metadata and arrays of a checkpoint"""
+        classifier = cls.__new__(cls)
+        classifier._columnDim = meta['columnDim']
+        classifier._alpha = meta['alpha']
+        classifier._steps = np.array(meta['steps'], dtype=np.int64)
+        classifier._weights = arrays['weights']
+        classifier._numLabels = classifier._weights.shape[1]
+        classifier._revlookup = dict(enumerate(meta['labels']))
+        classifier._lookup = {label: i for i, label in classifier._revlookup.items()}
+        classifier._history = [None] * int(classifier._steps[-1])
+        classifier._time = meta['time']
+        offsets = arrays['historyOffsets']
+        for k in range(len(offsets) - 1):
+            t = classifier._time - (len(offsets) - 1) + k
+            classifier._history[t % len(classifier._history)] = SDR(classifier._columnDim,
+                                                                     sparse=arrays['historyBits'][offsets[k]:offsets[k + 1]])
+        classifier._bits = None
+        classifier._stepIndex = 0
+        return classifier
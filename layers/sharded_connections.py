@@ -0,0 +1,349 @@
+import multiprocessing
+import os
+import weakref
+import numpy as np
+from layers.connections import Connections
+from layers.stats import arrayBytes
+
+
+class _ShardMethod:
+    """Call of a method of a shard for :meth:`ShardedConnections.map`; unlike a lambda it can be pickled"""
+
+    def __init__(self, name, *args):
+        self._name = name
+        self._args = args
+
+    def __call__(self, shard, *shardArgs):
+        return getattr(shard, self._name)(*(shardArgs + self._args))
+
+
+def _returnShard(shard):
+    """Returns shard, so a worker process sends a copy of it"""
+    return shard
+
+
+def _measureShard(shard):
+    """Returns the numbers of segments and synapses of shard and the bytes of its arrays"""
+    return shard.getNumSegments(), shard.getNumSynapses(), arrayBytes(shard)
+
+
+def _getShardState(shard):
+    """Returns the checkpoint metadata and arrays of shard, with the state of its random generator"""
+    meta, arrays = shard._getState()
+    meta['random'] = shard._random.bit_generator.state
+    return meta, arrays
+
+
+def _activateShard(shard, activeCells):
+    """Activates the segments of shard and returns its predictive and matching cells"""
+    shard.activateSegments(activeCells)
+    return np.flatnonzero(shard.getPredictiveStates()), np.flatnonzero(shard.getMatchingStates())
+
+
+def _serveShards(connection, shards):
+    """Runs the calls received on connection on the shards of a worker process until None is received"""
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        function, calls = message
+        try:
+            results = [function(shards[index], *args) for index, args in calls]
+        except Exception as error:
+            connection.send((False, error))
+        else:
+            connection.send((True, results))
+
+
+def _stopWorkers(pid, connections, processes):
+    """Stops the worker processes of a sharded connections store started by process pid"""
+    # forked processes inherit the finalizers of their parent but do not own its workers
+    if os.getpid() != pid:
+        return
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+
+
+class ShardedConnections:
+    """
+    This class splits the columns of a Temporal Memory region into contiguous shards, each keeping the
+    segments of its cells in its own :class:`layers.connections.Connections` store with its own random
+    generator. Segments only belong to the cell that owns them, so within a step the winner selection,
+    learning and segment activation of different shards are independent and run in worker processes.
+    Each worker process owns the shards it runs for the life of the store, so a step only sends the
+    active and winner cells to the workers and the winner cells and cell states back; the segments and
+    synapses never leave the workers. The generator of each shard is seeded from the seed and the shard
+    index, so the results depend on the number of shards but not on the number of workers.
+
+    Functions run on the shards must be picklable, such as module-level functions or instances of
+    module-level classes. Call :meth:`.close` to stop the workers, or use the store as a context manager.
+
+    Segment indices are local to the shard of their cell. The methods mirror
+    :class:`layers.connections.Connections` and route each cell to its shard.
+    """
+
+    def __init__(self, regionDim, minPermanence, activationThreshold, minActive, maxSegmentsPerCell,
+                 maxSynapsesPerSegment, numShards, workers=None, seed=None, connections=Connections):
+        """
+        Constructs a sharded connections store
+        :param regionDim: (tuple of integers) The dimensions of the region of temporal memory
+        :param minPermanence: (float) The permanence threshold for potentially connected synapses
+        :param activationThreshold: (int) The minimum number of active synapses for a segment to be considered active
+        :param minActive: (int) The minimum number of active synapses for a segment to be considered matching
+        :param maxSegmentsPerCell: (int) The maximum number of allowed segments for each cell
+        :param maxSynapsesPerSegment: (int) The maximum number of allowed synapses for each segment
+        :param numShards: (int) number of shards of columns
+        :param workers: (default=None) number of worker processes; None uses one per shard, 1 runs the
+            shards in turn in the calling process
+        :param seed: (default=None) seed of the random generators of the shards
+        :param connections: (default=Connections) Connections class of the shards
+        """
+        numColumns, cellsPerColumn = regionDim
+        if numShards < 1 or numShards > numColumns:
+            raise ValueError("Number of shards must be between 1 and %d but got %d" % (numColumns, numShards))
+        if workers is not None and workers < 1:
+            raise ValueError("Number of workers must be greater than 0")
+
+        self._regionDim = regionDim
+        self._cellsPerColumn = cellsPerColumn
+        # shard k owns columns _columnStarts[k] to _columnStarts[k + 1]
+        self._columnStarts = np.linspace(0, numColumns, numShards + 1).astype(np.int64)
+        self._shards = [connections(regionDim, minPermanence, activationThreshold, minActive, maxSegmentsPerCell,
+                                    maxSynapsesPerSegment, random=np.random.default_rng(seedSequence))
+                        for seedSequence in np.random.SeedSequence(seed).spawn(numShards)]
+        self._numShards = numShards
+        self._workers = numShards if workers is None else min(workers, numShards)
+        # worker k runs the shards with _shardWorkers == k; the workers start on first use
+        self._shardWorkers = np.arange(numShards) * self._workers // numShards
+        self._connections = None
+        self._finalizer = None
+        # predictive and matching states of the workers' shards, kept from activation until the next call
+        self._states = None
+
+    def map(self, function, *shardArgs):
+        """
+        Calls function with each shard and its arguments in the workers
+        :param function: picklable function of a Connections shard and its arguments
+        :param shardArgs: lists of arguments, one for each shard
+        :return: list of the results, one for each shard
+        """
+        return self._run(function, list(enumerate(zip(*shardArgs) if shardArgs else [()] * self._numShards)))
+
+    def _callShard(self, cell, name, *args):
+        """Calls method name of the shard of cell with cell and args and returns its result"""
+        return self._run(_ShardMethod(name), [(self._getShardIndex(cell), (cell,) + args)])[0]
+
+    def _run(self, function, calls):
+        """
+        Runs function on shards in the workers and returns the results in order
+        :param function: picklable function of a Connections shard and its arguments
+        :param calls: list of tuples of shard index and tuple of arguments
+        :return: list of results, one for each call
+        """
+        self._states = None
+        if self._connections is None:
+            if self._shards is None:
+                raise ValueError("Sharded connections are closed")
+            if self._workers == 1:
+                return [function(self._shards[index], *args) for index, args in calls]
+            self._startWorkers()
+
+        workerCalls = [[] for i in range(self._workers)]
+        for position, (index, args) in enumerate(calls):
+            workerCalls[self._shardWorkers[index]].append((position, index, args))
+        for connection, pending in zip(self._connections, workerCalls):
+            if pending:
+                connection.send((function, [(index, args) for _, index, args in pending]))
+
+        results = [None] * len(calls)
+        error = None
+        for connection, pending in zip(self._connections, workerCalls):
+            if pending:
+                succeeded, values = connection.recv()
+                if not succeeded:
+                    error = values
+                    continue
+                for (position, _, _), value in zip(pending, values):
+                    results[position] = value
+        if error is not None:
+            raise error
+        return results
+
+    def _startWorkers(self):
+        """Starts the worker processes and hands each its shards"""
+        context = multiprocessing.get_context()
+        connections, processes = [], []
+        for worker in range(self._workers):
+            connection, workerConnection = context.Pipe()
+            shards = {index: self._shards[index] for index in np.flatnonzero(self._shardWorkers == worker).tolist()}
+            process = context.Process(target=_serveShards, args=(workerConnection, shards), daemon=True)
+            process.start()
+            workerConnection.close()
+            connections.append(connection)
+            processes.append(process)
+        self._connections = connections
+        # the workers own the shards from now on
+        self._shards = None
+        self._finalizer = weakref.finalize(self, _stopWorkers, os.getpid(), connections, processes)
+
+    def close(self):
+        """Stops the worker processes; the store cannot be used afterwards"""
+        if self._finalizer is not None:
+            self._finalizer()
+        self._connections = None
+        self._shards = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def splitColumns(self, columns):
+        """Splits sorted column indices into the columns of each shard"""
+        columns = np.asarray(columns, dtype=np.int64)
+        return np.split(columns, np.searchsorted(columns, self._columnStarts[1:-1]))
+
+    def splitCells(self, cells):
+        """Splits sorted cell indices into the cells of each shard"""
+        cells = np.asarray(cells, dtype=np.int64)
+        return np.split(cells, np.searchsorted(cells, self._columnStarts[1:-1] * self._cellsPerColumn))
+
+    def usesWorkers(self):
+        """Returns True if the shards run in worker processes rather than in the calling process"""
+        return self._workers > 1
+
+    def getShards(self):
+        """Returns the Connections of the shards; when the shards run in worker processes, copies of them"""
+        if self._workers == 1 and self._shards is not None:
+            return self._shards
+        return self.map(_returnShard)
+
+    def getSizes(self):
+        """
+        Returns the numbers of segments and synapses and the bytes of the arrays of all shards, counted where
+        the shards run so that only the counts are sent back by worker processes
+        :return: tuple of numbers of segments, synapses and bytes
+        """
+        sizes = self.map(_measureShard)
+        return tuple(sum(shardSizes[i] for shardSizes in sizes) for i in range(3))
+
+    def _getShardIndex(self, cell):
+        """Returns the index of the shard of cell"""
+        column = cell // self._cellsPerColumn
+        return int(np.searchsorted(self._columnStarts, column, side='right') - 1)
+
+    def activateSegments(self, activeCells):
+        if self._workers == 1:
+            self.map(_ShardMethod('activateSegments', activeCells))
+            return
+        # the states are returned with the activation to save the workers two more calls
+        results = self.map(_activateShard, [activeCells] * self._numShards)
+        predictiveStates = np.zeros(int(np.prod(self._regionDim)), dtype=bool)
+        matchingStates = np.zeros(len(predictiveStates), dtype=bool)
+        for predictiveCells, matchingCells in results:
+            predictiveStates[predictiveCells] = True
+            matchingStates[matchingCells] = True
+        self._states = predictiveStates, matchingStates
+
+    def adaptSegment(self, cell, *args):
+        self._callShard(cell, 'adaptSegment', *args)
+
+    def adaptActiveSegments(self, cell, *args):
+        self._callShard(cell, 'adaptActiveSegments', *args)
+
+    def addSynapses(self, cell, *args):
+        self._callShard(cell, 'addSynapses', *args)
+
+    def createSegment(self, cell, *args):
+        self._callShard(cell, 'createSegment', *args)
+
+    def punishMatchingSegments(self, cell, *args):
+        self._callShard(cell, 'punishMatchingSegments', *args)
+
+    def getActivePotentials(self, cell, activeCells):
+        return self._callShard(cell, 'getActivePotentials', activeCells)
+
+    def getNumberOfSegments(self, cell):
+        return self._callShard(cell, 'getNumberOfSegments')
+
+    def getNumSegments(self):
+        return sum(self.map(_ShardMethod('getNumSegments')))
+
+    def getNumSynapses(self):
+        return sum(self.map(_ShardMethod('getNumSynapses')))
+
+    def getBestMatchingSegments(self, columns):
+        results = self.map(_ShardMethod('getBestMatchingSegments'), self.splitColumns(columns))
+        return (np.concatenate([winnerCells for winnerCells, _ in results]),
+                np.concatenate([bestSegments for _, bestSegments in results]))
+
+    def getPredictiveStates(self):
+        if self._states is not None:
+            return self._states[0].copy()
+        return np.any(self.map(_ShardMethod('getPredictiveStates')), axis=0)
+
+    def getMatchingStates(self):
+        if self._states is not None:
+            return self._states[1].copy()
+        return np.any(self.map(_ShardMethod('getMatchingStates')), axis=0)
+
+    def matching(self, cell):
+        return self._callShard(cell, 'matching')
+
+    def predictive(self, cell):
+        return self._callShard(cell, 'predictive')
+
+    def _getState(self):
+        """Returns the metadata and arrays of the shards and the states of their random generators for a checkpoint"""
+        meta = {'numShards': self._numShards, 'workers': self._workers, 'shards': []}
+        arrays = {}
+        for index, (shardMeta, shardArrays) in enumerate(self.map(_getShardState)):
+            meta['shards'].append(shardMeta)
+            for name, array in shardArrays.items():
+                arrays['shard%d/%s' % (index, name)] = array
+        return meta, arrays
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """
+        Constructs sharded connections from the metadata and arrays of a checkpoint. The worker processes
+        start on first use.
+        """
+        shards = []
+        for index, shardMeta in enumerate(meta['shards']):
+            prefix = 'shard%d/' % index
+            shard = Connections._fromState(shardMeta, {name[len(prefix):]: array for name, array in arrays.items()
+                                                       if name.startswith(prefix)})
+            shard._random = np.random.default_rng()
+            shard._random.bit_generator.state = shardMeta['random']
+            shards.append(shard)
+        first = meta['shards'][0]
+        sharded = cls(tuple(first['regionDim']), first['minPermanence'], first['activationThreshold'],
+                      first['minActive'], first['maxSegmentsPerCell'], first['maxSynapsesPerSegment'],
+                      meta['numShards'], meta['workers'])
+        sharded._shards = shards
+        return sharded
+
+    def compact(self, maxSegments=None):
+        """
+        Compacts every shard, see :meth:`layers.connections.Connections.compact`
+        :param maxSegments: (default=None) maximum number of segment rows packed in each shard by an
+            incremental pass; None runs a full pass
+        :return: tuple of list of segment index mappings, one for each shard, or None if the segments were
+            not renumbered, and dict with the total numbers of removed segments and reclaimed synapse slots,
+            the bytes of the buffers before and after, and whether the pass completed in every shard
+        """
+        results = self.map(_ShardMethod('compact', maxSegments))
+        report = {key: sum(shardReport[key] for _, shardReport in results) for key in results[0][1]}
+        report['complete'] = all(shardReport['complete'] for _, shardReport in results)
+        if maxSegments is not None:
+            return None, report
+        return [segmentMap for segmentMap, _ in results], report
@@ -1,4 +1,25 @@
 import numpy as np
+from sdr import SDR
+from layers import checkpoint
+from layers.stats import LayerStats, arrayBytes
+from utils.arrays import concatenateRanges
+
+
+def tieBreaks(numColumns):
+    """
+    Returns the keys added to scaled overlap scores of numColumns columns so that ties between equal
+    overlap scores are broken in favour of lower column indices
+    """
+    return np.arange(numColumns - 1, -1, -1, dtype=np.int64)
+
+
+def permanenceUpdates(inputStates, activeInc, inactiveDec):
+    """
+    Returns the permanence updates of the synapses of an active column: activeInc for synapses to ON
+    bits and -inactiveDec for the others
+    :param inputStates: boolean numpy array of the states of the inputs of the synapses
+    """
+    return np.where(inputStates, activeInc, -inactiveDec)
 
 
 class SpatialPooler:
@@ -6,8 +27,11 @@ class SpatialPooler:
     This class implements the Spatial Pooling algorithm forming sparse distributed representations of sensory inputs
     """
 
+    # number of inputs scored per matrix product in compute_batch
+    _batchChunk = 1024
+
     def __init__(self, inputDim, columnDim=2048, numActiveCols=40, pot_pct=0.5,
-                 minPermanence=0.1, activeInc=0.05, inactiveDec=0.008, seed=23):
+                 minPermanence=0.1, activeInc=0.05, inactiveDec=0.008, seed=23, sparse=False):
         """
         Constructs a Spatial Pooling layer and initializes variables
         :param inputDim: The dimensions of encoded input vectors
@@ -18,6 +42,8 @@ class SpatialPooler:
         :param activeInc: The increment value for active synapse permanence learning
         :param inactiveDec: The decrement value for inactive synapse permanence learning
         :param seed: The seed for the random number generator
+        :param sparse: (default=False) if True, stores only the potential pool of each column instead of
+            dense permanence matrices
         """
 
         np.random.seed(seed)
@@ -29,50 +55,315 @@ class SpatialPooler:
         self._minPermanence = minPermanence
         self._activeInc = activeInc
         self._inactiveDec = inactiveDec
-
-        self._permanences = np.zeros((columnDim, inputDim), dtype=np.float32)
-        self._potentials = np.zeros((columnDim, inputDim), dtype=np.int8)
+        self._sparse = sparse
+        self._tieBreak = tieBreaks(columnDim)
 
         self._numPotentials = int(pot_pct * inputDim + 0.5)
 
+        if sparse:
+            pools = []
+            poolPermanences = []
+            row = np.zeros(inputDim, dtype=np.float32)
+            potentials = np.zeros(inputDim, dtype=np.int8)
+        else:
+            self._permanences = np.zeros((columnDim, inputDim), dtype=np.float32)
+            self._potentials = np.zeros((columnDim, inputDim), dtype=np.int8)
+
         for i in range(columnDim):
             bits = np.random.randint(0, inputDim, (1, self._numPotentials), dtype=np.int64)
-            self._potentials[i, bits] = 1
-            self._permanences[i, bits] = np.random.normal(loc=minPermanence,
-                                                          scale=0.25*minPermanence,
-                                                          size=self._numPotentials)
+            if sparse:
+                potentials[:] = 0
+                potentials[bits] = 1
+                row[bits] = np.random.normal(loc=minPermanence, scale=0.25*minPermanence, size=self._numPotentials)
+                pool = np.flatnonzero(potentials)
+                pools.append(pool)
+                poolPermanences.append(row[pool])
+            else:
+                self._potentials[i, bits] = 1
+                self._permanences[i, bits] = np.random.normal(loc=minPermanence,
+                                                              scale=0.25*minPermanence,
+                                                              size=self._numPotentials)
+
+        if sparse:
+            # potential pools in CSR form: synapses of column i are _poolOffsets[i]:_poolOffsets[i + 1]
+            self._poolOffsets = np.zeros(columnDim + 1, dtype=np.int64)
+            self._poolOffsets[1:] = np.cumsum([len(pool) for pool in pools])
+            self._poolInputs = np.concatenate(pools).astype(np.int32)
+            self._poolPermanences = np.concatenate(poolPermanences).astype(np.float32)
+            self._poolColumns = np.repeat(np.arange(columnDim, dtype=np.int32), np.diff(self._poolOffsets))
+
+        # bit-packed connected synapses: bit 7 - (i % 8) of _connectedBits[i // 8, j] is set
+        # if column i has a connected synapse to input bit j
+        self._rebuildConnectedSynapses()
+        # float copy of the connected synapses for compute_batch, built on first use and updated by learning
+        self._connectedMatrix = None
+        self._stats = None
 
     def compute(self, encodedInput, learn=True, asarray=False):
         """
-        Returns a sparse distributed representation of the input as indices of active columns or if 'asarray'
+        Returns a sparse distributed representation of the input as an SDR of active columns or if 'asarray'
         is True, as a 1-D array of length returned by :meth:`.getWidth`. If 'learn' is set to True, updates
         permanences of active columns
-        :param encodedInput: A binary numpy array 
+        :param encodedInput: A binary numpy array or an SDR
         :param learn: (default=True) Indicates whether learning should be performed and permanence values updated
         :param asarray: (default=False) if True, returns a 1-D array of length returned by :meth:`.getWidth`.
-        :return: List of integers OR 1-D array of length returned by :meth:`.getWidth`.
+        :return: SDR OR 1-D array of length returned by :meth:`.getWidth`.
         """
 
+        if isinstance(encodedInput, SDR):
+            if encodedInput.getWidth() != self._inputDim:
+                raise ValueError("Input dimensions do not match. Expecting %d but got %d" % (self._inputDim,
+                                                                                             encodedInput.getWidth()))
+            return self._compute(encodedInput.sparse, learn, asarray)
         if not isinstance(encodedInput, np.ndarray):
             raise TypeError("Input must be a numpy array but got input of type %s" % type(encodedInput))
         if encodedInput.size != self._inputDim:
             raise ValueError("Input dimensions do not match. Expecting %d but got %d" % (self._inputDim,
                                                                                          encodedInput.size))
 
-        overlapScores = np.sum(np.multiply(self._permanences >= self._minPermanence, encodedInput), axis=1)
-        activeCols = np.argsort(overlapScores)[:self._w]
+        return self._compute(np.flatnonzero(encodedInput), learn, asarray)
+
+    def computeBits(self, activeBits, learn=True, asarray=False):
+        """
+        Same as :meth:`.compute` but takes the indices of the ON bits of the encoded input, as returned by
+        :meth:`encoders.unicode.UnicodeEncoder.encodeIntoBits`. Overlap and learning cost scale with the
+        number of ON bits rather than with the size of the input.
+        :param activeBits: (array-like) indices of ON bits in the encoded input, or an SDR
+        :param learn: (default=True) Indicates whether learning should be performed and permanence values updated
+        :param asarray: (default=False) if True, returns a 1-D array of length returned by :meth:`.getWidth`.
+        :return: SDR OR 1-D array of length returned by :meth:`.getWidth`.
+        """
+
+        return self._compute(SDR.convert(activeBits, self._inputDim).sparse, learn, asarray)
+
+    def compute_batch(self, inputs, learn=False, out=None):
+        """
+        Returns the active columns for many encoded inputs at once. Without learning, the overlap scores of
+        all inputs are computed with one matrix product against the connected synapses and the active
+        columns are found by partial selection. With learning, the inputs are pooled one at a time in order,
+        as with :meth:`.compute`.
+        :param inputs: A binary numpy array of shape (T, inputDim) OR a list of T lists of indices of ON bits or SDRs
+            OR a tuple of offsets and bits arrays as returned by :meth:`encoders.unicode.UnicodeEncoder.encodeBatch`,
+            the ON bits of input t being bits[offsets[t]:offsets[t + 1]]
+        :param learn: (default=False) Indicates whether learning should be performed and permanence values updated
+        :param out: (default=None) numpy int64 array of shape (T, numActiveCols) to write the active columns
+            into, so a caller pooling many batches can reuse one buffer
+        :return: numpy array of shape (T, numActiveCols) of sorted indices of active columns for each input
+        """
+
+        if isinstance(inputs, np.ndarray):
+            if inputs.ndim != 2 or inputs.shape[1] != self._inputDim:
+                raise ValueError("Input dimensions do not match. Expecting (T, %d) but got %s" % (self._inputDim,
+                                                                                                 inputs.shape))
+            numInputs = len(inputs)
+        else:
+            if isinstance(inputs, tuple):
+                offsets, activeBits = np.asarray(inputs[0], dtype=np.int64), np.asarray(inputs[1], dtype=np.int64)
+                if len(activeBits) and (np.min(activeBits) < 0 or np.max(activeBits) >= self._inputDim):
+                    raise ValueError("Indices out of range. Expecting indices between 0 and %d" % (self._inputDim - 1))
+            else:
+                sparse = [SDR.convert(bits, self._inputDim).sparse for bits in inputs]
+                offsets = np.zeros(len(sparse) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([len(bits) for bits in sparse])
+                activeBits = np.concatenate(sparse + [np.zeros(0, np.int64)])
+            numInputs = len(offsets) - 1
+
+        shape = (numInputs, min(self._w, self._n))
+        if out is None:
+            activeCols = np.zeros(shape, dtype=np.int64)
+        elif out.shape != shape:
+            raise ValueError("Output dimensions do not match. Expecting %s but got %s" % (shape, out.shape))
+        else:
+            activeCols = out
 
         if learn:
-            updates = encodedInput * (self._activeInc + self._inactiveDec) - self._inactiveDec
+            for t in range(numInputs):
+                if isinstance(inputs, np.ndarray):
+                    bits = np.flatnonzero(inputs[t])
+                else:
+                    bits = SDR.convert(activeBits[offsets[t]:offsets[t + 1]], self._inputDim).sparse
+                activeCols[t] = self._compute(bits, learn, False).sparse
+            return activeCols
+
+        if self._connectedMatrix is None:
+            self._connectedMatrix = np.unpackbits(self._connectedBits, axis=0, count=self._n).astype(np.float32)
+        for start in range(0, numInputs, self._batchChunk):
+            stop = min(start + self._batchChunk, numInputs)
+            if isinstance(inputs, np.ndarray):
+                chunk = (inputs[start:stop] != 0).astype(np.float32)
+            else:
+                chunk = np.zeros((stop - start, self._inputDim), dtype=np.float32)
+                rows = np.repeat(np.arange(stop - start), np.diff(offsets[start:stop + 1]))
+                chunk[rows, activeBits[offsets[start]:offsets[stop]]] = 1
+            overlapScores = np.dot(chunk, self._connectedMatrix.T)
+            activeCols[start:stop] = self._selectActiveColumns(overlapScores)
+        return activeCols
+
+    def _rebuildConnectedSynapses(self):
+        """Rebuilds the bit-packed connected synapses of all columns from their permanences"""
+        if self._sparse:
+            connected = np.zeros((self._n, self._inputDim), dtype=bool)
+            connected[self._poolColumns, self._poolInputs] = self._poolPermanences >= self._minPermanence
+        else:
+            connected = self._permanences >= self._minPermanence
+        self._connectedBits = np.packbits(connected, axis=0)
+        self._connectedMatrix = None
+
+    def _updateConnectedSynapses(self, columns):
+        """Updates the bit-packed connected synapses of the given columns from their permanences"""
+        if self._sparse:
+            synapses = concatenateRanges(self._poolOffsets[columns], self._poolOffsets[columns + 1])
+            rows = np.repeat(np.arange(len(columns)), self._poolOffsets[columns + 1] - self._poolOffsets[columns])
+            connected = np.zeros((len(columns), self._inputDim), dtype=bool)
+            connected[rows, self._poolInputs[synapses]] = self._poolPermanences[synapses] >= self._minPermanence
+        else:
+            connected = self._permanences[columns] >= self._minPermanence
+
+        for column, row in zip(columns.tolist(), connected.view(np.uint8)):
+            shift = 7 - (column & 7)
+            packed = self._connectedBits[column >> 3]
+            packed &= ~np.uint8(1 << shift)
+            packed |= row << shift
+        if self._connectedMatrix is not None:
+            self._connectedMatrix[columns] = connected
+
+    def _compute(self, activeBits, learn, asarray):
+        """Runs spatial pooling on the sorted indices of ON bits of the encoded input"""
+
+        activeCols = self._selectActiveColumns(self._overlapScores(activeBits))
+
+        if learn:
+            self._learn(activeCols, activeBits)
+            self._updateConnectedSynapses(activeCols)
+
+        columns = SDR(self._n, sparse=activeCols)
+        if asarray:
+            return columns.dense
+        else:
+            return columns
+
+    def _overlapScores(self, activeBits):
+        """Returns the number of connected synapses to ON bits for each column"""
+        return np.unpackbits(self._connectedBits[:, activeBits], axis=0, count=self._n).sum(axis=1, dtype=np.int64)
+
+    def _selectActiveColumns(self, overlapScores):
+        """
+        Returns the sorted indices of the numActiveCols columns with highest overlap scores, along the last
+        axis of overlapScores
+        """
+        if self._w >= self._n:
+            return np.broadcast_to(np.arange(self._n), overlapScores.shape).copy()
+        keys = overlapScores.astype(np.int64) * self._n + self._tieBreak
+        return np.sort(np.argpartition(keys, self._n - self._w, axis=-1)[..., self._n - self._w:], axis=-1)
+
+    def _learn(self, activeCols, activeBits):
+        """Increments permanences of active columns' potential synapses to ON bits and decrements the others"""
+        inputStates = np.zeros(self._inputDim, dtype=bool)
+        inputStates[activeBits] = True
+        if self._sparse:
+            synapses = concatenateRanges(self._poolOffsets[activeCols], self._poolOffsets[activeCols + 1])
+            updates = permanenceUpdates(inputStates[self._poolInputs[synapses]], self._activeInc, self._inactiveDec)
+            self._poolPermanences[synapses] = np.clip(self._poolPermanences[synapses] + updates, 0.0, 1.0)
+        else:
+            updates = permanenceUpdates(inputStates, self._activeInc, self._inactiveDec)
             updates = np.multiply(self._potentials[activeCols], updates)
             self._permanences[activeCols] = np.clip(self._permanences[activeCols] + updates, 0.0, 1.0)
 
-        if asarray:
-            columns = np.zeros(self._n, dtype=np.int8)
-            columns[activeCols] = 1
-            return columns.tolist()
+    def save(self, path):
+        """
+        Saves the layer and the state of numpy's random generator to a checkpoint file
+        :param path: path of the checkpoint file
+        """
+        checkpoint.saveLayer(path, self)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a layer saved by :meth:`.save` and restores the state of numpy's random generator
+        :param path: path of the checkpoint file
+        :param mmap: (default=True) if True, permanences are memory-mapped from the file
+        :return: SpatialPooler
+        """
+        return checkpoint.loadLayer(path, mmap)
+
+    def _getState(self):
+        """Returns the metadata and arrays of the layer for a checkpoint"""
+        meta = {'inputDim': self._inputDim, 'columnDim': self._n, 'numActiveCols': self._w,
+                'pot_pct': self._pot_pct, 'minPermanence': self._minPermanence, 'activeInc': self._activeInc,
+                'inactiveDec': self._inactiveDec, 'sparse': self._sparse, 'numPotentials': self._numPotentials}
+        arrays = {'connectedBits': self._connectedBits}
+        if self._sparse:
+            arrays.update(poolOffsets=self._poolOffsets, poolInputs=self._poolInputs,
+                          poolPermanences=self._poolPermanences, poolColumns=self._poolColumns)
+        else:
+            arrays.update(permanences=self._permanences, potentials=self._potentials)
+        return meta, arrays
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """Constructs a layer from the metadata and arrays of a checkpoint"""
+        sp = cls.__new__(cls)
+        sp._inputDim = meta['inputDim']
+        sp._n = meta['columnDim']
+        sp._w = meta['numActiveCols']
+        sp._pot_pct = meta['pot_pct']
+        sp._minPermanence = meta['minPermanence']
+        sp._activeInc = meta['activeInc']
+        sp._inactiveDec = meta['inactiveDec']
+        sp._sparse = meta['sparse']
+        sp._numPotentials = meta['numPotentials']
+        sp._tieBreak = tieBreaks(sp._n)
+        sp._connectedBits = arrays['connectedBits']
+        sp._connectedMatrix = None
+        if sp._sparse:
+            sp._poolOffsets = arrays['poolOffsets']
+            sp._poolInputs = arrays['poolInputs']
+            sp._poolPermanences = arrays['poolPermanences']
+            sp._poolColumns = arrays['poolColumns']
         else:
-            return activeCols.tolist()
+            sp._permanences = arrays['permanences']
+            sp._potentials = arrays['potentials']
+        sp._stats = None
+        return sp
+
+    def enableStats(self, callback=None, every=1):
+        """
+        Starts collecting statistics of the layer, see :meth:`.getStats`. The statistics are not saved
+        with the layer; disable them before copying the layer.
+        :param callback: (default=None) function called with the layer and its statistics every `every` steps
+        :param every: (default=1) number of steps between calls of callback
+        """
+        self.disableStats()
+        self._stats = LayerStats(self, (self, '_compute'),
+                                 {'overlap': [(self, '_overlapScores')],
+                                  'inhibition': [(self, '_selectActiveColumns')],
+                                  'learn': [(self, '_learn')],
+                                  'cache': [(self, '_updateConnectedSynapses')]},
+                                 structure=self._getStructure, callback=callback, every=every)
+
+    def disableStats(self):
+        """Stops collecting statistics; the layer then runs without any instrumentation"""
+        if self._stats is not None:
+            self._stats.uninstall()
+            self._stats = None
+
+    def getStats(self):
+        """
+        Returns the statistics collected since :meth:`.enableStats`: the number of steps, the cumulative
+        time in seconds and number of calls of each phase of :meth:`.compute` (compute, overlap, inhibition,
+        learn and cache), and the current potential and connected synapses and bytes of numpy buffers of the layer
+        :return: dict, or None if statistics are disabled
+        """
+        if self._stats is None:
+            return None
+        return self._stats.getStats()
+
+    def _getStructure(self):
+        """Returns the structural statistics of the layer"""
+        potentials = len(self._poolInputs) if self._sparse else int(np.count_nonzero(self._potentials))
+        return {'potentialSynapses': potentials,
+                'connectedSynapses': int(np.unpackbits(self._connectedBits).sum(dtype=np.int64)),
+                'memoryBytes': arrayBytes(self)}
 
     def getInputDim(self):
         """Returns the size of the encoded input"""
@@ -109,3 +400,4 @@ class SpatialPooler:
     def setPermanenceThreshold(self, minPermanence):
         """Returns the permanence threshold for potentially connected synapses"""
         self._minPermanence = minPermanence
+        self._rebuildConnectedSynapses()
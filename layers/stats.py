@@ -0,0 +1,124 @@
+import time
+import numpy as np
+
+
+def arrayBytes(*objects):
+    """Returns the number of bytes of the numpy arrays held by the attributes of objects, directly or in lists"""
+    total = 0
+    for obj in objects:
+        for value in vars(obj).values():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+            elif isinstance(value, list) and value and isinstance(value[0], np.ndarray):
+                # lists hold either arrays or other values, so lists of lists of indices are not scanned
+                total += sum(item.nbytes for item in value if isinstance(item, np.ndarray))
+    return total
+
+
+class LayerStats:
+    """
+    Collects the cumulative time and number of calls of the phases of a layer and counters updated
+    after each step. Timing is installed by shadowing the methods of each phase with timed wrappers
+    on the instances that own them, and removed by deleting the wrappers, so a layer without stats
+    runs its own methods unchanged.
+    """
+
+    def __init__(self, layer, step, phases, onStep=None, structure=None, callback=None, every=1):
+        """
+        Constructs the stats of a layer and installs the timed wrappers
+        :param layer: the layer
+        :param step: tuple of object and name of the method running one step of the layer
+        :param phases: (dict) phase name -> list of tuples of object and method name
+        :param onStep: (default=None) function of the stats called after each step to update counters
+        :param structure: (default=None) function returning a dict of structural statistics of the layer
+        :param callback: (default=None) function called with the layer and its stats every `every` steps
+        :param every: (default=1) number of steps between calls of callback
+        """
+        if every < 1:
+            raise ValueError("Number of steps between callbacks must be greater than 0")
+
+        self._layer = layer
+        self._onStep = onStep
+        self._structure = structure
+        self._callback = callback
+        self._every = every
+        self._installed = []
+        self._steps = 0
+        self._times = {'compute': 0.0}
+        self._calls = {'compute': 0}
+        self._counters = {}
+
+        self._install(step[0], step[1], 'compute', self._timedStep)
+        for phase, methods in phases.items():
+            self._times[phase] = 0.0
+            self._calls[phase] = 0
+            for obj, name in methods:
+                self._install(obj, name, phase, self._timed)
+
+    def reset(self):
+        """Clears the timings and counters"""
+        self._steps = 0
+        for phase in self._times:
+            self._times[phase] = 0.0
+            self._calls[phase] = 0
+        self._counters.clear()
+
+    def add(self, counter, value):
+        """Adds value to counter"""
+        self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def getCounter(self, counter):
+        """Returns the value of counter"""
+        return self._counters.get(counter, 0)
+
+    def getStats(self):
+        """
+        Returns the statistics of the layer
+        :return: dict with the number of steps, the time and calls of each phase, the counters and the
+            structural statistics of the layer
+        """
+        stats = {'steps': self._steps,
+                 'phases': {phase: {'time': self._times[phase], 'calls': self._calls[phase]} for phase in self._times},
+                 'counters': dict(self._counters)}
+        if self._structure is not None:
+            stats.update(self._structure())
+        return stats
+
+    def uninstall(self):
+        """Removes the timed wrappers so the layer runs its own methods again"""
+        for obj, name in self._installed:
+            del obj.__dict__[name]
+        self._installed = []
+
+    def _install(self, obj, name, phase, wrap):
+        """Shadows method name of obj with a timed wrapper"""
+        setattr(obj, name, wrap(phase, getattr(obj, name)))
+        self._installed.append((obj, name))
+
+    def _timed(self, phase, method):
+        """Returns a wrapper of method adding its time and calls to phase"""
+        times = self._times
+        calls = self._calls
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[phase] += time.perf_counter() - start
+                calls[phase] += 1
+        return timed
+
+    def _timedStep(self, phase, method):
+        """Returns a wrapper of the step method that also updates the counters and calls the callback"""
+        timed = self._timed(phase, method)
+
+        def step(*args, **kwargs):
+            result = timed(*args, **kwargs)
+            self._steps += 1
+            if self._onStep is not None:
+                self._onStep(self)
+            if self._callback is not None and self._steps % self._every == 0:
+                self._callback(self._layer, self.getStats())
+            return result
+        return step
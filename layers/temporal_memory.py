@@ -1,5 +1,114 @@
+import weakref
 import numpy as np
+from sdr import SDR
 from layers.tm_cell import TMCell
+from layers.connections import Connections
+from layers.sharded_connections import ShardedConnections
+from layers import checkpoint
+from layers.stats import LayerStats, arrayBytes
+
+
+class _CellRegion:
+    """
+    Presents a grid of :class:`layers.tm_cell.TMCell` objects through the region-wide
+    interface of :class:`layers.connections.Connections`, addressing cells by flat index.
+    """
+
+    def __init__(self, tm_cell, regionDim, minPermanence, activationThreshold,
+                 minActive, maxSegmentsPerCell, maxSynapsesPerSegment):
+        self._regionDim = regionDim
+        self._activeCells = []
+        self._cells = [tm_cell(regionDim, minPermanence, activationThreshold,
+                               minActive, maxSegmentsPerCell, maxSynapsesPerSegment)
+                       for i in range(int(np.prod(regionDim)))]
+
+    def activateSegments(self, activeCells):
+        self._activeCells = activeCells
+        for cell in self._cells:
+            cell.activateSegments(activeCells)
+
+    def adaptSegment(self, cell, segment, *args):
+        self._cells[cell].adaptSegment(segment, *args)
+
+    def adaptActiveSegments(self, cell, *args):
+        self._cells[cell].adaptActiveSegments(*args)
+
+    def addSynapses(self, cell, segment, *args):
+        self._cells[cell].addSynapses(segment, *args)
+
+    def createSegment(self, cell, *args):
+        self._cells[cell].createSegment(*args)
+
+    def punishMatchingSegments(self, cell, *args):
+        self._cells[cell].punishMatchingSegments(*args)
+
+    def getActivePotentials(self, cell, activeCells):
+        return self._cells[cell].getActivePotentials(activeCells)
+
+    def getNumberOfSegments(self, cell):
+        return self._cells[cell].getNumberOfSegments()
+
+    def getNumSegments(self):
+        return int(sum(cell.getNumberOfSegments() for cell in self._cells))
+
+    def getNumSynapses(self):
+        # TMCell does not expose its synapses
+        return None
+
+    def getBestMatchingSegments(self, columns):
+        cellsPerColumn = self._regionDim[1]
+        winnerCells = np.empty(len(columns), dtype=np.int64)
+        bestSegments = np.full(len(columns), -1, dtype=np.int64)
+        for k, column in enumerate(columns):
+            cells = self._cells[column * cellsPerColumn:(column + 1) * cellsPerColumn]
+            cellActivePotentials = [cell.getActivePotentials(self._activeCells) for cell in cells]
+            maxActivePotentials = [max(activePotentials) for activePotentials in cellActivePotentials]
+            if np.max(maxActivePotentials) > 0:
+                winnerCell = np.argmax(maxActivePotentials)
+                bestSegments[k] = np.argmax(cellActivePotentials[winnerCell])
+            else:
+                winnerCell = np.argmin([cell.getNumberOfSegments() for cell in cells])
+            winnerCells[k] = column * cellsPerColumn + winnerCell
+        return winnerCells, bestSegments
+
+    def getPredictiveStates(self):
+        return np.array([cell.predictive() for cell in self._cells], dtype=bool)
+
+    def getMatchingStates(self):
+        return np.array([cell.matching() for cell in self._cells], dtype=bool)
+
+    def matching(self, cell):
+        return self._cells[cell].matching()
+
+    def predictive(self, cell):
+        return self._cells[cell].predictive()
+
+
+class StreamState:
+    """
+    The activity of one input stream of a :class:`.TemporalMemory`: its active and winner cells and
+    the segment activity they caused. The learned segments and synapses are kept by the layer and
+    shared by all of its streams, so a stream is as small as its activity.
+    """
+
+    def __init__(self, n, activity):
+        """
+        Constructs the state of a stream at the start of a sequence
+        :param n: (int) number of cells in the region
+        :param activity: segment activity of no active cells, see :meth:`layers.connections.Connections.getActivity`
+        """
+        self._n = n
+        self._activeCells = SDR(n, sparse=[])
+        self._winnerCells = np.zeros(0, dtype=np.int64)
+        self._activity = activity
+
+    def getActiveCells(self):
+        """Returns the SDR of active cells of the stream"""
+        return self._activeCells
+
+    def getWinnerCells(self):
+        """Returns the SDR of winner cells of the stream"""
+        return SDR(self._n, sparse=self._winnerCells)
 
 
 class TemporalMemory:
@@ -12,10 +121,11 @@ class TemporalMemory:
 
     def __init__(self, tm_cell, columnDim, cellsPerColumn, maxSegmentsPerCell, maxSynapsesPerSegment,
                  minActive, activationThreshold, minPermanence, initialPermanence, maxNewSynapses,
-                 permanenceInc, permanenceDec, seed=45):
+                 permanenceInc, permanenceDec, seed=45, shards=None, workers=None):
         """
         Constructs a Temporal Memory layer 
-        :param tm_cell: 
+        :param tm_cell: TMCell class for the cells of the region, or :class:`layers.connections.Connections`
+            to keep the segments of the whole region in one flat store
         :param columnDim: 
         :param cellsPerColumn: 
         :param maxSegmentsPerCell: 
@@ -28,6 +138,10 @@ class TemporalMemory:
         :param permanenceInc: 
         :param permanenceDec: 
         :param seed: 
+        :param shards: (default=None) number of shards of columns learning and activating in parallel, see
+            :class:`layers.sharded_connections.ShardedConnections`; requires Connections for tm_cell
+        :param workers: (default=None) number of worker processes of the shards; None uses one per shard, 1
+            runs the shards in this process. Call :meth:`.close` to stop the workers.
         """
 
         if not isinstance(tm_cell, type(TMCell)):
@@ -54,20 +168,38 @@ class TemporalMemory:
         self._permanenceInc = permanenceInc
         self._permanenceDec = permanenceDec
 
-        self._cells = [[tm_cell((columnDim, cellsPerColumn), minPermanence, activationThreshold,
-                                minActive, maxSegmentsPerCell, maxSynapsesPerSegment)
-                        for j in range(cellsPerColumn)]
-                       for i in range(columnDim)]
-
-        self._activeCells = []
-        self._winnerCells = []
-
-    def compute(self, activeColumns, learn=True):
+        if shards is not None:
+            if not issubclass(tm_cell, Connections):
+                raise TypeError("Only a TemporalMemory using Connections can be sharded")
+            self._connections = ShardedConnections((columnDim, cellsPerColumn), minPermanence, activationThreshold,
+                                                   minActive, maxSegmentsPerCell, maxSynapsesPerSegment, shards,
+                                                   workers, seed, tm_cell)
+        elif issubclass(tm_cell, Connections):
+            self._connections = tm_cell((columnDim, cellsPerColumn), minPermanence, activationThreshold,
+                                        minActive, maxSegmentsPerCell, maxSynapsesPerSegment)
+        else:
+            self._connections = _CellRegion(tm_cell, (columnDim, cellsPerColumn), minPermanence,
+                                            activationThreshold, minActive, maxSegmentsPerCell,
+                                            maxSynapsesPerSegment)
+
+        self._activeCells = SDR(self._n, sparse=[])
+        self._winnerCells = np.zeros(0, dtype=np.int64)
+        self._updateCellStates()
+        self._stats = None
+        self._streams = weakref.WeakSet()
+        self._compactionInterval = None
+        self._compactionCallback = None
+        self._compactionSegments = None
+        self._steps = 0
+
+    def compute(self, activeColumns, learn=True, anomaly=False):
         """
-        
-        :param activeColumns: 
-        :param learn: 
-        :return: 
+        Computes the active, winner and predictive cells of the region for the active columns
+        :param activeColumns: SDR or list of indices of active columns
+        :param learn: (default=True) if True, segments and synapses are adapted and grown
+        :param anomaly: (default=False) if True, also returns the raw anomaly score: the fraction of
+            active columns that were not predicted at t-1 (0 if no column is active)
+        :return: tuple of SDRs of active cells and predictive cells, and the raw anomaly score if anomaly is True
         
         Algorithm:
         ACTIVE COLUMNS W PREDICTIVE CELLS
@@ -93,109 +225,302 @@ class TemporalMemory:
         Find matching segments using current active cells (t) [cols,cells,segments,cols,cells] w/ [cols,cells]
         """
 
-        prevActiveCells = self._activeCells
-        prevWinnerCells = self._winnerCells
+        if anomaly:
+            activeColumns = SDR.convert(activeColumns, self._columnDim)
+            numActive = len(activeColumns.sparse)
+            anomalyScore = 1.0 - np.count_nonzero(self._predictedColumns[activeColumns.sparse]) / numActive \
+                if numActive else 0.0
+
+        self._activeCells, self._winnerCells = self._computeCells(self._activeCells, self._winnerCells,
+                                                                  self._predictiveCells, activeColumns, learn)
+        self._connections.activateSegments(self._activeCells.sparse)
+        self._updateCellStates()
 
-        predictiveStates = np.array([[cell.predictive() for cell in col] for col in self._cells], dtype=np.int8)
-        columns = np.zeros((self._columnDim, self._cellsPerColumn), dtype=np.int8)
-        columns[activeColumns, :] = 1
-        winnerCells = activeCells = np.logical_and(columns, predictiveStates)
-        self._winnerCells = (np.flatnonzero(winnerCells)).tolist()
-        predictedCells = np.transpose(np.nonzero(activeCells))
-        activeCellsPerColumn = np.sum(activeCells, axis=1) > 0
-        burstingColumns = np.where(activeCellsPerColumn != columns[:, 0])[0]
-        activeCells[burstingColumns, :] = 1
-        self._activeCells = (np.flatnonzero(activeCells)).tolist()
-        self._findWinnerCells(burstingColumns, prevWinnerCells, learn)
+        self._steps += 1
+        if self._compactionInterval is not None and self._steps % self._compactionInterval == 0:
+            self.compact(self._compactionSegments)
+
+        if anomaly:
+            return self._activeCells, SDR(self._n, sparse=np.flatnonzero(self._predictiveCells)), anomalyScore
+        return self._activeCells, SDR(self._n, sparse=np.flatnonzero(self._predictiveCells))
+
+    def _computeCells(self, prevActiveCells, prevWinnerCells, predictiveCells, activeColumns, learn):
+        """
+        Computes the active and winner cells for the active columns from the cell states at t-1
+        and adapts the connections, see :meth:`.compute`
+        :param prevActiveCells: SDR of active cells at t-1
+        :param prevWinnerCells: numpy array of winner cells at t-1
+        :param predictiveCells: boolean numpy array of the predictive state of every cell at t-1
+        :param activeColumns: SDR or list of indices of active columns
+        :param learn: if True, segments and synapses are adapted and grown
+        :return: tuple of SDR of active cells and numpy array of winner cells
+        """
+        predictiveStates = predictiveCells.reshape((self._columnDim, self._cellsPerColumn))
+        columns = SDR.convert(activeColumns, self._columnDim).dense.view(bool)[:, np.newaxis]
+        activeCells = np.logical_and(columns, predictiveStates)
+        predictedCells = np.flatnonzero(activeCells)
+        burstingColumns = np.flatnonzero(np.logical_and(columns[:, 0], np.logical_not(np.any(activeCells, axis=1))))
+        activeCells[burstingColumns, :] = True
+        inactivePredictedCells = np.flatnonzero(np.logical_and(np.logical_not(columns), predictiveStates))
+
+        if isinstance(self._connections, ShardedConnections):
+            connections = self._connections
+            burstingWinnerCells = np.concatenate(connections.map(
+                _ShardLearner(self, prevActiveCells, prevWinnerCells, learn),
+                connections.splitColumns(burstingColumns), connections.splitCells(predictedCells),
+                connections.splitCells(inactivePredictedCells)))
+        else:
+            burstingWinnerCells = self._learnCells(self._connections, burstingColumns, predictedCells,
+                                                   inactivePredictedCells, prevActiveCells, prevWinnerCells, learn)
+
+        return SDR(self._n, dense=activeCells), np.concatenate((predictedCells, burstingWinnerCells))
+
+    def _learnCells(self, connections, burstingColumns, predictedCells, inactivePredictedCells, prevActiveCells,
+                    prevWinnerCells, learn):
+        """
+        Finds the winner cells of the bursting columns and adapts the segments of the active and inactive
+        predicted cells, see :meth:`._computeCells`
+        :param connections: connections of the cells, or of the shard owning them
+        :param burstingColumns: numpy array of bursting columns
+        :param predictedCells: numpy array of active predicted cells
+        :param inactivePredictedCells: numpy array of predicted cells in inactive columns
+        :param prevActiveCells: SDR of active cells at t-1
+        :param prevWinnerCells: numpy array of winner cells at t-1
+        :param learn: if True, segments and synapses are adapted and grown
+        :return: numpy array of winner cells of the bursting columns
+        """
+        winnerCells = self._findWinnerCells(connections, burstingColumns, prevWinnerCells, learn)
 
         if learn:
-            for i, j in predictedCells:  # for active predicted cells
-                self._cells[i][j].adaptActiveSegments(prevActiveCells,
-                                                      self._maxNewSynapses,
-                                                      prevWinnerCells,
-                                                      self._initialPermanence,
-                                                      self._permanenceInc,
-                                                      self._permanenceDec)
+            for cell in predictedCells:  # for active predicted cells
+                connections.adaptActiveSegments(cell,
+                                                prevActiveCells.sparse,
+                                                self._maxNewSynapses,
+                                                prevWinnerCells,
+                                                self._initialPermanence,
+                                                self._permanenceInc,
+                                                self._permanenceDec)
 
-            inactivePredictedCells = np.logical_and(np.logical_not(columns), predictiveStates)
-            inactivePredictedCells = np.transpose(np.nonzero(inactivePredictedCells))
-            for i, j in inactivePredictedCells:
-                self._cells[i][j].punishMatchingSegments(prevActiveCells, self._permanenceDec)
+            for cell in inactivePredictedCells:
+                connections.punishMatchingSegments(cell, prevActiveCells.sparse, self._permanenceDec)
 
-        for col in self._cells:
-            for cell in col:
-                cell.activateSegments(self._activeCells)
+        return winnerCells
 
-        predictiveStates = np.array([[cell.predictive() for cell in col] for col in self._cells], dtype=np.int8)
-        predictiveCells = (np.flatnonzero(predictiveStates)).tolist()
+    def createStream(self):
+        """
+        Creates the state of a new input stream sharing the segments and synapses of the layer.
+        Streams are advanced with :meth:`.compute_streams`.
+        Only layers using :class:`layers.connections.Connections` support streams.
+        :return: StreamState
+        """
+        if not isinstance(self._connections, Connections):
+            raise TypeError("Only a TemporalMemory using Connections supports streams")
+        stream = StreamState(self._n, self._connections.computeActivity([[]])[0])
+        self._streams.add(stream)
+        return stream
 
-        return self._activeCells, predictiveCells
+    def compact(self, maxSegments=None):
+        """
+        Repacks the segments and synapses of the layer so that activation scans only live synapses, see
+        :meth:`layers.connections.Connections.compact`. A full pass renumbers the segments, and the segment
+        activity of the layer and of its streams with them; an incremental pass of at most maxSegments
+        segments keeps the segment indices. Only layers using :class:`layers.connections.Connections` can
+        be compacted.
+        :param maxSegments: (default=None) maximum number of segment rows packed by an incremental pass, for
+            each shard of a sharded layer; None runs a full pass
+        :return: dict with the numbers of removed segments and reclaimed synapse slots, the bytes of the
+            buffers before and after, and whether the pass completed
+        """
+        if not isinstance(self._connections, (Connections, ShardedConnections)):
+            raise TypeError("Only a TemporalMemory using Connections can be compacted")
+        segmentMap, report = self._connections.compact(maxSegments)
+        if segmentMap is not None:
+            for stream in self._streams:
+                stream._activity = Connections.remapActivity(stream._activity, segmentMap)
+
+        if self._stats is not None:
+            self._stats.add('compactions', 1)
+            self._stats.add('bytesReclaimed', report['bytesReclaimed'])
+        if self._compactionCallback is not None:
+            self._compactionCallback(self, report)
+        return report
+
+    def setCompactionInterval(self, steps, callback=None, maxSegments=None):
+        """
+        Compacts the layer every `steps` calls of :meth:`.compute`, see :meth:`.compact`
+        :param steps: number of steps between compactions, or None to stop compacting
+        :param callback: (default=None) function called with the layer and the report of each compaction
+        :param maxSegments: (default=None) if given, each compaction is an incremental pass over at most
+            maxSegments segments, which bounds the time it takes; None runs full passes
+        """
+        if steps is not None:
+            if not isinstance(self._connections, (Connections, ShardedConnections)):
+                raise TypeError("Only a TemporalMemory using Connections can be compacted")
+            if steps < 1:
+                raise ValueError("Number of steps between compactions must be greater than 0")
+            if maxSegments is not None and maxSegments < 1:
+                raise ValueError("Maximum number of segments must be greater than 0")
+        self._compactionInterval = steps
+        self._compactionCallback = callback
+        self._compactionSegments = maxSegments
+
+    def close(self):
+        """Stops the worker processes of a sharded layer, see :class:`layers.sharded_connections.ShardedConnections`"""
+        if isinstance(self._connections, ShardedConnections):
+            self._connections.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def compute_streams(self, streams, activeColumns, learn=False):
+        """
+        Advances several independent input streams by one step. Without learning, the cell states of
+        all streams are computed together and the segment activity of all streams is found in one pass
+        over the synapses of their active cells. With learning, the streams are computed one at a time
+        in order, as with :meth:`.compute`, since each adapts the shared connections.
+        :param streams: list of StreamState created by :meth:`.createStream`
+        :param activeColumns: list of SDRs or lists of indices of active columns, one for each stream
+        :param learn: (default=False) if True, segments and synapses are adapted and grown
+        :return: list of tuples of SDRs of active cells and predictive cells, one for each stream
+        """
+        if len(streams) != len(activeColumns):
+            raise ValueError("Expecting active columns for %d streams but got %d" % (len(streams), len(activeColumns)))
 
-    def _findWinnerCells(self, burstingColumns, prevWinnerCells, learn):
+        if learn:
+            activity = self._connections.getActivity()
+            for stream, columns in zip(streams, activeColumns):
+                self._connections.setActivity(stream._activity)
+                stream._activeCells, stream._winnerCells = self._computeCells(
+                    stream._activeCells, stream._winnerCells, self._connections.getPredictiveStates(), columns, learn)
+                self._connections.activateSegments(stream._activeCells.sparse)
+                stream._activity = self._connections.getActivity()
+            self._connections.setActivity(activity)
+        else:
+            self._computeStreamCells(streams, activeColumns)
+            activities = self._connections.computeActivity([stream._activeCells.sparse for stream in streams])
+            for stream, activity in zip(streams, activities):
+                stream._activity = activity
+
+        segmentCells = self._connections._segmentCells
+        return [(stream._activeCells, SDR(self._n, sparse=np.unique(segmentCells[stream._activity[0]])))
+                for stream in streams]
+
+    def _computeStreamCells(self, streams, activeColumns):
+        """
+        Computes the active and winner cells of several streams together without learning, see
+        :meth:`._computeCells`. Cells and columns of stream k are keyed by k * n + cell and k * columnDim + column.
+        """
+        numStreams = len(streams)
+        segmentCells = self._connections._segmentCells
+        columnKeys = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                    [SDR.convert(columns, self._columnDim).sparse + k * self._columnDim
+                                     for k, columns in enumerate(activeColumns)])
+        predictiveKeys = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                                  [segmentCells[stream._activity[0]] + k * self._n
+                                                   for k, stream in enumerate(streams)]))
+
+        predictedColumnKeys = predictiveKeys // self._cellsPerColumn
+        predictedCells = predictiveKeys[np.isin(predictedColumnKeys, columnKeys)]
+        burstingKeys = columnKeys[np.logical_not(np.isin(columnKeys, predictedColumnKeys))]
+        burstingCells = (burstingKeys[:, np.newaxis] * self._cellsPerColumn + np.arange(self._cellsPerColumn)).ravel()
+        activeCells = np.union1d(predictedCells, burstingCells)
+
+        burstingStreams = burstingKeys // self._columnDim
+        burstingBounds = np.searchsorted(burstingStreams, np.arange(numStreams + 1))
+        winnerCells, _ = self._connections.getStreamBestMatchingSegments(
+            [burstingKeys[burstingBounds[k]:burstingBounds[k + 1]] - k * self._columnDim for k in range(numStreams)],
+            [stream._activity for stream in streams])
+
+        bounds = np.arange(numStreams + 1) * self._n
+        activeBounds = np.searchsorted(activeCells, bounds)
+        predictedBounds = np.searchsorted(predictedCells, bounds)
+        for k, stream in enumerate(streams):
+            stream._activeCells = SDR(self._n, sparse=activeCells[activeBounds[k]:activeBounds[k + 1]] - bounds[k])
+            stream._winnerCells = np.concatenate((predictedCells[predictedBounds[k]:predictedBounds[k + 1]] - bounds[k],
+                                                  winnerCells[burstingBounds[k]:burstingBounds[k + 1]]))
+
+    def reset(self):
+        """
+        Clears the activity of the region so the next input starts a new sequence.
+        Learned segments and synapses are kept.
+        """
+        self._activeCells = SDR(self._n, sparse=[])
+        self._winnerCells = np.zeros(0, dtype=np.int64)
+        self._connections.activateSegments(self._activeCells.sparse)
+        self._updateCellStates()
+
+    def _updateCellStates(self):
+        """
+        Caches the predictive and matching states of the region after segment activation.
+        The cached arrays are read-only and replaced on every step, so arrays handed out by
+        the getters keep the states of the step they were requested in.
+        """
+        self._predictiveCells = self._connections.getPredictiveStates()
+        self._predictiveCells.flags.writeable = False
+        self._predictedColumns = np.any(self._predictiveCells.reshape((self._columnDim, self._cellsPerColumn)),
+                                        axis=1)
+        self._predictedColumns.flags.writeable = False
+        self._matchingCells = self._connections.getMatchingStates()
+        self._matchingCells.flags.writeable = False
+
+    def _findWinnerCells(self, connections, burstingColumns, prevWinnerCells, learn):
         """
         Find winner cell in each bursting column
                 Cell with most active matching segment from t-l OR
                 Cell with least number of segments
-        :param burstingColumns: 
-        :param prevWinnerCells: 
-        :param learn: 
-        :return: 
+        The active matching synapse counts are those of the segment activation at t-l.
+        :param connections: connections of the cells of the bursting columns
+        :param burstingColumns: (array-like) indices of bursting columns
+        :param prevWinnerCells: (array-like) list of previous winner cells to grow to
+        :param learn: if True, adapt the best matching segments or grow new segments on winner cells
+        :return: numpy array of winner cells of the bursting columns
         """
 
-        for column in burstingColumns:
-            cellActivePotentials = []  # sequence of counts of active matching potentials for each cell
-            maxActivePotentials = []  # max numbers of active matching potentials for each cell
-            for i in range(self._cellsPerColumn):
-                cellActivePotentials.append(self._cells[column][i].getActivePotentials(self._activeCells))
-                maxActivePotentials.append(max(cellActivePotentials[-1]))
-
-            if np.max(maxActivePotentials) > 0:
-                # winner cell is cell with most active matching segment
-                winnerCell = np.array(maxActivePotentials).argmax()
-                if learn:
-                    segment = np.argmax(cellActivePotentials[winnerCell])
-                    self._cells[column][winnerCell].adaptSegment(segment,
-                                                                 prevWinnerCells,
-                                                                 self._maxNewSynapses,
-                                                                 self._initialPermanence,
-                                                                 self._permanenceInc,
-                                                                 self._permanenceDec)
-
-            else:
-                # winner cell is cell with least number of segments
-                segmentCounts = [self._cells[column][i].getNumberOfSegments() for i in range(self._cellsPerColumn)]
-                winnerCell = np.array(segmentCounts).argmin()
-
-                if learn:
-                    self._cells[column][winnerCell].createSegment(self._maxNewSynapses,
-                                                                  prevWinnerCells,
-                                                                  self._initialPermanence)
+        winnerCells, bestSegments = connections.getBestMatchingSegments(burstingColumns)
 
-            self._winnerCells.append(int(column * self._cellsPerColumn + winnerCell))
+        if learn:
+            for winnerCell, segment in zip(winnerCells, bestSegments):
+                if segment >= 0:
+                    # winner cell is cell with most active matching segment
+                    connections.adaptSegment(winnerCell,
+                                             segment,
+                                             prevWinnerCells,
+                                             self._maxNewSynapses,
+                                             self._initialPermanence,
+                                             self._permanenceInc,
+                                             self._permanenceDec)
+                else:
+                    # winner cell is cell with least number of segments
+                    connections.createSegment(winnerCell,
+                                              self._maxNewSynapses,
+                                              prevWinnerCells,
+                                              self._initialPermanence)
+
+        return winnerCells
 
     def getWinnerCells(self, asarray=False):
         """
         Returns the winner cells in the region
-        :param asarray: If True, returns array of winner cell states; otherwise, returns list of indices
-        :return: numpy array
+        :param asarray: If True, returns array of winner cell states; otherwise, returns SDR of winner cells
+        :return: numpy array OR SDR
         """
+        winnerCells = SDR(self._n, sparse=self._winnerCells)
         if asarray:
-            winnerCells = np.zeros(self._n, dtype=np.int8)
-            winnerCells[self._winnerCells] = 1
-            return winnerCells
+            return winnerCells.dense
         else:
-            return self._winnerCells
+            return winnerCells
 
     def getActiveCells(self, asarray=False):
         """
         Returns the active cells in the region
-        :param asarray: If True, returns array of active cell states; otherwise, returns list of indices
-        :return: numpy array
+        :param asarray: If True, returns array of active cell states; otherwise, returns SDR of active cells
+        :return: numpy array OR SDR
         """
         if asarray:
-            activeCells = np.zeros(self._n, dtype=np.int8)
-            activeCells[self._activeCells] = 1
-            return activeCells
+            return self._activeCells.dense
         else:
             return self._activeCells
 
@@ -205,11 +530,10 @@ class TemporalMemory:
         :param asarray: If True, returns array of predictive cell states; otherwise, returns list of predictive cells
         :return: numpy array
         """
-        predictiveStates = np.array([[cell.predictive() for cell in col] for col in self._cells], dtype=np.int8)
         if asarray:
-            return predictiveStates.flatten()
+            return self._predictiveCells.view(np.int8)
         else:
-            return np.flatnonzero(predictiveStates)
+            return np.flatnonzero(self._predictiveCells)
 
     def getPredictedColumns(self, asarray=True):
         """
@@ -217,12 +541,154 @@ class TemporalMemory:
         :param asarray: If True, returns array of predictive column states; otherwise, returns list of predicted columns
         :return: numpy array
         """
-        predictiveStates = np.array([[cell.predictive() for cell in col] for col in self._cells], dtype=np.int8)
-        prediction = np.sum(predictiveStates, axis=1) > 0
         if asarray:
-            return prediction
+            return self._predictedColumns
+        else:
+            return np.flatnonzero(self._predictedColumns)
+
+    def getMatchingCells(self, asarray=True):
+        """
+        Returns the cells in the region in the matching state
+        :param asarray: If True, returns array of matching cell states; otherwise, returns list of matching cells
+        :return: numpy array
+        """
+        if asarray:
+            return self._matchingCells.view(np.int8)
+        else:
+            return np.flatnonzero(self._matchingCells)
+
+    def enableStats(self, callback=None, every=1):
+        """
+        Starts collecting statistics of the layer, see :meth:`.getStats`. The statistics are not saved
+        with the layer; disable them before copying the layer.
+        :param callback: (default=None) function called with the layer and its statistics every `every` steps
+        :param every: (default=1) number of steps between calls of callback
+        """
+        self.disableStats()
+        connections = self._connections
+        # shards in worker processes cannot be timed from this process; shards run in turn add up their times
+        if isinstance(connections, ShardedConnections):
+            learners = [] if connections.usesWorkers() else connections.getShards()
+        else:
+            learners = [connections]
+        self._stats = LayerStats(self, (self, 'compute'),
+                                 {'winners': [(learner, 'getBestMatchingSegments') for learner in learners],
+                                  'adapt': [(learner, name) for learner in learners
+                                            for name in ('adaptActiveSegments', 'adaptSegment', 'createSegment')],
+                                  'punish': [(learner, 'punishMatchingSegments') for learner in learners],
+                                  'activate': [(connections, 'activateSegments')],
+                                  'states': [(self, '_updateCellStates')],
+                                  'compact': [(connections, 'compact')]
+                                  if isinstance(connections, (Connections, ShardedConnections)) else []},
+                                 self._countColumns, self._getStructure, callback, every)
+
+    def disableStats(self):
+        """Stops collecting statistics; the layer then runs without any instrumentation"""
+        if self._stats is not None:
+            self._stats.uninstall()
+            self._stats = None
+
+    def getStats(self):
+        """
+        Returns the statistics collected since :meth:`.enableStats`: the number of steps, the cumulative
+        time in seconds and number of calls of each phase of :meth:`.compute` (compute, winners, adapt,
+        punish, activate, states and compact), the counts of active and bursting columns, the number of
+        compactions and bytes they reclaimed, and the current segments, synapses, fraction of bursting
+        columns and bytes of numpy buffers of the layer
+        :return: dict, or None if statistics are disabled
+        """
+        if self._stats is None:
+            return None
+        return self._stats.getStats()
+
+    def _countColumns(self, stats):
+        """Counts the active and bursting columns of the last step"""
+        columnCells = np.bincount(self._activeCells.sparse // self._cellsPerColumn, minlength=self._columnDim)
+        stats.add('activeColumns', int(np.count_nonzero(columnCells)))
+        stats.add('burstingColumns', int(np.count_nonzero(columnCells == self._cellsPerColumn)))
+
+    def _getStructure(self):
+        """Returns the structural statistics of the layer"""
+        if isinstance(self._connections, ShardedConnections):
+            numSegments, numSynapses, shardBytes = self._connections.getSizes()
+            memoryBytes = arrayBytes(self, self._connections) + shardBytes
         else:
-            return np.flatnonzero(prediction)
+            numSegments, numSynapses = self._connections.getNumSegments(), self._connections.getNumSynapses()
+            memoryBytes = arrayBytes(self, self._connections, *getattr(self._connections, '_cells', []))
+        activeColumns = self._stats.getCounter('activeColumns')
+        return {'segments': numSegments,
+                'synapses': numSynapses,
+                'burstingColumnFraction': self._stats.getCounter('burstingColumns') / activeColumns
+                if activeColumns else 0.0,
+                'memoryBytes': memoryBytes}
+
+    def save(self, path):
+        """
+        Saves the layer and the state of numpy's random generator to a checkpoint file.
+        Only layers using :class:`layers.connections.Connections` can be saved; the shards of a sharded
+        layer are saved with the states of their random generators.
+        :param path: path of the checkpoint file
+        """
+        checkpoint.saveLayer(path, self)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a layer saved by :meth:`.save` and restores the state of numpy's random generator
+        :param path: path of the checkpoint file
+        :param mmap: (default=True) if True, segments and synapses are memory-mapped from the file
+        :return: TemporalMemory
+        """
+        return checkpoint.loadLayer(path, mmap)
+
+    def _getState(self):
+        """Returns the metadata and arrays of the layer for a checkpoint"""
+        if not isinstance(self._connections, (Connections, ShardedConnections)):
+            raise TypeError("Only a TemporalMemory using Connections can be saved")
+        meta = {'columnDim': self._columnDim, 'cellsPerColumn': self._cellsPerColumn,
+                'maxSegmentsPerCell': self._maxSegmentsPerCell, 'maxSynapsesPerSegment': self._maxSynapsesPerSegment,
+                'minActive': self._minActive, 'activationThreshold': self._activationThreshold,
+                'minPermanence': self._minPermanence, 'initialPermanence': self._initialPermanence,
+                'maxNewSynapses': self._maxNewSynapses, 'permanenceInc': self._permanenceInc,
+                'permanenceDec': self._permanenceDec,
+                'sharded': isinstance(self._connections, ShardedConnections)}
+        arrays = {'activeCells': self._activeCells.sparse, 'winnerCells': self._winnerCells}
+        connectionsMeta, connectionsArrays = self._connections._getState()
+        meta['connectionsMeta'] = connectionsMeta
+        for name, array in connectionsArrays.items():
+            arrays['connections/' + name] = array
+        return meta, arrays
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """Constructs a layer from the metadata and arrays of a checkpoint"""
+        tm = cls.__new__(cls)
+        tm._columnDim = meta['columnDim']
+        tm._cellsPerColumn = meta['cellsPerColumn']
+        tm._n = tm._columnDim * tm._cellsPerColumn
+        tm._maxSegmentsPerCell = meta['maxSegmentsPerCell']
+        tm._maxSynapsesPerSegment = meta['maxSynapsesPerSegment']
+        tm._minActive = meta['minActive']
+        tm._activationThreshold = meta['activationThreshold']
+        tm._minPermanence = meta['minPermanence']
+        tm._initialPermanence = meta['initialPermanence']
+        tm._maxNewSynapses = meta['maxNewSynapses']
+        tm._permanenceInc = meta['permanenceInc']
+        tm._permanenceDec = meta['permanenceDec']
+        connectionsArrays = {name[len('connections/'):]: array for name, array in arrays.items()
+                             if name.startswith('connections/')}
+        connectionsClass = ShardedConnections if meta.get('sharded') else Connections
+        tm._connections = connectionsClass._fromState(meta['connectionsMeta'], connectionsArrays)
+        tm._activeCells = SDR(tm._n, sparse=arrays['activeCells'])
+        tm._winnerCells = np.asarray(arrays['winnerCells'])
+        tm._updateCellStates()
+        tm._stats = None
+        tm._streams = weakref.WeakSet()
+        tm._compactionInterval = None
+        tm._compactionCallback = None
+        tm._compactionSegments = None
+        tm._steps = 0
+        return tm
 
     def getWidth(self):
         """Returns the total number of cells in the region"""
@@ -251,3 +717,28 @@ class TemporalMemory:
     def setPermanenceThreshold(self, minPermanence):
         """Returns the permanence threshold for connected synapses"""
         self._minPermanence = minPermanence
+
+
+class _ShardLearner:
+    """
+    Learning step of the cells of a shard with the learning parameters of a layer, see
+    :meth:`TemporalMemory._learnCells`. Unlike a closure over the layer it can be pickled, so shards can
+    learn in worker processes.
+    """
+
+    _learnCells = TemporalMemory._learnCells
+    _findWinnerCells = TemporalMemory._findWinnerCells
+
+    def __init__(self, layer, prevActiveCells, prevWinnerCells, learn):
+        self._maxNewSynapses = layer._maxNewSynapses
+        self._initialPermanence = layer._initialPermanence
+        self._permanenceInc = layer._permanenceInc
+        self._permanenceDec = layer._permanenceDec
+        # only the sparse form of the active cells is sent to the workers
+        self._prevActiveCells = SDR(layer._n, sparse=prevActiveCells.sparse)
+        self._prevWinnerCells = prevWinnerCells
+        self._learn = learn
+
+    def __call__(self, shard, burstingColumns, predictedCells, inactivePredictedCells):
+        return self._learnCells(shard, burstingColumns, predictedCells, inactivePredictedCells, self._prevActiveCells,
+                                self._prevWinnerCells, self._learn)
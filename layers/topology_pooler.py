@@ -1,7 +1,235 @@
 # Handles multi-dimensional data
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sdr import SDR
+from layers import checkpoint
+from layers.spatial_pooler import tieBreaks, permanenceUpdates
 
 
 class TopologyPooler:
+    """
+    This class implements the Spatial Pooling algorithm with topology for 2-D inputs such as images
+    and sensor grids. Columns are laid out on a 2-D grid over the input; each column's potential pool
+    lies in a square window of the input around its center, and columns inhibit each other only within
+    a square neighborhood of the column grid, so every neighborhood keeps about the same density of
+    active columns.
 
-    def __init__(self, n):
-        self._n = n
+    The permanences of each column are kept as a window-sized patch aligned with its center, so
+    overlap and learning read the input through sliding windows instead of per-column index lists.
+    """
+
+    def __init__(self, inputDim, columnDim=(64, 64), potentialRadius=8, inhibitionRadius=5, localDensity=0.02,
+                 pot_pct=0.5, stimulusThreshold=1, minPermanence=0.1, activeInc=0.05, inactiveDec=0.008, seed=23):
+        """
+        Constructs a Topology Pooling layer and initializes variables
+        :param inputDim: (tuple of 2 integers) The dimensions of the 2-D input grid
+        :param columnDim: (default=(64, 64)) The dimensions of the 2-D column grid; the output length is their product
+        :param potentialRadius: (default=8) The radius in input bits of the window of a column's potential pool
+        :param inhibitionRadius: (default=5) The radius in columns of the neighborhood a column competes within
+        :param localDensity: (default=0.02) The fraction of active columns in each inhibition neighborhood
+        :param pot_pct: (default=0.5) The percentage of input bits of the window that are potential synapses
+        :param stimulusThreshold: (default=1) The minimum overlap score for a column to become active
+        :param minPermanence: (default=0.1) The permanence threshold for potentially connected synapses
+        :param activeInc: (default=0.05) The increment value for active synapse permanence learning
+        :param inactiveDec: (default=0.008) The decrement value for inactive synapse permanence learning
+        :param seed: (default=23) The seed for the random number generator
+        """
+
+        if len(inputDim) != 2 or len(columnDim) != 2:
+            raise ValueError("Expecting 2-D input and column dimensions but got %s and %s" % (inputDim, columnDim))
+        if min(inputDim) <= 0 or min(columnDim) <= 0:
+            raise ValueError("Input and column dimensions must be greater than 0")
+        if potentialRadius < 0 or inhibitionRadius < 0:
+            raise ValueError("Potential and inhibition radii must not be negative")
+        if localDensity <= 0 or localDensity > 1:
+            raise ValueError("localDensity must be a number between 0 and 1")
+
+        np.random.seed(seed)
+
+        self._inputDim = tuple(inputDim)
+        self._columnDim = tuple(columnDim)
+        self._n = int(np.prod(columnDim))
+        self._potentialRadius = potentialRadius
+        self._inhibitionRadius = inhibitionRadius
+        self._localDensity = localDensity
+        self._pot_pct = pot_pct
+        self._stimulusThreshold = stimulusThreshold
+        self._minPermanence = minPermanence
+        self._activeInc = activeInc
+        self._inactiveDec = inactiveDec
+        self._initTopology()
+
+        # window of input bits of each column, relative to its center; bits outside the input are never potential
+        size = 2 * potentialRadius + 1
+        offsets = np.arange(-potentialRadius, potentialRadius + 1)
+        rows = self._centerRows[:, np.newaxis] + offsets
+        cols = self._centerCols[:, np.newaxis] + offsets
+        inside = (((rows >= 0) & (rows < inputDim[0]))[:, np.newaxis, :, np.newaxis] &
+                  ((cols >= 0) & (cols < inputDim[1]))[np.newaxis, :, np.newaxis, :])
+        self._potentials = (np.random.random((self._n, size, size)) < pot_pct) & inside.reshape((self._n, size, size))
+        self._permanences = np.zeros((self._n, size, size), dtype=np.float32)
+        self._permanences[self._potentials] = np.random.normal(loc=minPermanence, scale=0.25*minPermanence,
+                                                               size=np.count_nonzero(self._potentials))
+        np.clip(self._permanences, 0.0, 1.0, out=self._permanences)
+        self._connected = self._permanences >= minPermanence
+
+    def _initTopology(self):
+        """Computes the input centers of the columns and the number of active columns of each neighborhood"""
+        (inputRows, inputCols), (columnRows, columnCols) = self._inputDim, self._columnDim
+        self._centerRows = ((np.arange(columnRows) + 0.5) * inputRows / columnRows).astype(np.int64)
+        self._centerCols = ((np.arange(columnCols) + 0.5) * inputCols / columnCols).astype(np.int64)
+        self._tieBreak = tieBreaks(self._n).reshape(self._columnDim)
+
+        # columns of each neighborhood that lie on the grid, the column itself included
+        radius = self._inhibitionRadius
+        inside = np.pad(np.ones(self._columnDim, dtype=np.int64), radius)
+        neighbors = sliding_window_view(inside, (2 * radius + 1, 2 * radius + 1)).sum(axis=(2, 3))
+        self._numActiveLocal = np.maximum((0.5 + self._localDensity * neighbors).astype(np.int64), 1)
+
+    def compute(self, encodedInput, learn=True, asarray=False):
+        """
+        Returns a sparse distributed representation of the input as an SDR of active columns or if 'asarray'
+        is True, as a 1-D array of length returned by :meth:`.getWidth`. If 'learn' is set to True, updates
+        permanences of active columns
+        :param encodedInput: A binary numpy array of the input dimensions or flattened, or an SDR
+        :param learn: (default=True) Indicates whether learning should be performed and permanence values updated
+        :param asarray: (default=False) if True, returns a 1-D array of length returned by :meth:`.getWidth`.
+        :return: SDR OR 1-D array of length returned by :meth:`.getWidth`.
+        """
+
+        size = self._inputDim[0] * self._inputDim[1]
+        if isinstance(encodedInput, SDR):
+            if encodedInput.getWidth() != size:
+                raise ValueError("Input dimensions do not match. Expecting %d but got %d" % (size,
+                                                                                             encodedInput.getWidth()))
+            inputGrid = encodedInput.dense.view(bool)
+        elif isinstance(encodedInput, np.ndarray):
+            if encodedInput.size != size:
+                raise ValueError("Input dimensions do not match. Expecting %d but got %d" % (size, encodedInput.size))
+            inputGrid = encodedInput != 0
+        else:
+            raise TypeError("Input must be a numpy array or an SDR but got input of type %s" % type(encodedInput))
+
+        patches = self._inputPatches(inputGrid.reshape(self._inputDim))
+        activeCols = self._inhibit(self._overlapScores(patches))
+
+        if learn:
+            self._learn(activeCols, patches[activeCols])
+
+        columns = SDR(self._n, sparse=activeCols)
+        if asarray:
+            return columns.dense
+        else:
+            return columns
+
+    def _inputPatches(self, inputGrid):
+        """Returns the window of the input around the center of each column, as an array of shape (n, size, size)"""
+        radius = self._potentialRadius
+        windows = sliding_window_view(np.pad(inputGrid, radius), (2 * radius + 1, 2 * radius + 1))
+        return windows[np.ix_(self._centerRows, self._centerCols)].reshape(self._connected.shape)
+
+    def _overlapScores(self, patches):
+        """Returns the number of connected synapses to ON bits for each column"""
+        return np.count_nonzero(patches & self._connected, axis=(1, 2))
+
+    def _inhibit(self, overlapScores):
+        """
+        Returns the sorted indices of the columns that have fewer columns with higher overlap scores in their
+        neighborhood than the number of active columns of the neighborhood
+        """
+        radius = self._inhibitionRadius
+        keys = overlapScores.reshape(self._columnDim).astype(np.int64) * self._n + self._tieBreak
+        windows = sliding_window_view(np.pad(keys, radius, constant_values=-1), (2 * radius + 1, 2 * radius + 1))
+        numBigger = np.count_nonzero(windows > keys[:, :, np.newaxis, np.newaxis], axis=(2, 3))
+        active = (numBigger < self._numActiveLocal).reshape(-1) & (overlapScores >= self._stimulusThreshold)
+        return np.flatnonzero(active)
+
+    def _learn(self, activeCols, patches):
+        """Increments permanences of active columns' potential synapses to ON bits and decrements the others"""
+        updates = permanenceUpdates(patches, np.float32(self._activeInc), np.float32(self._inactiveDec))
+        permanences = np.clip(self._permanences[activeCols] + updates * self._potentials[activeCols], 0.0, 1.0)
+        self._permanences[activeCols] = permanences
+        self._connected[activeCols] = permanences >= self._minPermanence
+
+    def save(self, path):
+        """
+        Saves the layer and the state of numpy's random generator to a checkpoint file
+        :param path: path of the checkpoint file
+        """
+        checkpoint.saveLayer(path, self)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a layer saved by :meth:`.save` and restores the state of numpy's random generator
+        :param path: path of the checkpoint file
+        :param mmap: (default=True) if True, permanences are memory-mapped from the file
+        :return: TopologyPooler
+        """
+        return checkpoint.loadLayer(path, mmap)
+
+    def _getState(self):
+        """Returns the metadata and arrays of the layer for a checkpoint"""
+        meta = {'inputDim': self._inputDim, 'columnDim': self._columnDim, 'potentialRadius': self._potentialRadius,
+                'inhibitionRadius': self._inhibitionRadius, 'localDensity': self._localDensity,
+                'pot_pct': self._pot_pct, 'stimulusThreshold': self._stimulusThreshold,
+                'minPermanence': self._minPermanence, 'activeInc': self._activeInc, 'inactiveDec': self._inactiveDec}
+        return meta, {'permanences': self._permanences, 'potentials': self._potentials}
+
+    @classmethod
+    def _fromState(cls, meta, arrays):
+        """Constructs a layer from the metadata and arrays of a checkpoint"""
+        tp = cls.__new__(cls)
+        tp._inputDim = tuple(meta['inputDim'])
+        tp._columnDim = tuple(meta['columnDim'])
+        tp._n = int(np.prod(tp._columnDim))
+        tp._potentialRadius = meta['potentialRadius']
+        tp._inhibitionRadius = meta['inhibitionRadius']
+        tp._localDensity = meta['localDensity']
+        tp._pot_pct = meta['pot_pct']
+        tp._stimulusThreshold = meta['stimulusThreshold']
+        tp._minPermanence = meta['minPermanence']
+        tp._activeInc = meta['activeInc']
+        tp._inactiveDec = meta['inactiveDec']
+        tp._initTopology()
+        tp._permanences = arrays['permanences']
+        tp._potentials = np.asarray(arrays['potentials'])
+        tp._connected = tp._permanences >= tp._minPermanence
+        return tp
+
+    def getInputDim(self):
+        """Returns the dimensions of the 2-D input grid"""
+        return self._inputDim
+
+    def getColumnDim(self):
+        """Returns the dimensions of the 2-D column grid"""
+        return self._columnDim
+
+    def getWidth(self):
+        """Returns the number of columns in the Topology Pooler"""
+        return self._n
+
+    def getActiveIncrement(self):
+        """Returns the learning increment value for active synapse permanences"""
+        return self._activeInc
+
+    def getInactiveDecrement(self):
+        """Returns the learning decrement value for inactive synapse permanences"""
+        return self._inactiveDec
+
+    def getPermanenceThreshold(self):
+        """Returns the permanence threshold for potentially connected synapses"""
+        return self._minPermanence
+
+    def setActiveIncrement(self, activeInc):
+        """Sets the learning increment value for active synapse permanences"""
+        self._activeInc = activeInc
+
+    def setInactiveDecrement(self, inactiveDec):
+        """Sets the learning decrement value for inactive synapse permanences"""
+        self._inactiveDec = inactiveDec
+
+    def setPermanenceThreshold(self, minPermanence):
+        """Sets the permanence threshold for potentially connected synapses"""
+        self._minPermanence = minPermanence
+        self._connected = self._permanences >= minPermanence
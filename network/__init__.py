@@ -0,0 +1,3 @@
+from network.bulk import DocumentScorer, scoreDocuments
+from network.pipeline import Pipeline, readText, OUTPUTS
+from network.service import PredictionService, LatencyHistogram, generateLoad
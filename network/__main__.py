@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import json
+import sys
+from encoders.unicode import UnicodeEncoder, LOOKUP_SOURCE, LOOKUP_TABLE
+from layers.checkpoint import loadModel
+from network.service import PredictionService, generateLoad
+
+
+async def _serve(args):
+    model = loadModel(args.model)
+    service = PredictionService(UnicodeEncoder(args.lookup, args.table), model['spatialPooler'],
+                                model['temporalMemory'], model['classifier'], args.max_batch, args.max_wait)
+    server = await service.start(args.host, args.port, args.unix)
+    print('serving on %s' % (args.unix or '%s:%d' % server.sockets[0].getsockname()[:2]), flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await service.stop(server)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m network',
+                                     description="Serves next-character predictions or generates load on a service.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="serve a model saved with layers.checkpoint.saveModel")
+    serve.add_argument('model', help="path of the checkpoint with spatialPooler, temporalMemory and classifier layers")
+    serve.add_argument('--lookup', default=LOOKUP_SOURCE, help="path of the JSON character lookup of the encoder")
+    serve.add_argument('--table', default=LOOKUP_TABLE, help="path of the compiled lookup table of the encoder")
+    serve.add_argument('--host', default='127.0.0.1', help="host of the TCP socket (default: 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8765, help="port of the TCP socket (default: 8765)")
+    serve.add_argument('--unix', help="path of a Unix socket to serve on instead of TCP")
+    serve.add_argument('--max-batch', type=int, default=256, help="maximum steps of a micro-batch (default: 256)")
+    serve.add_argument('--max-wait', type=float, default=0.002,
+                       help="maximum seconds a step waits for its micro-batch (default: 0.002)")
+
+    load = commands.add_parser('load', help="measure the throughput of a running service")
+    load.add_argument('--host', default='127.0.0.1', help="host of the TCP socket (default: 127.0.0.1)")
+    load.add_argument('--port', type=int, default=8765, help="port of the TCP socket (default: 8765)")
+    load.add_argument('--unix', help="path of a Unix socket to connect to instead of TCP")
+    load.add_argument('--connections', type=int, default=16, help="concurrent connections (default: 16)")
+    load.add_argument('--requests', type=int, default=100, help="requests per connection (default: 100)")
+    load.add_argument('--chars', type=int, default=1, help="characters per request (default: 1)")
+    load.add_argument('--text', help="path of a text file the connections send (default: a pangram)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.text:
+        with open(args.text, 'r', encoding='utf-8') as fi:
+            texts = [fi.read()]
+    else:
+        texts = ["The quick brown fox jumps over the lazy dog. "]
+    stats = asyncio.run(generateLoad(texts, args.host, args.port, args.unix, args.connections, args.requests,
+                                     args.chars))
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
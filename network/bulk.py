@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+from layers.checkpoint import saveModel, loadModel
+
+# state of a scoring worker process, set by _initWorker
+_scorer = None
+
+
+class DocumentScorer:
+    """
+    Scores text documents with a trained encoder, Spatial Pooler, Temporal Memory and classifier
+    stack without learning. Every document is scored as an independent sequence.
+    """
+
+    def __init__(self, encoder, spatialPooler, temporalMemory, classifier):
+        """
+        Constructs a document scorer
+        :param encoder: encoder providing encodeBatch, such as :class:`encoders.unicode.UnicodeEncoder`
+        :param spatialPooler: trained :class:`layers.spatial_pooler.SpatialPooler`
+        :param temporalMemory: trained :class:`layers.temporal_memory.TemporalMemory`
+        :param classifier: trained :class:`layers.feed_forward_classifier.FeedForwardClassifier` taking
+            the active cells of the Temporal Memory
+        """
+        self._encoder = encoder
+        self._spatialPooler = spatialPooler
+        self._temporalMemory = temporalMemory
+        self._classifier = classifier
+
+    def score(self, document):
+        """
+        Returns the most likely next character and its probability after each character of document
+        :param document: (str) text to score
+        :return: list of tuples of label and probability
+        """
+        self._temporalMemory.reset()
+        self._classifier.reset()
+
+        offsets, bits = self._encoder.encodeBatch(document)
+        activeColumns = self._spatialPooler.compute_batch(np.split(bits, offsets[1:-1]) if len(document) else [])
+
+        predictions = []
+        for columns in activeColumns:
+            activeCells, _ = self._temporalMemory.compute(columns, learn=False)
+            labels, probabilities = self._classifier.infer(activeCells)
+            best = int(np.argmax(probabilities))
+            predictions.append((labels[best], float(probabilities[best])))
+        return predictions
+
+
+def _initWorker(path, encoder):
+    """Loads the learned state of the stack in a worker process"""
+    global _scorer
+    model = loadModel(path)
+    _scorer = DocumentScorer(encoder, model['spatialPooler'], model['temporalMemory'], model['classifier'])
+
+
+def _scoreDocument(document):
+    """Scores a document in a worker process"""
+    return _scorer.score(document)
+
+
+def scoreDocuments(encoder, spatialPooler, temporalMemory, classifier, documents, processes=None, chunksize=1):
+    """
+    Scores independent text documents in a pool of worker processes and yields the results in the order
+    of documents. The learned state is written once to a checkpoint that every worker memory-maps, so the
+    workers share its pages; each worker keeps its own activation state.
+    :param encoder: encoder providing encodeBatch, such as :class:`encoders.unicode.UnicodeEncoder`
+    :param spatialPooler: trained :class:`layers.spatial_pooler.SpatialPooler`
+    :param temporalMemory: trained :class:`layers.temporal_memory.TemporalMemory` using Connections
+    :param classifier: trained :class:`layers.feed_forward_classifier.FeedForwardClassifier`
+    :param documents: iterable of strings; consumed lazily
+    :param processes: (default=None) number of worker processes; None uses the number of CPUs
+    :param chunksize: (default=1) number of documents sent to a worker at a time
+    :return: generator of lists of tuples of label and probability, see :meth:`.DocumentScorer.score`
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'model.ckpt')
+        saveModel(path, {'spatialPooler': spatialPooler, 'temporalMemory': temporalMemory,
+                         'classifier': classifier})
+        with multiprocessing.Pool(processes, initializer=_initWorker, initargs=(path, encoder)) as pool:
+            for result in pool.imap(_scoreDocument, documents, chunksize):
+                yield result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,140 @@
+import io
+import numpy as np
+from sdr import SDR
+
+# outputs a pipeline can produce at each step, see Pipeline.run
+OUTPUTS = ('columns', 'cells', 'anomaly', 'prediction')
+
+
+def readText(path, chunkSize=1 << 16, encoding='utf-8'):
+    """
+    Reads a text file in chunks, so a large file can be streamed through a :class:`.Pipeline` without
+    loading it into memory
+    :param path: path of the text file
+    :param chunkSize: (default=65536) maximum number of characters of each chunk
+    :param encoding: (default='utf-8') encoding of the file
+    :return: generator of strings
+    """
+    with io.open(path, 'r', encoding=encoding) as fi:
+        while True:
+            chunk = fi.read(chunkSize)
+            if not chunk:
+                return
+            yield chunk
+
+
+class Pipeline:
+    """
+    Chains an encoder, a Spatial Pooler, a Temporal Memory and a classifier and streams inputs through
+    them one step at a time. Only the stages needed for the requested outputs run: a pipeline asked for
+    active columns does not run the Temporal Memory or the classifier, neither to infer nor to learn.
+
+    Strings are pooled a chunk at a time: the encoder encodes the whole chunk in one call and the
+    Spatial Pooler pools the chunk with :meth:`layers.spatial_pooler.SpatialPooler.compute_batch` from
+    the offsets and bits of the encoding, without per-character lists. The encoded bits and the active
+    columns of a chunk are written into buffers kept by the pipeline and reused by the next chunks; the
+    buffers grow when a chunk does not fit.
+    """
+
+    def __init__(self, encoder, spatialPooler, temporalMemory=None, classifier=None):
+        """
+        Constructs a pipeline
+        :param encoder: encoder providing encode and encodeBatch, such as :class:`encoders.unicode.UnicodeEncoder`
+        :param spatialPooler: :class:`layers.spatial_pooler.SpatialPooler` or other pooler providing compute
+        :param temporalMemory: (default=None) :class:`layers.temporal_memory.TemporalMemory`
+        :param classifier: (default=None) :class:`layers.feed_forward_classifier.FeedForwardClassifier` or
+            :class:`layers.classifier.Classifier` taking the active cells of the Temporal Memory and
+            learning each input as the label of the active cells of the step before. A classifier with step
+            offsets keeps that history itself; the pipeline records the previous active cells for others.
+        """
+        self._encoder = encoder
+        self._spatialPooler = spatialPooler
+        self._temporalMemory = temporalMemory
+        self._classifier = classifier
+        # buffers of the encoded bits and of the active columns of a chunk, reused between chunks
+        self._bits = None
+        self._activeColumns = None
+        # active cells of the previous step, recorded with the current input by classifiers without step offsets
+        self._previousCells = None
+
+    def run(self, inputs, learn=True, outputs=('prediction',)):
+        """
+        Streams inputs through the pipeline and yields the requested outputs of each step. Inputs are read
+        lazily, so inputs can be a generator such as :func:`.readText`.
+        :param inputs: iterable of inputs; strings are split into their characters, one step each
+        :param learn: (default=True) if True, the stages that run learn from each step
+        :param outputs: (default=('prediction',)) names of the outputs of each step, see OUTPUTS:
+            'columns' the SDR of active columns, 'cells' the SDR of active cells, 'anomaly' the fraction
+            of active columns that were not predicted and 'prediction' a tuple of the most probable next
+            input and its probability
+        :return: generator of dicts with the input under 'input' and each requested output
+        """
+        for name in outputs:
+            if name not in OUTPUTS:
+                raise ValueError("Unknown output %s. Expecting one of %s" % (name, ', '.join(OUTPUTS)))
+        useTemporalMemory = any(name in outputs for name in ('cells', 'anomaly', 'prediction'))
+        useClassifier = 'prediction' in outputs
+        if useTemporalMemory and self._temporalMemory is None:
+            raise ValueError("Outputs %s need a Temporal Memory" % ', '.join(outputs))
+        if useClassifier and self._classifier is None:
+            raise ValueError("Output prediction needs a classifier")
+
+        for chunk in inputs:
+            if isinstance(chunk, str):
+                steps = zip(chunk, self._poolChunk(chunk, learn, copy='columns' in outputs))
+            else:
+                steps = [(chunk, self._spatialPooler.compute(self._encoder.encode(chunk), learn))]
+
+            for inputData, activeColumns in steps:
+                result = {'input': inputData}
+                if 'columns' in outputs:
+                    result['columns'] = activeColumns
+                if useTemporalMemory:
+                    if 'anomaly' in outputs:
+                        activeCells, _, result['anomaly'] = self._temporalMemory.compute(activeColumns, learn,
+                                                                                         anomaly=True)
+                    else:
+                        activeCells, _ = self._temporalMemory.compute(activeColumns, learn)
+                    if 'cells' in outputs:
+                        result['cells'] = activeCells
+                    if useClassifier:
+                        if learn:
+                            if hasattr(self._classifier, 'getSteps'):
+                                self._classifier.record(inputData, activeCells)
+                            elif self._previousCells is not None:
+                                self._classifier.record(inputData, self._previousCells)
+                        self._previousCells = activeCells
+                        labels, probabilities = self._classifier.infer(activeCells)
+                        if len(labels):
+                            best = int(np.argmax(probabilities))
+                            result['prediction'] = (labels[best], float(probabilities[best]))
+                        else:
+                            result['prediction'] = (None, 0.0)
+                yield result
+
+    def _poolChunk(self, chunk, learn, copy):
+        """
+        Returns the SDRs of active columns of each character of chunk
+        :param copy: if True, the SDRs are copied out of the buffer of active columns so they can be kept
+            after the next chunk is pooled
+        """
+        if not hasattr(self._spatialPooler, 'compute_batch'):
+            return [self._spatialPooler.compute(self._encoder.encode(char), learn) for char in chunk]
+        offsets, bits = self._encoder.encodeBatch(chunk, out=self._bits)
+        self._bits = bits.base if bits.base is not None else bits
+        out = None
+        if self._activeColumns is not None and len(self._activeColumns) >= len(chunk):
+            out = self._activeColumns[:len(chunk)]
+        activeColumns = self._spatialPooler.compute_batch((offsets, bits), learn, out=out)
+        if out is None:
+            self._activeColumns = activeColumns
+        width = self._spatialPooler.getWidth()
+        return (SDR(width, sparse=columns.copy() if copy else columns) for columns in activeColumns)
+
+    def reset(self):
+        """Starts a new sequence in the Temporal Memory and the classifier"""
+        if self._temporalMemory is not None:
+            self._temporalMemory.reset()
+        self._previousCells = None
+        if self._classifier is not None and hasattr(self._classifier, 'reset'):
+            self._classifier.reset()
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import time
+import numpy as np
+
+# upper bounds in seconds of the latency histogram buckets: 10us doubling up to about 84s
+LATENCY_BUCKETS = 1e-5 * 2.0 ** np.arange(24)
+
+
+class LatencyHistogram:
+    """Counts latencies in buckets of doubling width, see LATENCY_BUCKETS"""
+
+    def __init__(self):
+        # the last bucket counts latencies above the largest bound
+        self._counts = np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64)
+        self._total = 0.0
+
+    def record(self, seconds):
+        """Adds a latency in seconds"""
+        self._counts[np.searchsorted(LATENCY_BUCKETS, seconds)] += 1
+        self._total += seconds
+
+    def percentile(self, q):
+        """Returns the upper bound in seconds of the bucket holding the q-th percentile, or None if empty"""
+        count = int(np.sum(self._counts))
+        if not count:
+            return None
+        bucket = int(np.searchsorted(np.cumsum(self._counts), q / 100.0 * count))
+        return float(LATENCY_BUCKETS[min(bucket, len(LATENCY_BUCKETS) - 1)])
+
+    def getStats(self):
+        """
+        Returns the number of latencies, their mean and percentiles in seconds and the counts of the
+        non-empty buckets by upper bound
+        """
+        count = int(np.sum(self._counts))
+        buckets = {('%g' % bound if i < len(LATENCY_BUCKETS) else 'inf'): int(n)
+                   for i, (bound, n) in enumerate(zip(list(LATENCY_BUCKETS) + [np.inf], self._counts)) if n}
+        return {'count': count, 'mean': self._total / count if count else None,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'buckets': buckets}
+
+
+class PredictionService:
+    """
+    Serves next-character predictions of a trained encoder, Spatial Pooler, Temporal Memory and
+    classifier stack to many clients over a TCP or Unix socket. Each connection is an input stream
+    with its own :class:`layers.temporal_memory.StreamState`; the learned state is shared and not
+    adapted.
+
+    The steps pending on all connections are collected into micro-batches: a batch runs as soon as it
+    holds maxBatchSize steps or maxWait seconds after its first step arrived. A batch is encoded in one
+    call, pooled with :meth:`layers.spatial_pooler.SpatialPooler.compute_batch`, advanced with
+    :meth:`layers.temporal_memory.TemporalMemory.compute_streams` and classified with
+    :meth:`layers.feed_forward_classifier.FeedForwardClassifier.infer_batch`, in a worker thread so
+    the event loop keeps serving connections.
+
+    The protocol is one JSON object per line. A request {"text": "..."} advances the stream of the
+    connection by each character of the text and is answered with {"predictions": [[label, probability],
+    ...]}, one pair per character. {"reset": true} starts a new sequence and {"stats": true} returns
+    the statistics of :meth:`.getStats`.
+    """
+
+    def __init__(self, encoder, spatialPooler, temporalMemory, classifier, maxBatchSize=256, maxWait=0.002):
+        """
+        Constructs a prediction service
+        :param encoder: encoder providing encodeBatch, such as :class:`encoders.unicode.UnicodeEncoder`
+        :param spatialPooler: trained :class:`layers.spatial_pooler.SpatialPooler`
+        :param temporalMemory: trained :class:`layers.temporal_memory.TemporalMemory` using Connections
+        :param classifier: trained :class:`layers.feed_forward_classifier.FeedForwardClassifier` taking
+            the active cells of the Temporal Memory
+        :param maxBatchSize: (default=256) maximum number of steps of a micro-batch
+        :param maxWait: (default=0.002) maximum time in seconds a step waits for its micro-batch to fill
+        """
+        if maxBatchSize < 1:
+            raise ValueError("Maximum batch size must be greater than 0")
+        if maxWait < 0:
+            raise ValueError("Maximum wait time must not be negative")
+
+        self._encoder = encoder
+        self._spatialPooler = spatialPooler
+        self._temporalMemory = temporalMemory
+        self._classifier = classifier
+        self._maxBatchSize = maxBatchSize
+        self._maxWait = maxWait
+        self._queue = None
+        self._batcher = None
+        # steps taken from the queue by the batcher and not resolved yet
+        self._batch = []
+        self._requestLatency = LatencyHistogram()
+        self._batchLatency = LatencyHistogram()
+        self._batchSizes = np.zeros(maxBatchSize + 1, dtype=np.int64)
+        self._connections = 0
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """
+        Starts serving on a TCP socket, or on a Unix socket if path is given
+        :param host: (default='127.0.0.1') host of the TCP socket
+        :param port: (default=0) port of the TCP socket; 0 picks a free port
+        :param path: (default=None) path of the Unix socket
+        :return: asyncio.Server
+        """
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._runBatches())
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle, path)
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self, server):
+        """Stops server and the micro-batching; the steps waiting for a micro-batch fail with a RuntimeError"""
+        server.close()
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+            pending = self._batch + [self._queue.get_nowait() for _ in range(self._queue.qsize())]
+            self._batch = []
+            self._failSteps(pending, RuntimeError("Prediction service stopped"))
+        await server.wait_closed()
+
+    def getStats(self):
+        """
+        Returns the statistics of the service: the open connections, the latency histograms of requests
+        and batches and the number of batches and steps and mean batch size
+        :return: dict
+        """
+        batches = int(np.sum(self._batchSizes))
+        steps = int(np.dot(self._batchSizes, np.arange(len(self._batchSizes))))
+        return {'connections': self._connections, 'batches': batches, 'steps': steps,
+                'meanBatchSize': steps / batches if batches else None,
+                'requestLatency': self._requestLatency.getStats(), 'batchLatency': self._batchLatency.getStats()}
+
+    async def _handle(self, reader, writer):
+        """Serves the requests of a connection in order"""
+        self._connections += 1
+        stream = self._temporalMemory.createStream()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    if request.get('reset'):
+                        stream = self._temporalMemory.createStream()
+                        response = {'reset': True}
+                    elif request.get('stats'):
+                        response = self.getStats()
+                    else:
+                        text = request['text']
+                        if not isinstance(text, str):
+                            raise TypeError("Expected a string but got text of type %s" % type(text))
+                        predictions = []
+                        for char in text:
+                            future = asyncio.get_running_loop().create_future()
+                            await self._queue.put((stream, char, future))
+                            predictions.append(await future)
+                        response = {'predictions': predictions}
+                        self._requestLatency.record(time.perf_counter() - start)
+                except Exception as error:  # reported to the client; the connection stays open
+                    response = {'error': '%s: %s' % (type(error).__name__, error)}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    async def _runBatches(self):
+        """Collects pending steps into micro-batches and runs them in a worker thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self._maxWait
+            while len(batch) < self._maxBatchSize:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.perf_counter()
+            try:
+                predictions = await loop.run_in_executor(None, self._runBatch, [step[0] for step in batch],
+                                                         ''.join(step[1] for step in batch))
+            except Exception as error:
+                self._batch = []
+                self._failSteps(batch, error)
+                continue
+            self._batch = []
+            self._batchLatency.record(time.perf_counter() - start)
+            self._batchSizes[len(batch)] += 1
+            for (_, _, future), prediction in zip(batch, predictions):
+                if not future.done():  # the request may have been cancelled while the batch ran
+                    future.set_result(prediction)
+
+    @staticmethod
+    def _failSteps(steps, error):
+        """Sets error on the futures of steps that are not done yet"""
+        for _, _, future in steps:
+            if not future.done():
+                future.set_exception(error)
+
+    def _runBatch(self, streams, chars):
+        """Advances each stream by one character and returns the most likely next character of each"""
+        offsets, bits = self._encoder.encodeBatch(chars)
+        activeColumns = self._spatialPooler.compute_batch(np.split(bits, offsets[1:-1]))
+        results = self._temporalMemory.compute_streams(streams, list(activeColumns))
+        labels, probabilities = self._classifier.infer_batch([activeCells for activeCells, _ in results])
+        if not len(labels):
+            return [[None, 0.0]] * len(streams)
+        best = np.argmax(probabilities, axis=1)
+        return [[labels[label], float(probabilities[k, label])] for k, label in enumerate(best.tolist())]
+
+
+async def _openConnection(host, port, path):
+    """Opens a connection to a prediction service"""
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+async def generateLoad(texts, host='127.0.0.1', port=None, path=None, connections=16, requestsPerConnection=100,
+                       charsPerRequest=1):
+    """
+    Measures the throughput of a prediction service with concurrent client connections. Each connection
+    sends requestsPerConnection requests of charsPerRequest characters, reading its text in order and
+    waiting for each response before sending the next request.
+    :param texts: list of strings; connection i sends texts[i % len(texts)] repeated
+    :param host: (default='127.0.0.1') host of the TCP socket of the service
+    :param port: (default=None) port of the TCP socket of the service
+    :param path: (default=None) path of the Unix socket of the service, used instead of host and port
+    :param connections: (default=16) number of concurrent connections
+    :param requestsPerConnection: (default=100) number of requests sent by each connection
+    :param charsPerRequest: (default=1) number of characters of each request
+    :return: dict with the number of requests and characters, elapsed seconds, requests and characters
+        per second and the client-side latency histogram
+    """
+    latency = LatencyHistogram()
+
+    async def client(text):
+        reader, writer = await _openConnection(host, port, path)
+        try:
+            length = requestsPerConnection * charsPerRequest
+            text = (text * (length // max(len(text), 1) + 1))[:length]
+            for i in range(requestsPerConnection):
+                chunk = text[i * charsPerRequest:(i + 1) * charsPerRequest]
+                start = time.perf_counter()
+                writer.write(json.dumps({'text': chunk}).encode('utf-8') + b'\n')
+                await writer.drain()
+                response = json.loads(await reader.readline())
+                if 'error' in response:
+                    raise RuntimeError(response['error'])
+                latency.record(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(texts[i % len(texts)]) for i in range(connections)])
+    elapsed = time.perf_counter() - start
+    requests = connections * requestsPerConnection
+    return {'requests': requests, 'chars': requests * charsPerRequest, 'seconds': elapsed,
+            'requestsPerSecond': requests / elapsed, 'charsPerSecond': requests * charsPerRequest / elapsed,
+            'latency': latency.getStats()}
@@ -0,0 +1 @@
+from sdr.sdr import SDR
@@ -0,0 +1,123 @@
+import numpy as np
+
+
+class SDR(object):
+    """
+    A sparse distributed representation of fixed width. The ON bits can be read as sorted indices,
+    as a dense 0/1 array or as a bit-packed array. Each form is computed on first use from the form
+    the SDR was created with and then cached, so an SDR can be passed between layers without repeated
+    conversions. The cached arrays are shared and must not be modified.
+
+    For compatibility with layers that exchange lists of indices, an SDR behaves like the sequence of
+    its ON bit indices: len() is the number of ON bits, iteration and indexing yield indices and numpy
+    converts it to the index array.
+    """
+
+    def __init__(self, size, sparse=None, dense=None, packed=None):
+        """
+        Constructs an SDR from exactly one of its forms
+        :param size: (int) width of the representation
+        :param sparse: (array-like) indices of ON bits
+        :param dense: (array-like) 1-D array of length size, nonzero for ON bits
+        :param packed: (numpy array) dense form packed with numpy.packbits
+        """
+        if sum(value is not None for value in (sparse, dense, packed)) != 1:
+            raise ValueError("Expected exactly one of sparse, dense or packed")
+
+        self._size = size
+        self._sparse = None
+        self._dense = None
+        self._packed = None
+
+        if sparse is not None:
+            sparse = np.asarray(sparse, dtype=np.int64).reshape(-1)
+            if len(sparse) > 1 and np.any(sparse[1:] <= sparse[:-1]):
+                sparse = np.unique(sparse)
+            if len(sparse) and (sparse[0] < 0 or sparse[-1] >= size):
+                raise ValueError("Indices out of range. Expecting indices between 0 and %d" % (size - 1))
+            self._sparse = sparse
+        elif dense is not None:
+            dense = np.asarray(dense).reshape(-1)
+            if dense.size != size:
+                raise ValueError("Dense dimensions do not match. Expecting %d but got %d" % (size, dense.size))
+            self._dense = dense if dense.dtype == np.int8 else (dense != 0).astype(np.int8)
+        else:
+            self._packed = np.asarray(packed, dtype=np.uint8)
+
+    @staticmethod
+    def convert(value, size):
+        """
+        Returns value as an SDR of width size
+        :param value: an SDR, or a list or array of indices of ON bits
+        :param size: (int) width of the representation
+        :return: SDR
+        """
+        if isinstance(value, SDR):
+            if value.getWidth() != size:
+                raise ValueError("SDR dimensions do not match. Expecting %d but got %d" % (size, value.getWidth()))
+            return value
+        return SDR(size, sparse=value)
+
+    @property
+    def sparse(self):
+        """Sorted numpy array of indices of ON bits"""
+        if self._sparse is None:
+            self._sparse = np.flatnonzero(self.dense)
+        return self._sparse
+
+    @property
+    def dense(self):
+        """Numpy int8 array of length returned by :meth:`.getWidth` with ON bits set to 1"""
+        if self._dense is None:
+            if self._sparse is not None:
+                self._dense = np.zeros(self._size, dtype=np.int8)
+                self._dense[self._sparse] = 1
+            else:
+                self._dense = np.unpackbits(self._packed, count=self._size).view(np.int8)
+        return self._dense
+
+    @property
+    def packed(self):
+        """Numpy uint8 array of the dense form packed with numpy.packbits"""
+        if self._packed is None:
+            self._packed = np.packbits(self.dense)
+        return self._packed
+
+    def getWidth(self):
+        """Returns the width of the representation"""
+        return self._size
+
+    def tolist(self):
+        """Returns the indices of ON bits as a list of integers"""
+        return self.sparse.tolist()
+
+    def __len__(self):
+        return len(self.sparse)
+
+    def __iter__(self):
+        return iter(self.sparse.tolist())
+
+    def __getitem__(self, item):
+        return self.sparse[item]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.sparse.copy() if copy else self.sparse
+        return self.sparse.astype(dtype)
+
+    def __eq__(self, other):
+        if isinstance(other, SDR):
+            return self._size == other._size and np.array_equal(self.sparse, other.sparse)
+        try:
+            return self.tolist() == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "SDR(%d, %s)" % (self._size, self.tolist())
@@ -0,0 +1,31 @@
+import os
+import tempfile
+from layers.classifier import Classifier
+
+
+def test_record_after_loading_empty_classifier():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'classifier.ckpt')
+        Classifier(32, 0.1).save(path)
+        classifier = Classifier.load(path)
+    for label in 'abcde':
+        classifier.record(label, [1, 2, 3])
+    labels, probabilities = classifier.infer([1, 2, 3])
+    assert sorted(labels) == list('abcde')
+    assert len(classifier._counts) >= 5
+
+
+def test_counts_do_not_overflow_after_reaching_max_times_seen():
+    classifier = Classifier(8, 1.0 / 254)
+    maxTimesSeen = classifier._maxTimesSeen
+    for _ in range(maxTimesSeen - 1):
+        classifier.record('a', [2, 5])
+    # column 5 reaches maxTimesSeen first, then column 2 goes past it while 5 stays at the cap
+    classifier.record('a', [5])
+    for _ in range(4):
+        classifier.record('a', [2])
+        counts = classifier._counts[0]
+        assert counts[2] >= counts[5] == maxTimesSeen
+    assert classifier._columnLabels[2] == classifier._columnLabels[5] == {0}
+    labels, probabilities = classifier.infer([2, 5])
+    assert labels == ['a']
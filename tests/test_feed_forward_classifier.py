@@ -0,0 +1,23 @@
+import numpy as np
+from layers.feed_forward_classifier import FeedForwardClassifier
+
+
+def test_record_more_labels_than_step_offsets():
+    np.random.seed(0)
+    classifier = FeedForwardClassifier(64, 0.1, steps=(1, 2, 3, 4, 5, 6))
+    for t in range(40):
+        classifier.record(t, [t % 64, (3 * t) % 64])
+    labels, probabilities = classifier.infer([0, 1])
+    assert len(labels) == 40
+    assert classifier._weights.shape[0] == 6
+    assert classifier._weights.shape[1] == 64
+
+
+def test_weights_grow_geometrically():
+    np.random.seed(0)
+    classifier = FeedForwardClassifier(16, 0.1)
+    capacities = set()
+    for t in range(201):
+        classifier.record(t, [t % 16])
+        capacities.add(classifier._weights.shape[1])
+    assert capacities == {4, 8, 16, 32, 64, 128, 256}
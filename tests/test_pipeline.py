@@ -0,0 +1,29 @@
+import json
+import os
+import numpy as np
+import pytest
+from encoders.unicode import UnicodeEncoder
+from layers import SpatialPooler, TemporalMemory, Connections, FeedForwardClassifier
+from layers.classifier import Classifier
+from network import Pipeline
+
+
+def makePipeline(directory, classifierClass):
+    rng = np.random.RandomState(0)
+    lookup = {str(ord(char)): sorted(rng.choice(2048, 37, replace=False).tolist()) for char in 'abcde'}
+    sourcePath = os.path.join(str(directory), 'chars.json')
+    with open(sourcePath, 'w') as fo:
+        json.dump(lookup, fo)
+    encoder = UnicodeEncoder(sourcePath, os.path.join(str(directory), 'chars.bin'))
+    temporalMemory = TemporalMemory(Connections, 256, 4, 16, 32, 5, 7, 0.5, 0.55, 10, 0.1, 0.05, seed=2)
+    return Pipeline(encoder, SpatialPooler(encoder.getWidth(), 256, 20, seed=1, sparse=True), temporalMemory,
+                    classifierClass(temporalMemory.getWidth(), 0.1))
+
+
+@pytest.mark.parametrize('classifierClass', [Classifier, FeedForwardClassifier])
+def test_prediction_is_next_input(tmp_path, classifierClass):
+    pipeline = makePipeline(tmp_path, classifierClass)
+    text = 'abcde' * 40
+    results = list(pipeline.run([text]))
+    predictions = [result['prediction'][0] for result in results[-10:]]
+    assert predictions == list(text[-9:] + 'a')
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from layers import SpatialPooler
+
+
+def makeInputs(numInputs, inputDim=256, numBits=20, seed=0):
+    """Returns random inputs as lists of ON bits and as the offsets and bits arrays of encodeBatch"""
+    rng = np.random.RandomState(seed)
+    bits = [np.sort(rng.choice(inputDim, numBits, replace=False)) for _ in range(numInputs)]
+    offsets = np.arange(numInputs + 1, dtype=np.int64) * numBits
+    return bits, (offsets, np.concatenate(bits))
+
+
+def computeEach(sp, bits, learn):
+    return np.array([sp.computeBits(b, learn).sparse for b in bits])
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+@pytest.mark.parametrize('form', ['lists', 'offsets'])
+def test_compute_batch_matches_compute(sparse, form):
+    sp = SpatialPooler(256, 128, 8, seed=1, sparse=sparse)
+    bits, encoded = makeInputs(40)
+    inputs = bits if form == 'lists' else encoded
+    expected = computeEach(sp, bits, learn=False)
+    assert np.array_equal(sp.compute_batch(inputs), expected)
+    dense = np.zeros((len(bits), 256), dtype=np.int8)
+    for t, b in enumerate(bits):
+        dense[t, b] = 1
+    assert np.array_equal(sp.compute_batch(dense), expected)
+
+    # learning updates the connected synapses cached by the batch path
+    reference = SpatialPooler(256, 128, 8, seed=1, sparse=sparse)
+    assert np.array_equal(sp.compute_batch(inputs, learn=True), computeEach(reference, bits, learn=True))
+    assert np.array_equal(sp.compute_batch(inputs), computeEach(reference, bits, learn=False))
+
+    sp.setPermanenceThreshold(0.3)
+    reference.setPermanenceThreshold(0.3)
+    out = np.zeros((len(bits), 8), dtype=np.int64)
+    assert sp.compute_batch(inputs, out=out) is out
+    assert np.array_equal(out, computeEach(reference, bits, learn=False))
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from layers import TemporalMemory, BasicTMCell, Connections
+
+
+def runSequences(tm_cell, maxSegmentsPerCell, maxSynapsesPerSegment, initialPermanence=0.55, permanenceDec=0.05,
+                 compaction=(None,), seed=1):
+    """
+    Returns the active, predictive and winner cells of each step of a seeded run over repeated sequences,
+    with noise replacing some of the sequences
+    """
+    tm = TemporalMemory(tm_cell, 32, 3, maxSegmentsPerCell, maxSynapsesPerSegment, 2, 3, 0.5, initialPermanence, 6,
+                        0.1, permanenceDec, seed=seed)
+    tm.setCompactionInterval(*compaction)
+    rng = np.random.RandomState(seed)
+    sequences = [sorted(rng.choice(32, 8, replace=False)) for _ in range(6)]
+    steps = []
+    for repeat in range(20):
+        for k, columns in enumerate(sequences):
+            if repeat % 3 == 2 and k % 2 == 0:
+                columns = sorted(rng.choice(32, 8, replace=False))
+            activeCells, predictiveCells = tm.compute(columns, learn=True)
+            steps.append((np.asarray(activeCells).tolist(), np.asarray(predictiveCells).tolist(),
+                          np.asarray(tm.getWinnerCells()).tolist()))
+    return steps
+
+
+@pytest.mark.parametrize('maxSegmentsPerCell, maxSynapsesPerSegment', [(32, 32), (2, 4)])
+def test_connections_match_basic_cells(maxSegmentsPerCell, maxSynapsesPerSegment):
+    expected = runSequences(BasicTMCell, maxSegmentsPerCell, maxSynapsesPerSegment)
+    assert any(predictiveCells for _, predictiveCells, _ in expected)
+    steps = runSequences(Connections, maxSegmentsPerCell, maxSynapsesPerSegment)
+    for step, (cells, expectedCells) in enumerate(zip(steps, expected)):
+        assert cells == expectedCells, "step %d" % step
+
+
+@pytest.mark.parametrize('maxSegments', [None, 2])
+def test_compacted_connections_match_basic_cells(maxSegments):
+    reports = []
+    expected = runSequences(BasicTMCell, 4, 8, 0.3, 0.3)
+    steps = runSequences(Connections, 4, 8, 0.3, 0.3, (5, lambda layer, report: reports.append(report), maxSegments))
+    assert sum(report['slotsReclaimed'] for report in reports) > 0
+    for step, (cells, expectedCells) in enumerate(zip(steps, expected)):
+        assert cells == expectedCells, "step %d" % step
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_sharded_layer_continues_after_loading(tmp_path, workers):
+    rng = np.random.RandomState(0)
+    sequences = [sorted(rng.choice(64, 8, replace=False)) for _ in range(6)]
+    path = str(tmp_path / 'tm.ckpt')
+    with TemporalMemory(Connections, 64, 4, 8, 16, 2, 3, 0.5, 0.55, 6, 0.1, 0.05, seed=3, shards=3,
+                        workers=workers) as tm:
+        for t in range(60):
+            tm.compute(sequences[t % 6])
+        tm.save(path)
+        with TemporalMemory.load(path) as loaded:
+            for t in range(60, 90):
+                columns = sequences[t % 6] if t % 5 else sorted(rng.choice(64, 8, replace=False))
+                activeCells, predictiveCells = tm.compute(columns)
+                loadedCells, loadedPredictiveCells = loaded.compute(columns)
+                assert activeCells.sparse.tolist() == loadedCells.sparse.tolist(), "step %d" % t
+                assert predictiveCells.sparse.tolist() == loadedPredictiveCells.sparse.tolist(), "step %d" % t
+                assert np.array_equal(tm.getWinnerCells(), loaded.getWinnerCells()), "step %d" % t
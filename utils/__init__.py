@@ -0,0 +1,2 @@
+from utils.arrays import concatenateRanges
+from utils.files import writeCheckpoint, readCheckpoint
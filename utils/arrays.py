@@ -0,0 +1,8 @@
+import numpy as np
+
+
+def concatenateRanges(starts, stops):
+    """Returns the concatenation of the integer ranges [starts[i], stops[i])"""
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(len(offsets))
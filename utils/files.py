@@ -0,0 +1,76 @@
+import json
+import os
+import numpy as np
+
+# Checkpoint file layout:
+#   magic (8 bytes) | format version (uint32) | header size (uint64) | JSON header | arrays
+# The JSON header holds the metadata and, for every array, its dtype, shape and byte offset.
+# Arrays are stored raw in C order and aligned so they can be memory-mapped directly.
+MAGIC = b'CAMICKPT'
+FORMAT_VERSION = 1
+_ALIGNMENT = 64
+_PREFIX_SIZE = len(MAGIC) + 4 + 8
+
+
+def writeCheckpoint(path, meta, arrays):
+    """
+    Writes metadata and numpy arrays to a checkpoint file. The file is written next to path and
+    moved into place once complete, so readers never see a partial checkpoint.
+    :param path: path of the checkpoint file
+    :param meta: (dict) JSON serializable metadata
+    :param arrays: (dict) numpy arrays by name
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        table[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+
+    header = json.dumps({'meta': meta, 'arrays': table}).encode('utf-8')
+    dataStart = -(-(_PREFIX_SIZE + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    tempPath = '%s.tmp%d' % (path, os.getpid())
+    with open(tempPath, 'wb') as fo:
+        fo.write(MAGIC)
+        fo.write(np.uint32(FORMAT_VERSION).tobytes())
+        fo.write(np.uint64(len(header)).tobytes())
+        fo.write(header)
+        for name, array in arrays.items():
+            fo.write(b'\0' * (dataStart + table[name]['offset'] - fo.tell()))
+            fo.write(array.tobytes())
+    os.replace(tempPath, path)
+
+
+def readCheckpoint(path, mmap=True):
+    """
+    Reads a checkpoint file written by :func:`.writeCheckpoint`
+    :param path: path of the checkpoint file
+    :param mmap: (default=True) if True, arrays are copy-on-write memory maps of the file, so loading
+        reads no array data and processes loading the same file share its pages until they write
+    :return: tuple of metadata dict and dict of numpy arrays by name
+    """
+    with open(path, 'rb') as fi:
+        prefix = fi.read(_PREFIX_SIZE)
+        if len(prefix) != _PREFIX_SIZE or prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a checkpoint file" % path)
+        version = int(np.frombuffer(prefix, dtype=np.uint32, count=1, offset=len(MAGIC))[0])
+        if version > FORMAT_VERSION:
+            raise ValueError("Unsupported checkpoint version %d. Expecting version %d or lower" %
+                             (version, FORMAT_VERSION))
+        headerSize = int(np.frombuffer(prefix, dtype=np.uint64, count=1, offset=len(MAGIC) + 4)[0])
+        header = json.loads(fi.read(headerSize).decode('utf-8'))
+        dataStart = -(-(_PREFIX_SIZE + headerSize) // _ALIGNMENT) * _ALIGNMENT
+
+        arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            shape = tuple(entry['shape'])
+            if mmap and int(np.prod(shape)):
+                arrays[name] = np.memmap(path, dtype=dtype, mode='c', offset=dataStart + entry['offset'], shape=shape)
+            else:
+                fi.seek(dataStart + entry['offset'])
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(fi, dtype=dtype, count=count).reshape(shape)
+    return header['meta'], arrays